@@ -0,0 +1,91 @@
+"""Cost of an instrument read with a session per phase and with the pool.
+
+Every phase of a test used to stand for its own instrument session; the
+pool of ``station.instruments`` opens each session once. The simulated
+instruments sleep for the open and I/O latency given on the command line
+(milliseconds), so the table shows what reusing sessions saves on a real
+bench, and how nests sharing one instrument queue behind its lock while
+nests with their own instruments do not.
+
+Usage: python src/benchmarks/bench_instruments.py [reads] [io_ms] [open_ms] [nests]
+"""
+
+from time import perf_counter
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.instruments import SimulatedInstrument, simulated_pool
+
+
+def per_phase(reads, latency, open_latency):
+    for _ in range(reads):
+        session = SimulatedInstrument("DMM", latency, open_latency)
+        session.query("MEAS:VOLT:DC?", 12.0)
+        session.close()
+
+
+def pooled(pool, reads, resource="DMM"):
+    for _ in range(reads):
+        with pool.lease(resource) as session:
+            session.query("MEAS:VOLT:DC?", 12.0)
+
+
+def nests(pool, count, reads, shared):
+    threads = [
+        threading.Thread(
+            target=pooled, args=(pool, reads, "DMM" if shared else f"DMM{i}")
+        )
+        for i in range(count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def bench(label, run, reads):
+    start = perf_counter()
+    run()
+    per_read = (perf_counter() - start) / reads * 1e3
+    print(f"{label:<34} {per_read:8.3f} ms/read")
+
+
+def main(reads=200, io_ms=2.0, open_ms=50.0, nest_count=4):
+    latency, open_latency = io_ms / 1e3, open_ms / 1e3
+    print(f"{reads} reads, {io_ms} ms I/O, {open_ms} ms to open a session")
+    bench(
+        "session per phase", lambda: per_phase(reads, latency, open_latency), reads
+    )
+
+    pool = simulated_pool(latency, open_latency)
+    bench("pooled session", lambda: pooled(pool, reads), reads)
+    print(f"{'sessions opened':<34} {pool.opened:8d}")
+
+    pool = simulated_pool(latency, open_latency)
+    bench(
+        f"{nest_count} nests, one shared DMM",
+        lambda: nests(pool, nest_count, reads // nest_count, True),
+        reads,
+    )
+    leases, waited = pool.stats()["DMM"]
+    print(f"{'  waited for the lock':<34} {waited / leases * 1e3:8.3f} ms/read")
+
+    pool = simulated_pool(latency, open_latency)
+    bench(
+        f"{nest_count} nests, one DMM each",
+        lambda: nests(pool, nest_count, reads // nest_count, False),
+        reads,
+    )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        int(args[0]) if len(args) > 0 else 200,
+        float(args[1]) if len(args) > 1 else 2.0,
+        float(args[2]) if len(args) > 2 else 50.0,
+        int(args[3]) if len(args) > 3 else 4,
+    )
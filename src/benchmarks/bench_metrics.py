@@ -0,0 +1,36 @@
+"""Cost of recording one station metrics event.
+
+Usage: python src/benchmarks/bench_metrics.py [events]
+"""
+
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.metrics import Registry, StationMetrics
+
+
+def bench(label, record, events):
+    start = perf_counter()
+    for _ in range(events):
+        record()
+    per_event = (perf_counter() - start) / events * 1e9
+    print(f"{label:<28} {per_event:8.1f} ns/event")
+
+
+def main(events=1_000_000):
+    metrics = StationMetrics(Registry())
+    bench("counter inc", lambda: metrics.units_started.inc("FVT1"), events)
+    bench(
+        "histogram observe",
+        lambda: metrics.step_seconds.observe(0.0123, "flash_firmware_and_version"),
+        events,
+    )
+    bench("create_run observe", lambda: metrics.observe_create_run(0.05, True), events)
+    bench("empty call (loop overhead)", lambda: None, events)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,60 @@
+"""Compare the serial PCB -> Cell -> Assembly loop with the pipelined line.
+
+Each procedure sleeps for its step durations from
+src/drone/python-client/test_batteries.py scaled down by ``scale``, standing
+in for the time the unit spends on the station.
+
+Usage: python src/benchmarks/bench_pipeline.py [units] [scale] [pcb_fixtures]
+"""
+
+from time import perf_counter, sleep
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.pipeline import Pipeline, Stage
+
+# Total step durations of FVT1, FVT2 and FVT3 in seconds
+DURATIONS = [("PCB", 118.1), ("Cell", 9.1), ("Assembly", 8.1)]
+
+
+def procedure(duration):
+    def run(unit):
+        sleep(duration)
+        return unit
+
+    return run
+
+
+def main(units=40, scale=0.001, pcb_fixtures=13):
+    procedures = [(name, procedure(seconds * scale)) for name, seconds in DURATIONS]
+
+    start = perf_counter()
+    for unit in range(units):
+        for _, run in procedures:
+            run(unit)
+    serial = units / (perf_counter() - start)
+    print(f"serial loop  {serial * 3600:10.0f} units/h")
+
+    stages = [Stage(name, run) for name, run in procedures]
+    stats = Pipeline(stages).run(range(units))
+    print(f"pipelined    {stats.throughput * 3600:10.0f} units/h  "
+          f"{stats.throughput / serial:.2f}x")
+    print(stats.format())
+
+    if pcb_fixtures > 1:
+        stages[0] = Stage("PCB", procedures[0][1], workers=pcb_fixtures)
+        stats = Pipeline(stages).run(range(units))
+        print(f"pipelined, {pcb_fixtures} PCB fixtures  "
+              f"{stats.throughput / serial:.2f}x")
+        print(stats.format())
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:4]
+    main(
+        int(args[0]) if len(args) > 0 else 40,
+        float(args[1]) if len(args) > 1 else 0.001,
+        int(args[2]) if len(args) > 2 else 13,
+    )
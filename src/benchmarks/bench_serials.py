@@ -0,0 +1,49 @@
+"""Measure SerialAllocator throughput and check that serials never collide.
+
+Usage: python src/benchmarks/bench_serials.py [count] [processes]
+"""
+
+from multiprocessing import Pool
+from time import perf_counter
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.serials import SerialAllocator
+
+PREFIX = "00109A4J"
+
+
+def allocate_many(args):
+    directory, count = args
+    allocator = SerialAllocator(directory, width=9, lease=10_000)
+    return [allocator.allocate(PREFIX) for _ in range(count)]
+
+
+def main(count=1_000_000, processes=4):
+    with tempfile.TemporaryDirectory() as directory:
+        allocator = SerialAllocator(directory, width=9, lease=10_000)
+
+        start = perf_counter()
+        for _ in range(count):
+            allocator.allocate(PREFIX)
+        elapsed = perf_counter() - start
+        print(f"allocate()        {count / elapsed / 1e6:6.2f} M serials/s")
+
+        start = perf_counter()
+        allocator.allocate_block(PREFIX, count)
+        elapsed = perf_counter() - start
+        print(f"allocate_block()  {count / elapsed / 1e6:6.2f} M serials/s")
+
+        share = count // processes
+        with Pool(processes) as pool:
+            batches = pool.map(allocate_many, [(directory, share)] * processes)
+        serials = [serial for batch in batches for serial in batch]
+        assert len(set(serials)) == len(serials), "duplicate serial numbers"
+        print(f"{processes} processes       {len(serials)} serials, no duplicates")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
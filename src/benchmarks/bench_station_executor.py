@@ -0,0 +1,58 @@
+"""Measure how StationExecutor throughput scales with the number of nests.
+
+Each simulated unit runs a 14-step plan whose steps do a fixed amount of CPU
+work, standing in for measurement processing on the station.
+
+Usage: python src/benchmarks/bench_station_executor.py [units] [max_nests]
+"""
+
+from datetime import timedelta
+from time import perf_counter
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.executor import StationExecutor
+from station.steps import StepPlan, as_steps
+
+
+def measurement_step():
+    # About a millisecond of CPU work per step
+    value = sum(random.random() for _ in range(20_000)) / 20_000
+    return random.random() < 0.99, round(value, 3), "V", 0.45, 0.55
+
+
+plan = StepPlan([(measurement_step, timedelta(seconds=1))] * 14)
+
+
+def test_unit(serial_number):
+    run_passed, records, _ = plan.run()
+    return {
+        "procedure_id": "FVT1",
+        "unit_under_test": {"serial_number": serial_number},
+        "run_passed": run_passed,
+        "steps": as_steps(records),
+    }
+
+
+def main(units=400, max_nests=os.cpu_count()):
+    serial_numbers = [f"00109A4J{i:05d}" for i in range(units)]
+    nests = 1
+    baseline = None
+    while nests <= max_nests:
+        start = perf_counter()
+        with StationExecutor(nests) as station:
+            runs = list(station.map(test_unit, serial_numbers, seed=0))
+        throughput = len(runs) / (perf_counter() - start)
+        baseline = baseline or throughput
+        print(
+            f"{nests:3d} nests  {throughput:8.1f} units/s  "
+            f"{throughput / baseline:5.2f}x"
+        )
+        nests *= 2
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,78 @@
+"""Compare the per-step overhead of the legacy run_test loop and StepPlan.
+
+Usage: python src/benchmarks/bench_step_engine.py [total_steps]
+"""
+
+from datetime import datetime, timedelta
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.steps import StepPlan
+
+
+def boolean_step():
+    return True, None, None, None, None
+
+
+def numeric_step():
+    return True, 12.0, "V", 11.5, 12.5
+
+
+TESTS = [
+    (boolean_step, timedelta(seconds=1)),
+    (numeric_step, timedelta(seconds=3)),
+] * 7
+
+
+# Copy of the loop the templates used before StepPlan
+def legacy_run_test(test, duration):
+    start_time = datetime.now()
+    passed, value_measured, unit, limit_low, limit_high = test()
+
+    step = {
+        "name": test.__name__,
+        "started_at": start_time,
+        "duration": duration,
+        "step_passed": passed,
+        "measurement_unit": unit,
+        "measurement_value": value_measured,
+        "limit_low": limit_low,
+        "limit_high": limit_high,
+    }
+    return step
+
+
+def legacy_run_all_tests():
+    steps = []
+    for test, duration in TESTS:
+        step = legacy_run_test(test, duration)
+        steps.append(step)
+        if not step["step_passed"]:
+            break
+    return steps
+
+
+def bench(label, run, units):
+    start = perf_counter()
+    for _ in range(units):
+        run()
+    elapsed = perf_counter() - start
+    per_step = elapsed / (units * len(TESTS)) * 1e9
+    print(f"{label:<10} {elapsed:8.3f} s  {per_step:8.1f} ns/step")
+    return elapsed
+
+
+def main(total_steps=1_000_000):
+    units = total_steps // len(TESTS)
+    plan = StepPlan(TESTS)
+    print(f"{units * len(TESTS)} steps ({units} units x {len(TESTS)} steps)")
+    legacy = bench("legacy", legacy_run_all_tests, units)
+    compiled = bench("StepPlan", plan.run, units)
+    print(f"speedup    {legacy / compiled:8.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
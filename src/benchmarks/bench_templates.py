@@ -0,0 +1,204 @@
+"""Per-unit overhead of every template against a local API stand-in.
+
+Every template is driven through its own entry point: ``handle_test`` or
+``execute_procedures`` for the Python client templates, ``test_unit`` for
+the openhtf tests, and one pytest session per unit for the pytest plugin
+modules. Uploads go to ``station.standin_server`` running in a separate
+process on localhost, so nothing reaches the live service and the server's
+CPU time is not counted.
+
+The steps of the templates do not sleep, so everything measured is the
+cost of the template itself: building the steps, allocating serials,
+serializing the payload and the ``create_run`` / ``UploadToTofuPilot``
+round trip. For every template the table shows per unit:
+
+- CPU time of this process (of the pytest process for the plugin modules),
+- p50 and p99 wall latency,
+- bytes sent to the API,
+- peak memory allocated while testing the unit (a second, traced pass;
+  not available for the pytest subprocesses).
+
+Templates whose libraries are not installed are skipped.
+
+Usage: python src/benchmarks/bench_templates.py [units]
+"""
+
+from time import perf_counter_ns, process_time_ns
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import urllib.request
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROOT = os.path.join(SRC, "..")
+
+sys.path.insert(0, SRC)
+
+# (name, kind, template, working directory its attachment paths expect)
+TEMPLATES = [
+    ("motor", "client", "motors/test_motor.py", SRC),
+    ("climatic-chamber", "client", "climatic-chamber/python-client/test_final_assembly.py", SRC),
+    ("pcba-rf motherboard", "client", "pcba-rf/python-client/pcba_motherboard.py", SRC),
+    ("drone batteries", "client", "drone/python-client/test_batteries.py", ROOT),
+    ("pcba-power openhtf", "openhtf", "pcba-power/openhtf/pcba_test.py", SRC),
+    ("pcba-rf openhtf", "openhtf", "pcba-rf/openhtf/pcba_assembly.py", SRC),
+    ("drone pytest pcb", "pytest", "drone/pytest-plugin/test_battery_pcb.py", None),
+    ("drone pytest cell", "pytest", "drone/pytest-plugin/test_battery_cell.py", None),
+    ("drone pytest assembly", "pytest", "drone/pytest-plugin/test_battery_assembly.py", None),
+]
+
+
+def received_bytes(url):
+    with urllib.request.urlopen(f"{url}/standin/stats") as response:
+        return json.load(response)["bytes"]
+
+
+class SyncUploads:
+    """Uploader calling create_run inline, so its cost lands on the unit."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, **run):
+        self.client.create_run(**run)
+
+
+def load_template(name, path):
+    spec = importlib.util.spec_from_file_location(
+        "bench_" + name.replace(" ", "_").replace("-", "_"), os.path.join(SRC, path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def client_unit(module, url):
+    from tofupilot import TofuPilotClient
+
+    uploads = SyncUploads(TofuPilotClient(url=url))
+    if hasattr(module, "execute_procedures"):
+        return lambda: module.execute_procedures(1, uploads)
+    return lambda: module.handle_test(1, uploads)
+
+
+def measure(unit, units, url, flush=None):
+    # One pass for time and payload, one traced pass for memory, since
+    # tracing slows the unit down; ``flush`` waits for background uploads
+    # before the payload is counted
+    cpu = 0
+    latencies = []
+    sent = received_bytes(url)
+    for _ in range(units):
+        cpu_start = process_time_ns()
+        start = perf_counter_ns()
+        unit()
+        latencies.append(perf_counter_ns() - start)
+        cpu += process_time_ns() - cpu_start
+    if flush is not None:
+        flush()
+    payload = (received_bytes(url) - sent) / units
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(max(1, units // 10)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        unit()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return cpu / units, latencies, payload, peak
+
+
+def measure_pytest(path, units, url, env):
+    command = [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", path]
+    directory = os.path.dirname(path)
+    cpu = 0.0
+    latencies = []
+    sent = received_bytes(url)
+    for _ in range(units):
+        before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = perf_counter_ns()
+        subprocess.run(command, cwd=directory, env=env, capture_output=True)
+        latencies.append(perf_counter_ns() - start)
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    payload = (received_bytes(url) - sent) / units
+    return cpu * 1e9 / units, latencies, payload, None
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main(units=200):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "station.standin_server", "--port", "0"],
+        cwd=SRC,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    url = server.stdout.readline().strip()
+
+    # Keep the stores of the templates away from the ones of this machine
+    state = tempfile.mkdtemp(prefix="bench-templates-")
+    os.environ.update(
+        TOFUPILOT_API_KEY="bench",
+        TOFUPILOT_URL=url,
+        TOFUPILOT_SERIAL_DIR=os.path.join(state, "serials"),
+        TOFUPILOT_RETEST_DB=os.path.join(state, "retest.sqlite"),
+    )
+    os.environ.pop("TOFUPILOT_SPOOL_DIR", None)
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [SRC, os.environ.get("PYTHONPATH")])),
+    )
+
+    print(f"{'template':<24}{'units':>7}{'cpu ms':>10}{'p50 ms':>10}"
+          f"{'p99 ms':>10}{'payload B':>11}{'peak KiB':>10}")
+    cwd = os.getcwd()
+    try:
+        for name, kind, path, directory in TEMPLATES:
+            try:
+                if kind == "pytest":
+                    if importlib.util.find_spec("tofupilot") is None:
+                        raise ImportError("No module named 'tofupilot'")
+                    result = measure_pytest(
+                        os.path.join(SRC, path), max(1, units // 20), url, env
+                    )
+                    count = max(1, units // 20)
+                else:
+                    os.chdir(directory)
+                    module = load_template(name, path)
+                    unit = client_unit(module, url) if kind == "client" else module.test_unit
+                    unit()  # warm up
+                    uploads = getattr(module, "uploads", None)
+                    flush = uploads.flush if hasattr(uploads, "flush") else None
+                    result = measure(unit, units, url, flush)
+                    count = units
+            except ImportError as error:
+                print(f"{name:<24}  skipped ({error})")
+                continue
+            finally:
+                os.chdir(cwd)
+
+            cpu, latencies, payload, peak = result
+            peak = f"{peak / 1024:10.1f}" if peak is not None else f"{'-':>10}"
+            print(
+                f"{name:<24}{count:7d}{cpu / 1e6:10.3f}"
+                f"{percentile(latencies, 0.5) / 1e6:10.3f}"
+                f"{percentile(latencies, 0.99) / 1e6:10.3f}"
+                f"{payload:11.0f}{peak}"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,66 @@
+"""Compare synchronous create_run calls with UploadQueue.
+
+The server is replaced by a stand-in client that sleeps for the injected
+latency, so the numbers show how much of the station cycle the upload costs.
+
+Usage: python src/benchmarks/bench_uploads.py [units] [latency_ms] [workers]
+"""
+
+from time import perf_counter, sleep
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.uploads import UploadQueue
+
+
+class LatencyClient:
+    """Stand-in for TofuPilotClient whose create_run takes ``latency`` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.runs = 0
+
+    def create_run(self, **run):
+        sleep(self.latency)
+        self.runs += 1
+        return {"success": True}
+
+
+def unit_payload(index):
+    return {
+        "procedure_id": "FVT1",
+        "unit_under_test": {"part_number": "00109", "serial_number": f"{index:05d}"},
+        "run_passed": True,
+        "steps": [],
+    }
+
+
+def main(units=200, latency_ms=50, workers=8):
+    latency = latency_ms / 1000
+
+    client = LatencyClient(latency)
+    start = perf_counter()
+    for index in range(units):
+        client.create_run(**unit_payload(index))
+    synchronous = perf_counter() - start
+
+    client = LatencyClient(latency)
+    uploads = UploadQueue(client, workers=workers, maxsize=4 * workers)
+    start = perf_counter()
+    for index in range(units):
+        uploads.submit(**unit_payload(index))
+    loop_done = perf_counter() - start
+    uploads.close()
+    queued = perf_counter() - start
+    assert client.runs == units
+
+    print(f"{units} units, {latency_ms} ms per create_run, {workers} workers")
+    print(f"synchronous  {units / synchronous:10.1f} units/s")
+    print(f"queued       {units / queued:10.1f} units/s (including final flush)")
+    print(f"test loop    {loop_done * 1000 / units:10.3f} ms/unit blocked on uploads")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:4]))
@@ -1,9 +1,27 @@
 from tofupilot import TofuPilotClient
 from datetime import datetime, timedelta
+import os
 import random
+import sys
 import uuid
 
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.steps import StepPlan, as_steps
+from station.executor import StationExecutor
+from station.metrics import open_metrics
+from station.spc import open_spc
+from station.trace import open_trace
+from station.uploads import open_uploader
+
 client = TofuPilotClient()
+# Step timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+# Control charts of the measurements, when TOFUPILOT_SPC_BASELINE is set
+spc = open_spc()
 
 
 # Simulate FPY for each step
@@ -116,25 +134,9 @@ def operational_efficiency_test():
 
 
 # Running Steps
-def run_test(test, duration):
-    start_time = datetime.now()
-    passed, value_measured, unit, limit_low, limit_high = test()
-
-    step = {
-        "name": test.__name__,
-        "started_at": start_time,
-        "duration": duration,
-        "step_passed": passed,
-        "measurement_unit": unit,
-        "measurement_value": value_measured,
-        "limit_low": limit_low,
-        "limit_high": limit_high,
-    }
-    return step
-
-
-def run_all_tests():
-    tests = [
+# The step table is compiled once and reused for every unit
+plan = StepPlan(
+    [
         (power_on_test, timedelta(seconds=1)),
         (initial_temp_reading, timedelta(seconds=2)),
         (heat_up_start_test, timedelta(seconds=1)),
@@ -150,37 +152,58 @@ def run_all_tests():
         (cycle_completion_signal_test, timedelta(seconds=1)),
         (final_temp_reading, timedelta(seconds=2)),
         (operational_efficiency_test, timedelta(seconds=3)),
-    ]
-
-    steps = []
-
-    for test, duration in tests:
-        step = run_test(test, duration)
-        steps.append(step)
+    ],
+    procedure_id="FVT1",
+)
 
-    return steps
 
+def run_all_tests():
+    # Every step runs, even after a failure
+    run_passed, records, _ = plan.run(fail_fast=False, trace=trace, metrics=metrics)
+    return run_passed, as_steps(records)
 
-def handle_test():
-    # Generate a unique serial number for each UUT (Unit Under Test)
-    serial_number = str(uuid.uuid4())[:8]
 
+# Test a single unit and return its Run for TofuPilot
+def test_unit(serial_number):
     # Run all tests
-    steps = run_all_tests()
+    run_passed, steps = run_all_tests()
 
-    # Create a Run on TofuPilot
-    client.create_run(
-        procedure_id="FVT1",
-        unit_under_test={
+    return {
+        "procedure_id": "FVT1",
+        "unit_under_test": {
             "part_number": "UNIT42",
             "revision": "1.0",
             "serial_number": serial_number,
         },
-        run_passed=all(step["step_passed"] for step in steps),
-        steps=steps,
-    )
+        "run_passed": run_passed,
+        "steps": steps,
+    }
+
+
+def handle_test(end, uploads, nests=1):
+    # Generate a unique serial number for each UUT (Unit Under Test)
+    serial_numbers = [str(uuid.uuid4())[:8] for _ in range(end)]
+
+    # Test the units on every nest of the fixture and queue each Run for upload
+    with StationExecutor(nests) as station:
+        for run in station.map(test_unit, serial_numbers):
+            if spc is not None:
+                spc.observe_run(run)
+            uploads.submit(**run)
+
+
+# Test a batch of units and upload their Runs with the given client
+def main(client=client):
+    # Runs are uploaded in the background so the next unit starts right away,
+    # through an on-disk spool when TOFUPILOT_SPOOL_DIR is set
+    uploads = open_uploader(client, metrics)
+
+    # Run mock-up for x units
+    handle_test(20, uploads)
+    uploads.close()
+    if spc is not None:
+        print(spc.format())
 
 
-# Run mock-up for x units
-for _ in range(20):
-    handle_test()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Make the shared station helpers in src/station importable from the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.pytest_runs import add_options, install
+
+
+def pytest_addoption(parser):
+    add_options(parser)
+
+
+# With --tofupilot, upload one run per module for the unit of every worker,
+# so `pytest --tofupilot -n 32 --dist each` tests 32 units at once
+@pytest.hookimpl(trylast=True)
+def pytest_configure(config):
+    install(config)
@@ -1,31 +1,28 @@
-from tofupilot import conf, numeric_step, string_step
+from tofupilot import numeric_step, string_step
 from datetime import datetime, timedelta
 import random
 import pytest
 
-# Generate unique serial numbers
+# Unit Under Test (UUT) identification
 part_number_assembly = "SI02430"
 revision_assembly = "B"
 static_segment = "4J"
 batch_number_assembly = "1024"
-random_digits_assembly = "".join([str(random.randint(0, 9)) for _ in range(5)])
-serial_number_assembly = (
-    f"{part_number_assembly}{revision_assembly}{static_segment}{random_digits_assembly}"
-)
 # To be improved - for the moment creates a link with sub-units of a fixed serial number
 sub_units = [
     {"serial_number": "00786C4J26221"},
     {"serial_number": "00143B4J73889"},
 ]
 
-# Configure Run information to be sent to TofuPilot
-conf.set(
-    procedure_id="FVT1",
-    serial_number=serial_number_assembly,
-    part_number=part_number_assembly,
-    batch_number=batch_number_assembly,
-    sub_units=sub_units,
-)
+# Run information to be sent to TofuPilot; every worker tests its own unit,
+# with a unique serial number allocated from this prefix
+run_info = {
+    "procedure_id": "FVT1",
+    "serial_prefix": f"{part_number_assembly}{revision_assembly}{static_segment}",
+    "part_number": part_number_assembly,
+    "batch_number": batch_number_assembly,
+    "sub_units": sub_units,
+}
 
 
 # Simulate passing probability for a test result
@@ -39,8 +36,7 @@ def test_battery_connection(step):
     assert passed
 
 
-@pytest.fixture(scope="module")
-def voltage_value():
+def measure_voltage():
     passed = simulate_test_result(0.98)
     measured_voltage = (
         round(random.uniform(10, 12), 1)
@@ -50,16 +46,34 @@ def voltage_value():
     return measured_voltage
 
 
+VOLTAGE_LIMITS = (10.0, 12.0)
+INTERNAL_RESISTANCE_LIMITS = (5, 15)
+
+
+# Readings are cached per unit, so later steps, other procedures and reruns
+# of the same unit reuse them until they expire; failing readings are not
+# cached, so a rerun after rework measures again
+@pytest.fixture(scope="module")
+def voltage_value(unit_run, measurement_cache):
+    return measurement_cache.measure(
+        unit_run.serial_number,
+        "battery_voltage",
+        measure_voltage,
+        {"range": "20V"},
+        limits=VOLTAGE_LIMITS,
+    )
+
+
 @numeric_step
 def test_voltage_value(step, voltage_value):
     # Test for voltage value using a fixture.
-    step.set_units("V").set_limits(low=10.0, high=12.0)
+    low, high = VOLTAGE_LIMITS
+    step.set_units("V").set_limits(low=low, high=high)
     step.measure(voltage_value)
     assert step()
 
 
-@pytest.fixture(scope="module")
-def internal_resistance():
+def measure_internal_resistance():
     passed = simulate_test_result(0.98)
     measured_ir = (
         round(random.uniform(10, 12), 1) if passed else round(random.uniform(15, 20), 1)
@@ -67,9 +81,21 @@ def internal_resistance():
     return measured_ir
 
 
+@pytest.fixture(scope="module")
+def internal_resistance(unit_run, measurement_cache):
+    return measurement_cache.measure(
+        unit_run.serial_number,
+        "internal_resistance",
+        measure_internal_resistance,
+        {"method": "dc_pulse", "current": "1A"},
+        limits=INTERNAL_RESISTANCE_LIMITS,
+    )
+
+
 @numeric_step
 def test_internal_resistance(step, internal_resistance):
-    step.set_units("mΩ").set_limits(low=5, high=15)
+    low, high = INTERNAL_RESISTANCE_LIMITS
+    step.set_units("mΩ").set_limits(low=low, high=high)
     step.measure(internal_resistance)
     assert step()
 
@@ -99,7 +125,7 @@ def test_state_of_health(step):
 
 
 @numeric_step
-def test_state_of_charge(step, voltage_value, internal_resistance):
+def test_state_of_charge(step, unit_run, voltage_value, internal_resistance):
     step.set_units("%").set_limits(low=40, high=60)
     passed = simulate_test_result(0.99)
     value_measured = (
@@ -110,11 +136,11 @@ def test_state_of_charge(step, voltage_value, internal_resistance):
     # Create report if last step is passed
     report_variables = {
         "report_date": str(datetime.now().strftime("%d.%m.%Y")),
-        "serial_number": serial_number_assembly,
+        "serial_number": unit_run.serial_number,
         "batch_number": batch_number_assembly,
         "voltage_test_result": str(voltage_value),
         "safety_test_result": "Passed all safety tests",
         "internal_resistance": str(internal_resistance),
     }
-    conf.set(report_variables=report_variables)
+    unit_run.set(report_variables=report_variables)
     assert True
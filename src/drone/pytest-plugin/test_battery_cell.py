@@ -1,24 +1,21 @@
-from tofupilot import conf, numeric_step
+from tofupilot import numeric_step
 import random
 import pytest
 
-# Generate unique serial numbers
+# Unit Under Test (UUT) identification
 part_number_cell = "00143"
 revision_cell = "B"
 static_segment = "4J"
 batch_number_cell = "1024"
-random_digits_cell = "".join([str(random.randint(0, 9)) for _ in range(5)])
-serial_number_cell = (
-    f"{part_number_cell}{revision_cell}{static_segment}{random_digits_cell}"
-)
 
-# Configure Run information to be sent to TofuPilot
-conf.set(
-    procedure_id="FVT2",
-    serial_number=serial_number_cell,
-    part_number=part_number_cell,
-    batch_number=batch_number_cell,
-)
+# Run information to be sent to TofuPilot; every worker tests its own unit,
+# with a unique serial number allocated from this prefix
+run_info = {
+    "procedure_id": "FVT2",
+    "serial_prefix": f"{part_number_cell}{revision_cell}{static_segment}",
+    "part_number": part_number_cell,
+    "batch_number": batch_number_cell,
+}
 
 
 # Simulate passing probability for a test result
@@ -1,25 +1,22 @@
-from tofupilot import conf, numeric_step, string_step
+from tofupilot import numeric_step, string_step
 import random
 import os
 import pytest
 
-# Generate unique serial numbers
+# Unit Under Test (UUT) identification
 part_number_pcb = "00786"
 revision_pcb = "A"
 static_segment = "4J"
 batch_number_pcb = "1024"
-random_digits_pcb = "".join([str(random.randint(0, 9)) for _ in range(5)])
-serial_number_pcb = (
-    f"{part_number_pcb}{revision_pcb}{static_segment}{random_digits_pcb}"
-)
 
-# Configure Run information to be sent to TofuPilot
-conf.set(
-    procedure_id="FVT1",
-    serial_number=serial_number_pcb,
-    part_number=part_number_pcb,
-    batch_number=batch_number_pcb,
-)
+# Run information to be sent to TofuPilot; every worker tests its own unit,
+# with a unique serial number allocated from this prefix
+run_info = {
+    "procedure_id": "FVT1",
+    "serial_prefix": f"{part_number_pcb}{revision_pcb}{static_segment}",
+    "part_number": part_number_pcb,
+    "batch_number": batch_number_pcb,
+}
 
 
 # Simulate passing probability for a test result
@@ -102,7 +99,7 @@ def test_calibrate_temperature(step):
     assert step()
 
 
-def test_visual_inspection():
+def test_visual_inspection(unit_run):
     attachment = ["./pcb_coating.jpeg"]
     assert attachment is not None
-    conf.set(attachments=attachment)
+    unit_run.set(attachments=attachment)
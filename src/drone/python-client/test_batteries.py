@@ -1,8 +1,48 @@
 from tofupilot import TofuPilotClient
-from datetime import datetime, timedelta
+from datetime import datetime
+import os
 import random
+import sys
+
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.steps import StepPlan, as_steps
+from station.executor import StationExecutor
+from station.metrics import open_metrics
+from station.models import (
+    DRONE_ASSEMBLY_FVT3,
+    DRONE_CELL_FVT2,
+    DRONE_PCB_FVT1,
+    draw,
+    step_table,
+    steps_by_name,
+)
+from station.pipeline import Pipeline, Stage
+from station.retest import open_retest_store
+from station.serials import open_serial_allocator
+from station.spc import open_spc
+from station.trace import open_trace
+from station.uploads import open_uploader
 
 client = TofuPilotClient()
+serials = open_serial_allocator()
+# Step timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+# Control charts of the measurements, when TOFUPILOT_SPC_BASELINE is set
+spc = open_spc()
+# Last failed step of every unit, kept for later sessions when
+# TOFUPILOT_RETEST_DB is set
+retests = open_retest_store()
+
+
+# Simulated FPY, duration and measurement range of each step, shared with
+# the line simulator
+pcb = steps_by_name(DRONE_PCB_FVT1)
+cell = steps_by_name(DRONE_CELL_FVT2)
+assembly = steps_by_name(DRONE_ASSEMBLY_FVT3)
 
 
 # Simulate passing probability for a test result
@@ -12,85 +52,59 @@ def simulate_test_result(passed_prob):
 
 # Cell Test Functions
 def esr_test():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(5, 10), 2) if passed else round(random.uniform(15, 20), 2)
-    )
+    passed, value_measured = draw(cell["esr_test"], 2)
     return passed, value_measured, "mΩ", 5, 15
 
 
 def cell_voltage_test():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(3.0, 3.5), 2)
-        if passed
-        else round(random.uniform(2.5, 2.9), 2)
-    )
+    passed, value_measured = draw(cell["cell_voltage_test"], 2)
     return passed, value_measured, "V", 3.0, 3.5
 
 
 def ir_test():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(5, 10), 2) if passed else round(random.uniform(15, 20), 2)
-    )
+    passed, value_measured = draw(cell["ir_test"], 2)
     return passed, value_measured, "mΩ", 5, 15
 
 
 def charge_discharge_cycle_test():
-    passed = simulate_test_result(0.95)
-    value_measured = (
-        round(random.uniform(95, 100), 1)
-        if passed
-        else round(random.uniform(80, 94), 1)
-    )
+    passed, value_measured = draw(cell["charge_discharge_cycle_test"], 1)
     return passed, value_measured, "% Capacity", 95, 100
 
 
 # PCBA Test function
 def flash_firmware_and_version():
-    passed = simulate_test_result(0.99)
+    passed, _ = draw(pcb["flash_firmware_and_version"])
     value_measured = "1.2.8" if passed else None
     return passed, value_measured, None, None, None
 
 
 def configuration_battery_gauge():
-    passed = simulate_test_result(0.98)
+    passed, _ = draw(pcb["configuration_battery_gauge"])
     return passed, None, None, None, None
 
 
 def get_calibration_values_and_internal_statuses():
-    passed = simulate_test_result(0.98)
+    passed, _ = draw(pcb["get_calibration_values_and_internal_statuses"])
     return passed, None, None, None, None
 
 
 def overvoltage_protection_test():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(4.20, 4.25), 3)
-        if passed
-        else round(random.uniform(4.30, 4.35), 3)
-    )
+    passed, value_measured = draw(pcb["overvoltage_protection_test"], 3)
     return passed, value_measured, "V", 4.20, 4.25
 
 
 def undervoltage_protection_test():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(2.5, 2.6), 2)
-        if passed
-        else round(random.uniform(2.3, 2.4), 2)
-    )
+    passed, value_measured = draw(pcb["undervoltage_protection_test"], 2)
     return passed, value_measured, "V", 2.5, 2.6
 
 
 def test_LED_and_button():
-    passed = simulate_test_result(0.95)
+    passed, _ = draw(pcb["test_LED_and_button"])
     return passed, None, None, None, None
 
 
 def save_information_in_memory():
-    passed = simulate_test_result(0.99)
+    passed, _ = draw(pcb["save_information_in_memory"])
     return passed, None, None, None, None
 
 
@@ -107,125 +121,136 @@ def calibrate_temperature():
 
 # Assembly Test Functions
 def battery_connection():
-    passed = simulate_test_result(1.0)
+    passed, _ = draw(assembly["battery_connection"])
     return passed, None, None, None, None
 
 
 def voltage_value():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(10.0, 12.0), 2)
-        if passed
-        else round(random.uniform(8.0, 9.5), 2)
-    )
+    passed, value_measured = draw(assembly["voltage_value"], 2)
     return passed, value_measured, "V", 10.0, 12.0
 
 
 def internal_resistance():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(5, 10), 2) if passed else round(random.uniform(15, 20), 2)
-    )
+    passed, value_measured = draw(assembly["internal_resistance"], 2)
     return passed, value_measured, "mΩ", 5, 15
 
 
 def thermal_runaway_detection():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(55, 65), 2) if passed else round(random.uniform(66, 70), 2)
-    )
+    passed, value_measured = draw(assembly["thermal_runaway_detection"], 2)
     return passed, value_measured, "°C", 55, 65
 
 
 def state_of_health():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(95, 100), 1)
-        if passed
-        else round(random.uniform(85, 94), 1)
-    )
+    passed, value_measured = draw(assembly["state_of_health"], 1)
     return passed, value_measured, "%", 95, None
 
 
 def state_of_charge():
-    passed = simulate_test_result(0.98)
-    value_measured = (
-        round(random.uniform(40, 60), 1) if passed else round(random.uniform(25, 35), 1)
-    )
+    passed, value_measured = draw(assembly["state_of_charge"], 1)
     return passed, value_measured, "%", 40, 60
 
 
 def visual_inspection():
-    passed = simulate_test_result(1)
+    passed, _ = draw(pcb["visual_inspection"])
     return passed, None, None, None, None
 
 
-# Run a single test
-def run_test(test, duration):
-    start_time = datetime.now()
-    passed, value_measured, unit, limit_low, limit_high = test()
-
-    step = {
-        "name": test.__name__,
-        "started_at": start_time,
-        "duration": duration,
-        "step_passed": passed,
-        "measurement_unit": unit,
-        "measurement_value": value_measured,
-        "limit_low": limit_low,
-        "limit_high": limit_high,
-    }
-    return passed, step
-
+# Step tables, compiled once and reused for every unit, in the order and
+# with the durations of the models
+# PCBA Tests
+plan_pcb = StepPlan(
+    step_table(
+        DRONE_PCB_FVT1,
+        [
+            flash_firmware_and_version,
+            configuration_battery_gauge,
+            get_calibration_values_and_internal_statuses,
+            overvoltage_protection_test,
+            undervoltage_protection_test,
+            test_LED_and_button,
+            save_information_in_memory,
+            visual_inspection,
+        ],
+    ),
+    procedure_id="FVT1",
+)
+
+# Cell Tests
+plan_cell = StepPlan(
+    step_table(
+        DRONE_CELL_FVT2,
+        [
+            esr_test,
+            cell_voltage_test,
+            ir_test,
+            charge_discharge_cycle_test,
+        ],
+    ),
+    procedure_id="FVT2",
+)
+
+# Assembly Tests
+plan_assembly = StepPlan(
+    step_table(
+        DRONE_ASSEMBLY_FVT3,
+        [
+            battery_connection,
+            voltage_value,
+            internal_resistance,
+            thermal_runaway_detection,
+            state_of_health,
+            state_of_charge,
+        ],
+    ),
+    procedure_id="FVT3",
+)
+
+
+def run_all_tests(plan, previous_failed_step=None):
+    # Resume from the failed step of a previous attempt, keeping the steps
+    # that already passed
+    if previous_failed_step is not None:
+        run_passed, records, failed_index = plan.run(
+            start=previous_failed_step["index"],
+            previous=previous_failed_step["records"],
+            trace=trace,
+            metrics=metrics,
+        )
+    else:
+        run_passed, records, failed_index = plan.run(trace=trace, metrics=metrics)
 
-def run_all_tests(tests, previous_failed_step=None):
-    steps = []
-    all_tests_passed = True
     failed_at_step = None
+    if failed_index is not None:
+        failed_at_step = {"index": failed_index, "records": records}
 
-    for index, (test, duration) in enumerate(tests):
-        if previous_failed_step is not None and index == previous_failed_step["index"]:
-            passed = previous_failed_step["step_passed"]
-            step = previous_failed_step
-        else:
-            passed, step = run_test(test, duration)
-
-        steps.append(step)
-
-        if not passed:
-            failed_at_step = {
-                "index": index,
-                "step_passed": passed,
-                "name": step["name"],
-                "started_at": step["started_at"],
-                "duration": step["duration"],
-                "measurement_unit": step["measurement_unit"],
-                "measurement_value": step["measurement_value"],
-                "limit_low": step["limit_low"],
-                "limit_high": step["limit_high"],
-            }
-            all_tests_passed = False
-            break
-
-    return all_tests_passed, steps, failed_at_step
+    return run_passed, records, failed_at_step
 
 
-# Run a list of tests sequentially
+# Run a list of tests sequentially and return the Run for TofuPilot. A unit
+# retested after rework resumes from its failed step and keeps the steps it
+# already passed.
 def handle_procedure(
     procedure_id,
-    tests,
+    plan,
     serial_number,
     part_number,
     revision,
     batch_number,
     sub_units,
     attachments,
+    previous_failed_step=None,
 ):
-    run_passed, steps, failed_step = run_all_tests(tests)
+    run_passed, records, failed_step = run_all_tests(plan, previous_failed_step)
+    if retests is not None:
+        if failed_step is not None:
+            retests.save(procedure_id, serial_number, failed_step)
+        elif previous_failed_step is not None:
+            # The unit passed: its failure is no longer needed
+            retests.clear(procedure_id, serial_number)
 
     if procedure_id == "FVT3" and run_passed:  # Assembly Procedure
-        internal_resistance = steps[2]["measurement_value"]
-        voltage_value = steps[1]["measurement_value"]
+        internal_resistance = records[2].measurement_value
+        voltage_value = records[1].measurement_value
         report_variables = {
             "report_date": str(datetime.now().strftime("%d.%m.%Y")),
             "serial_number": serial_number,
@@ -237,113 +262,190 @@ def handle_procedure(
     else:
         report_variables = None
 
-    client.create_run(
-        procedure_id=procedure_id,
-        unit_under_test={
+    run = {
+        "procedure_id": procedure_id,
+        "unit_under_test": {
             "part_number": part_number,
             "revision": revision,
             "serial_number": serial_number,
             "batch_number": batch_number,
         },
-        run_passed=run_passed,
-        steps=steps,
-        sub_units=sub_units,
-        attachments=attachments,
-        report_variables=report_variables,
+        "run_passed": run_passed,
+        "steps": as_steps(records),
+        "sub_units": sub_units,
+        "attachments": attachments,
+        "report_variables": report_variables,
+    }
+    return run_passed, failed_step, run
+
+
+# Units Under Test identification
+part_number_cell = "00143"
+part_number_pcb = "00786"
+part_number_assembly = "SI02430"
+revision_cell = "A"
+revision_pcb = "B"
+revision_assembly = "B"
+static_segment = "4J"
+batch_number = "1024"
+
+# Number of times a failed unit is reworked and retested in the same session,
+# none unless TOFUPILOT_REWORK_ATTEMPTS is set
+rework_attempts = int(os.environ.get("TOFUPILOT_REWORK_ATTEMPTS", 0))
+
+
+# Run a procedure, and retest the unit after each rework until it passes.
+# Serials are allocated in this session, so there is no earlier failure to
+# look up: only the retests resume, from the failure of the attempt before.
+def handle_procedure_with_rework(*args):
+    runs = []
+    failed_step = None
+    for _ in range(1 + rework_attempts):
+        run_passed, failed_step, run = handle_procedure(*args, failed_step)
+        runs.append(run)
+        if run_passed:
+            break
+    return run_passed, runs
+
+
+# Execute PCBA Tests
+def test_pcb(serial_numbers):
+    serial_number_pcb, _, _ = serial_numbers
+    return handle_procedure_with_rework(
+        "FVT1",
+        plan_pcb,
+        serial_number_pcb,
+        part_number_pcb,
+        revision_pcb,
+        batch_number,
+        None,
+        ["src/drone/python-client/pcb_coating.jpeg"],
     )
-    return run_passed, failed_step
+
+
+# Execute Cell Tests
+def test_cell(serial_numbers):
+    _, serial_number_cell, _ = serial_numbers
+    return handle_procedure_with_rework(
+        "FVT2",
+        plan_cell,
+        serial_number_cell,
+        part_number_cell,
+        revision_cell,
+        batch_number,
+        None,
+        None,
+    )
+
+
+# Execute Assembly Tests, linking the PCB and cell as sub-units
+def test_assembly(serial_numbers):
+    serial_number_pcb, serial_number_cell, serial_number_assembly = serial_numbers
+    return handle_procedure_with_rework(
+        "FVT3",
+        plan_assembly,
+        serial_number_assembly,
+        part_number_assembly,
+        revision_assembly,
+        batch_number,
+        [
+            {"serial_number": serial_number_pcb},
+            {"serial_number": serial_number_cell},
+        ],
+        None,
+    )
+
+
+# Procedures of the line, in order
+procedures = [("PCB", test_pcb), ("Cell", test_cell), ("Assembly", test_assembly)]
+
+
+# Run the PCB, cell and assembly procedures for one battery and return the
+# Runs to upload
+def test_unit(serial_numbers):
+    runs = []
+    for _, test_procedure in procedures:
+        passed, procedure_runs = test_procedure(serial_numbers)
+        runs.extend(procedure_runs)
+        if not passed:
+            break
+    return runs
+
+
+# Turn a procedure into a pipeline stage that uploads its Runs and passes the
+# battery on to the next station only if it passed
+def pipeline_stage(test_procedure, uploads):
+    def run_stage(serial_numbers):
+        passed, runs = test_procedure(serial_numbers)
+        for run in runs:
+            if spc is not None:
+                spc.observe_run(run)
+            uploads.submit(**run)
+        return serial_numbers if passed else None
+
+    return run_stage
 
 
 # Main Function for Executing Procedures
-def execute_procedures(end):
-    for _ in range(end):
-        # Generate unique serial numbers
-        part_number_cell = "00143"
-        part_number_pcb = "00786"
-        part_number_assembly = "SI02430"
-        revision_cell = "A"
-        revision_pcb = "B"
-        revision_assembly = "B"
-        static_segment = "4J"
-        random_digits_cell = "".join([str(random.randint(0, 9)) for _ in range(5)])
-        random_digits_pcb = "".join([str(random.randint(0, 9)) for _ in range(5)])
-        random_digits_assembly = "".join([str(random.randint(0, 9)) for _ in range(5)])
-        serial_number_cell = (
-            f"{part_number_cell}{revision_cell}{static_segment}{random_digits_cell}"
+# With pipelined=True each procedure is a station of its own, so the PCB of
+# the next battery is tested while the cell of the current one is; the
+# throughput and utilization of every station are returned.
+def execute_procedures(end, uploads, nests=1, pipelined=False):
+    # Allocate unique serial numbers
+    serial_numbers = list(
+        zip(
+            serials.allocate_block(
+                f"{part_number_pcb}{revision_pcb}{static_segment}", end
+            ),
+            serials.allocate_block(
+                f"{part_number_cell}{revision_cell}{static_segment}", end
+            ),
+            serials.allocate_block(
+                f"{part_number_assembly}{revision_assembly}{static_segment}", end
+            ),
         )
-        serial_number_pcb = (
-            f"{part_number_pcb}{revision_pcb}{static_segment}{random_digits_pcb}"
-        )
-        serial_number_assembly = f"{part_number_assembly}{revision_assembly}{static_segment}{random_digits_assembly}"
-        batch_number = "1024"
-
-        # Execute PCBA Tests
-        tests_pcb = [
-            (flash_firmware_and_version, timedelta(seconds=90)),
-            (configuration_battery_gauge, timedelta(seconds=1)),
-            (get_calibration_values_and_internal_statuses, timedelta(seconds=1)),
-            (overvoltage_protection_test, timedelta(seconds=5)),
-            (undervoltage_protection_test, timedelta(seconds=5)),
-            (test_LED_and_button, timedelta(seconds=6)),
-            (save_information_in_memory, timedelta(seconds=0.1)),
-            (visual_inspection, timedelta(seconds=10)),
-        ]
-        passed_pcb, failed_step_pcb = handle_procedure(
-            "FVT1",
-            tests_pcb,
-            serial_number_pcb,
-            part_number_pcb,
-            revision_pcb,
-            batch_number,
-            None,
-            ["src/drone/python-client/pcb_coating.jpeg"],
-        )
-        if not passed_pcb:
-            continue
-
-        # Execute Cell Tests
-        tests_cell = [
-            (esr_test, timedelta(seconds=2)),
-            (cell_voltage_test, timedelta(seconds=0.1)),
-            (ir_test, timedelta(seconds=5)),
-            (charge_discharge_cycle_test, timedelta(seconds=2)),
-        ]
-        passed_cell, failed_step_cell = handle_procedure(
-            "FVT2",
-            tests_cell,
-            serial_number_cell,
-            part_number_cell,
-            revision_cell,
-            batch_number,
-            None,
-            None,
-        )
-        if not passed_cell:
-            continue
-
-        # Execute Assembly Tests
-        tests_assembly = [
-            (battery_connection, timedelta(seconds=0.1)),
-            (voltage_value, timedelta(seconds=1)),
-            (internal_resistance, timedelta(seconds=1)),
-            (thermal_runaway_detection, timedelta(seconds=2)),
-            (state_of_health, timedelta(seconds=2)),
-            (state_of_charge, timedelta(seconds=2)),
-        ]
-        handle_procedure(
-            "FVT3",
-            tests_assembly,
-            serial_number_assembly,
-            part_number_assembly,
-            revision_assembly,
-            batch_number,
+    )
+
+    if pipelined:
+        line = Pipeline(
             [
-                {"serial_number": serial_number_pcb},
-                {"serial_number": serial_number_cell},
-            ],
-            None,
+                Stage(name, pipeline_stage(test_procedure, uploads), workers=nests)
+                for name, test_procedure in procedures
+            ]
         )
-
-
-# Run all procedures for 20 units
-execute_procedures(20)
+        return line.run(serial_numbers)
+
+    # Test the batteries on every nest of the fixture and queue each Run for
+    # upload
+    with StationExecutor(nests) as station:
+        for runs in station.map(test_unit, serial_numbers):
+            for run in runs:
+                if spc is not None:
+                    spc.observe_run(run)
+                uploads.submit(**run)
+
+
+# Nests of the fixture, and of every station when pipelined, from
+# TOFUPILOT_NESTS; each procedure runs on a station of its own when
+# TOFUPILOT_PIPELINED is set
+nests = int(os.environ.get("TOFUPILOT_NESTS", 1))
+pipelined = bool(os.environ.get("TOFUPILOT_PIPELINED"))
+
+
+# Test a batch of units and upload their Runs with the given client
+def main(client=client, nests=nests, pipelined=pipelined):
+    # Runs are uploaded in the background so the next unit starts right away,
+    # through an on-disk spool when TOFUPILOT_SPOOL_DIR is set
+    uploads = open_uploader(client, metrics)
+
+    # Run all procedures for 20 units
+    stats = execute_procedures(20, uploads, nests, pipelined)
+    uploads.close()
+    if stats is not None:
+        print(stats.format())
+    if spc is not None:
+        print(spc.format())
+
+
+if __name__ == "__main__":
+    main()
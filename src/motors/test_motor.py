@@ -1,9 +1,37 @@
 from tofupilot import TofuPilotClient
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import partial
+import os
 import random
+import sys
 import uuid
 
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from station.steps import StepPlan, as_steps
+from station.executor import StationExecutor
+from station.metrics import open_metrics
+from station.models import MOTOR_FVT1, draw, step_table, steps_by_name
+from station.ordering import open_scheduler
+from station.serials import open_serial_allocator
+from station.spc import open_spc
+from station.trace import open_trace
+from station.uploads import open_uploader
+
 client = TofuPilotClient()
+serials = open_serial_allocator()
+# Step timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+# Control charts of the measurements, when TOFUPILOT_SPC_BASELINE is set
+spc = open_spc()
+
+
+# Simulated FPY, duration and measurement range of each step, shared with
+# the line and yield simulators
+model = steps_by_name(MOTOR_FVT1)
 
 
 # Simulate FPY for each step
@@ -13,27 +41,27 @@ def simulate_test_result(passed_prob):
 
 # Boolean Steps
 def visual_inspection_connector():
-    passed = simulate_test_result(1)
+    passed, _ = draw(model["visual_inspection_connector"])
     return passed, None, None, None, None
 
 
 def power_on_test():
-    passed = simulate_test_result(1)
+    passed, _ = draw(model["power_on_test"])
     return passed, None, None, None, None
 
 
 def motor_startup_test():
-    passed = simulate_test_result(0.99)
+    passed, _ = draw(model["motor_startup_test"])
     return passed, None, None, None, None
 
 
 def speed_consistency_no_load_test():
-    passed = simulate_test_result(0.98)
+    passed, _ = draw(model["speed_consistency_no_load_test"])
     return passed, None, None, None, None
 
 
 def encoder_feedback_test():
-    passed = simulate_test_result(0.99)
+    passed, _ = draw(model["encoder_feedback_test"])
     return passed, None, None, None, None
 
 
@@ -45,172 +73,179 @@ def thermal_stability_test():
 # Numeric Measurement Steps
 # Verifies that the motor receives the correct voltage and current when powered on.
 def power_supply_check_voltage():
-    passed = simulate_test_result(0.99)
-    value_measured = (
-        round(random.uniform(11.5, 12.5), 1)
-        if passed
-        else round(random.uniform(10.0, 11.0), 1)
-    )
+    passed, value_measured = draw(model["power_supply_check_voltage"], 1)
     return passed, value_measured, "V", 11.5, 12.5
 
 
 def power_supply_check_current():
-    passed = simulate_test_result(0.99)
-    value_measured = (
-        round(random.uniform(0, 1.5), 2) if passed else round(random.uniform(1.6, 2), 2)
-    )
+    passed, value_measured = draw(model["power_supply_check_current"], 2)
     return passed, value_measured, "A", None, 1.50
 
 
 # Evaluates the RPM of the motor without any load to verify speed consistency.
 def motor_startup_rpm():
-    passed = simulate_test_result(0.99)
-    value_measured = (
-        round(random.uniform(100, 1500)) if passed else round(random.uniform(50, 99))
-    )
+    passed, value_measured = draw(model["motor_startup_rpm"])
     return passed, value_measured, "RPM", 100, None
 
 
 # Verifies that the encoder is providing accurate feedback for speed and position.
 def encoder_feedback_measurement():
-    passed = simulate_test_result(0.99)
-    value_measured = (
-        round(random.uniform(0.5, 4.9), 1)
-        if passed
-        else round(random.uniform(5.1, 10), 1)
-    )
+    passed, value_measured = draw(model["encoder_feedback_measurement"], 1)
     return passed, value_measured, "% deviation", 0, 5
 
 
 def backlash_response_time_test():
-    passed = simulate_test_result(0.95)
-    value_measured = (
-        round(random.uniform(0, 0.19), 3)
-        if passed
-        else round(random.uniform(0.21, 0.5), 3)
-    )
+    passed, value_measured = draw(model["backlash_response_time_test"], 3)
     return passed, value_measured, "seconds", None, 0.2
 
 
 #  Runs the motor at full speed and then tests the braking system
 def full_speed_braking_test():
-    passed = simulate_test_result(0.8)
-    value_measured = (
-        round(random.uniform(1.5, 2), 2) if passed else round(random.uniform(2.1, 3), 2)
-    )
+    passed, value_measured = draw(model["full_speed_braking_test"], 2)
     return passed, value_measured, "seconds", None, 2
 
 
 # Monitors the motor’s temperature when running under load.
 def thermal_reading():
-    passed = simulate_test_result(0.75)
-    value_measured = (
-        round(random.uniform(75, 80), 1)
-        if passed
-        else round(random.uniform(81, 100), 1)
-    )
+    passed, value_measured = draw(model["thermal_reading"], 1)
     return passed, value_measured, "°C", None, 80
 
 
 def motor_noise():
-    passed = simulate_test_result(0.92)
-    value_measured = (
-        round(random.uniform(45, 50)) if passed else round(random.uniform(51, 55))
-    )
+    passed, value_measured = draw(model["motor_noise"])
     return passed, value_measured, "dB", None, 50
 
 
 # Runs the motor at full speed
 def final_rpm_reading():
-    passed = simulate_test_result(1)
-    value_measured = (
-        round(random.uniform(2900, 3100))
-        if passed
-        else round(random.uniform(2500, 2900))
-    )
+    passed, value_measured = draw(model["final_rpm_reading"])
     return passed, value_measured, "RPM", 2900, 3100
 
 
 # Running Steps
-def run_test(test, duration):
-    start_time = datetime.now()
-    passed, value_measured, unit, limit_low, limit_high = test()
-
-    step = {
-        "name": test.__name__,
-        "started_at": start_time,
-        "duration": duration,
-        "step_passed": passed,
-        "measurement_unit": unit,
-        "measurement_value": value_measured,
-        "limit_low": limit_low,
-        "limit_high": limit_high,
+# The step table is compiled once and reused for every unit; the order and
+# durations of the steps are those of the model
+plan = StepPlan(
+    step_table(
+        MOTOR_FVT1,
+        [
+            visual_inspection_connector,
+            power_on_test,
+            power_supply_check_voltage,
+            power_supply_check_current,
+            motor_startup_test,
+            motor_startup_rpm,
+            speed_consistency_no_load_test,
+            encoder_feedback_measurement,
+            backlash_response_time_test,
+            full_speed_braking_test,
+            thermal_reading,
+            motor_noise,
+            encoder_feedback_test,
+            final_rpm_reading,
+        ],
+    ),
+    procedure_id="FVT1",
+)
+
+# Steps that must pass before another can run; the others may be reordered
+depends = {
+    "power_on_test": ["visual_inspection_connector"],
+    "power_supply_check_voltage": ["power_on_test"],
+    "power_supply_check_current": ["power_on_test"],
+    "motor_startup_test": ["power_supply_check_voltage", "power_supply_check_current"],
+    "motor_startup_rpm": ["motor_startup_test"],
+    "speed_consistency_no_load_test": ["motor_startup_test"],
+    "encoder_feedback_measurement": ["motor_startup_test"],
+    "encoder_feedback_test": ["encoder_feedback_measurement"],
+    "backlash_response_time_test": ["motor_startup_test"],
+    "full_speed_braking_test": ["motor_startup_test"],
+    "thermal_reading": ["motor_startup_test"],
+    "motor_noise": ["motor_startup_test"],
+    "final_rpm_reading": ["full_speed_braking_test", "thermal_reading", "motor_noise"],
+}
+# Faster step orders learned from history, when TOFUPILOT_STEP_HISTORY is set
+scheduler = open_scheduler(plan, depends)
+
+
+def run_all_tests(plan):
+    # Stop the test execution if any step fails
+    run_passed, records, _ = plan.run(fail_fast=True, trace=trace, metrics=metrics)
+    return run_passed, as_steps(records)
+
+
+# Unit Under Test (UUT) identification
+part_number = "00109"
+revision = "A"
+static_segment = "4J"
+batch_number = "1024"
+
+
+# Test a single unit and return its Run for TofuPilot
+def test_unit(serial_number, plan=plan):
+    # Run all tests
+    run_passed, steps = run_all_tests(plan)
+
+    return {
+        "procedure_id": "FVT1",
+        "unit_under_test": {
+            "part_number": part_number,
+            "revision": revision,
+            "serial_number": serial_number,
+            "batch_number": batch_number,
+        },
+        "run_passed": run_passed,
+        "steps": steps,
+        "report_variables": {
+            "motor_serial_number": serial_number,
+            "production_date": str(datetime.now().strftime("%d.%m.%Y")),
+            "report_date": str(datetime.now().strftime("%d.%m.%Y")),
+        },
+        "attachments": ["./motors/motor_connector.png"],
     }
-    return step
-
-
-def run_all_tests():
-    tests = [
-        (visual_inspection_connector, timedelta(seconds=8)),
-        (power_on_test, timedelta(seconds=1)),
-        (power_supply_check_voltage, timedelta(seconds=3)),
-        (power_supply_check_current, timedelta(seconds=3)),
-        (motor_startup_test, timedelta(seconds=15)),
-        (motor_startup_rpm, timedelta(seconds=20)),
-        (speed_consistency_no_load_test, timedelta(seconds=10)),
-        (encoder_feedback_measurement, timedelta(seconds=4)),
-        (backlash_response_time_test, timedelta(seconds=6)),
-        (full_speed_braking_test, timedelta(seconds=12)),
-        (thermal_reading, timedelta(seconds=10)),
-        (motor_noise, timedelta(seconds=18)),
-        (encoder_feedback_test, timedelta(seconds=4)),
-        (final_rpm_reading, timedelta(seconds=15)),
-    ]
-
-    steps = []
-
-    for test, duration in tests:
-        step = run_test(test, duration)
-        steps.append(step)
-        if not step["step_passed"]:
-            break  # Stop the test execution if any step fails
-
-    return steps
 
 
 # Main function
-def handle_test(end):
-    for _ in range(end):
-        # Generate a unique serial number for each Unit Under Test (UUT)
-        part_number = "00109"
-        revision = "A"
-        static_segment = "4J"
-        batch_number = "1024"
-        random_digits = "".join([str(random.randint(0, 9)) for _ in range(5)])
-        serial_number = f"{part_number}{revision}{static_segment}{random_digits}"
-
-        # Run all tests
-        steps = run_all_tests()
-
-        # Create a Run on TofuPilot
-        client.create_run(
-            procedure_id="FVT1",
-            unit_under_test={
-                "part_number": part_number,
-                "revision": revision,
-                "serial_number": serial_number,
-                "batch_number": batch_number,
-            },
-            run_passed=all(step["step_passed"] for step in steps),
-            steps=steps,
-            report_variables={
-                "motor_serial_number": serial_number,
-                "production_date": str(datetime.now().strftime("%d.%m.%Y")),
-                "report_date": str(datetime.now().strftime("%d.%m.%Y")),
-            },
-            attachments=["./motors/motor_connector.png"],
-        )
-
-
-# Run mock-up for multiple units
-handle_test(10)
+def handle_test(end, uploads, nests=1):
+    # Run the steps in the order the step history shows to be fastest. The
+    # plan is passed to every unit, as worker processes import the template
+    # with the original order
+    order = plan
+    if scheduler is not None:
+        proposal = scheduler.propose(plan)
+        if proposal.worthwhile:
+            print(proposal.format())
+            order = proposal.plan
+
+    # Allocate a unique serial number for each Unit Under Test (UUT)
+    serial_numbers = serials.allocate_block(
+        f"{part_number}{revision}{static_segment}", end
+    )
+
+    # Test the units on every nest of the fixture and queue each Run for upload
+    with StationExecutor(nests) as station:
+        for run in station.map(partial(test_unit, plan=order), serial_numbers):
+            if spc is not None:
+                spc.observe_run(run)
+            if scheduler is not None:
+                scheduler.observe_run(run)
+            uploads.submit(**run)
+    if scheduler is not None:
+        scheduler.save()
+
+
+# Test a batch of units and upload their Runs with the given client
+def main(client=client):
+    # Runs are uploaded in the background so the next unit starts right away,
+    # through an on-disk spool when TOFUPILOT_SPOOL_DIR is set
+    uploads = open_uploader(client, metrics)
+
+    # Run mock-up for multiple units
+    handle_test(10, uploads)
+    uploads.close()
+    if spc is not None:
+        print(spc.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,17 @@ import openhtf as htf
 from openhtf.util import units
 import random
 from tofupilot import UploadToTofuPilot
+import os
+import sys
+
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.callbacks import BackgroundCallbacks
+from station.metrics import open_metrics
+from station.plugs import MultimeterPlug, PowerSupplyPlug
+from station.serials import open_serial_allocator
+from station.trace import open_trace
 
 
 # Utility function to simulate the test result with a given pass probability
@@ -29,15 +40,19 @@ def check_led_switch_on():
 
 @htf.measures(
     htf.Measurement('input_voltage').in_range(20, 60).with_units(units.VOLT))
-def test_voltage_input(test):
+@htf.plug(psu=PowerSupplyPlug)
+def test_voltage_input(test, psu):
     passed = simulate_test_result(0.99) 
-    test.measurements.input_voltage = round(random.uniform(40, 60)) if passed else round(random.uniform(20, 30))
+    value_measured = round(random.uniform(40, 60)) if passed else round(random.uniform(20, 30))
+    test.measurements.input_voltage = psu.measure_voltage("IN", value_measured)
 
 @htf.measures(
     htf.Measurement('output_voltage').in_range(220, 240).with_units(units.VOLT))
-def test_voltage_output(test):
+@htf.plug(dmm=MultimeterPlug)
+def test_voltage_output(test, dmm):
     passed = simulate_test_result(0.99) 
-    test.measurements.output_voltage = round(random.uniform(220, 240)) if passed else round(random.uniform(190, 200))
+    value_measured = round(random.uniform(220, 240)) if passed else round(random.uniform(190, 200))
+    test.measurements.output_voltage = dmm.measure_voltage(value_measured)
 
 @htf.measures(
     htf.Measurement('current_protection_triggered').in_range(maximum=25).with_units(units.AMPERE))
@@ -89,11 +104,31 @@ test = htf.Test(
     revision="A",
 )
 
-test.add_output_callbacks(UploadToTofuPilot())
+# Upload in the background so test.execute returns as soon as the record
+# is final; pending uploads are flushed at exit
+uploads = BackgroundCallbacks(UploadToTofuPilot())
+test.add_output_callbacks(uploads)
+
+# Phase timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+if trace is not None:
+    test.add_output_callbacks(trace.openhtf_callback)
+
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+if metrics is not None:
+    test.add_output_callbacks(metrics.openhtf_callback)
+
+serials = open_serial_allocator()
+
+
+# Execute the test for one unit, under a unique Serial Number unless one was
+# scanned
+def test_unit(serial_number=None):
+    if serial_number is None:
+        serial_number = serials.allocate("00220A4J")
+    return test.execute(lambda: serial_number)
 
-# Generate random Serial Number
-random_digits = "".join([str(random.randint(0, 9)) for _ in range(5)])
-serial_number = f"00220A4J{random_digits}"
 
-# Execute the test
-test.execute(lambda: serial_number)
\ No newline at end of file
+if __name__ == "__main__":
+    test_unit()
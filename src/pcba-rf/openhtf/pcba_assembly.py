@@ -2,8 +2,21 @@ import openhtf as htf
 from openhtf.output.callbacks import json_factory
 import tofupilot as tp
 from openhtf.util import units
+import numpy as np
 import random
 from tofupilot import UploadToTofuPilot
+import os
+import sys
+
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.callbacks import BackgroundCallbacks
+from station.metrics import open_metrics
+from station.plugs import PowerSupplyPlug
+from station.serials import open_serial_allocator
+from station.sweep import LimitMask, Sweep
+from station.trace import open_trace
 
 
 # Utility function to simulate the test result with a given pass probability
@@ -45,11 +58,12 @@ def pcba_firmware_version(test):
     .in_range(maximum=80.0)
     .with_units(units.WATT)
 )
-def check_power_consumption(test):
+@htf.plug(psu=PowerSupplyPlug)
+def check_power_consumption(test, psu):
     """Measure the power consumption of the unit (in Watts)."""
     passed = simulate_test_result(0.99) 
     value_measured = round(random.uniform(75, 80), 1) if passed else round(random.uniform(81, 85), 1)
-    test.measurements.power_consumption = value_measured
+    test.measurements.power_consumption = psu.measure_power(value_measured)
 
 
 # Numeric Measurement: Thermal Sensor Check
@@ -71,11 +85,12 @@ def check_thermal_sensor(test):
     .in_range(minimum=11.5, maximum=12.5)
     .with_units(units.VOLT)
 )
-def check_power_supply_12V(test):
+@htf.plug(psu=PowerSupplyPlug)
+def check_power_supply_12V(test, psu):
     """Check the 12V power supply output."""
     passed = simulate_test_result(0.95)
     value_measured = round(random.uniform(12, 12.5), 1) if passed else round(random.uniform(10.5, 11.4), 1)
-    test.measurements.voltage_12V = value_measured
+    test.measurements.voltage_12V = psu.measure_voltage("12V", value_measured)
 
 
 # Numeric Measurement: 3.3V Power Supply Check
@@ -84,11 +99,12 @@ def check_power_supply_12V(test):
     .in_range(minimum=3.0, maximum=3.6)
     .with_units(units.VOLT)
 )
-def check_power_supply_3V3(test):
+@htf.plug(psu=PowerSupplyPlug)
+def check_power_supply_3V3(test, psu):
     """Check the 3.3V power supply output."""
     passed = simulate_test_result(0.90)
     value_measured = round(random.uniform(3.3, 3.6), 2) if passed else round(random.uniform(1.1, 2.9), 2)
-    test.measurements.voltage_3V3 = value_measured
+    test.measurements.voltage_3V3 = psu.measure_voltage("3V3", value_measured)
 
 
 # Boolean Step: EEPROM Read Check
@@ -115,39 +131,45 @@ def check_JTAG_connector():
     return htf.PhaseResult.CONTINUE if simulate_test_result(0.99) else htf.PhaseResult.STOP
 
 
-# Numeric Measurement: Gain Bandwidth at 15 GHz
-@htf.measures(
-    htf.Measurement("gain_bandwidth_15GHz")
-    .in_range(minimum=-7.2, maximum=-6.8)
-    .with_units(units.DECIBEL_MILLIWATTS)
+# Sweep Measurement: Gain across the 15-16 GHz band
+# The whole trace is checked against the limit mask in one pass and attached
+# as a .npy file; only the figures derived from it are measurements
+SWEEP_GHZ = np.linspace(14.0, 17.0, 3001)
+GAIN_MASK = LimitMask(
+    lower=[(15.0, -7.2), (16.0, -7.2)],
+    upper=[(14.0, -6.8), (17.0, -6.8)],
 )
-def check_gain_bandwidth_at_15GHz(test):
-    """Check the gain and bandwidth at 15 GHz."""
-    passed = simulate_test_result(0.98)
-    value_measured = round(random.uniform(-7.2, -6.8), 1) if passed else round(random.uniform(-7.8, -7.3),1)
-    test.measurements.gain_bandwidth_15GHz = value_measured
 
-# Numeric Measurement: Gain Bandwidth at 15 GHz
-@htf.measures(
-    htf.Measurement("gain_bandwidth_15p5GHz")
-    .in_range(minimum=-7.2, maximum=-6.8)
-    .with_units(units.DECIBEL_MILLIWATTS)
-)
-def check_gain_bandwidth_at_15p5GHz(test):
-    passed = simulate_test_result(0.99)
-    value_measured = round(random.uniform(-7.2, -6.8), 1) if passed else round(random.uniform(-7.8, -7.3),1)    
-    test.measurements.gain_bandwidth_15p5GHz = value_measured
 
-# Numeric Measurement: Gain Bandwidth at 15 GHz
+# Simulate a band-pass response with a little ripple, sagging on a failed unit
+def simulate_gain_sweep(passed):
+    offset = random.uniform(-7.05, -6.95) if passed else random.uniform(-7.6, -7.3)
+    ripple = np.random.normal(0, 0.02, SWEEP_GHZ.shape)
+    rolloff = 10 * np.log10(1 + ((SWEEP_GHZ - 15.5) / 0.75) ** 12)
+    return Sweep(SWEEP_GHZ, offset + ripple - rolloff)
+
+
 @htf.measures(
-    htf.Measurement("gain_bandwidth_16GHz")
-    .in_range(minimum=-7.2, maximum=-6.8)
-    .with_units(units.DECIBEL_MILLIWATTS)
+    htf.Measurement("gain_min_15_16GHz")
+    .in_range(minimum=-7.2)
+    .with_units(units.DECIBEL_MILLIWATTS),
+    htf.Measurement("gain_max_15_16GHz")
+    .in_range(maximum=-6.8)
+    .with_units(units.DECIBEL_MILLIWATTS),
+    htf.Measurement("bandwidth_3dB")
+    .in_range(minimum=1.0)
+    .with_units(units.GIGAHERTZ),
+    htf.Measurement("gain_mask_violations").in_range(maximum=0),
 )
-def check_gain_bandwidth_at_16GHz(test):
-    passed = simulate_test_result(0.99)
-    value_measured = round(random.uniform(-7.2, -6.8), 1) if passed else round(random.uniform(-7.8, -7.3),1)        
-    test.measurements.gain_bandwidth_16GHz = value_measured
+def check_gain_sweep(test):
+    """Sweep the gain from 14 to 17 GHz and check it against the limit mask."""
+    sweep = simulate_gain_sweep(simulate_test_result(0.96))
+    summary = sweep.summary(GAIN_MASK, band=(15.0, 16.0))
+    test.measurements.gain_min_15_16GHz = round(summary["min"], 2)
+    test.measurements.gain_max_15_16GHz = round(summary["max"], 2)
+    test.measurements.bandwidth_3dB = round(summary["bandwidth_3dB"], 3)
+    test.measurements.gain_mask_violations = summary["violations"]
+    test.attach("gain_sweep.npy", sweep.to_npy(), mimetype="application/octet-stream")
 
 
 # Define the test plan with all steps
@@ -163,20 +185,38 @@ test = htf.Test(
     write_eeprom,
     read_and_write_eMMC,
     check_JTAG_connector,
-    check_gain_bandwidth_at_15GHz,
-    check_gain_bandwidth_at_15p5GHz,
-    check_gain_bandwidth_at_16GHz, 
+    check_gain_sweep,
     procedure_id="FVT3",
     part_number="00389",
     sub_units=[{"serial_number": "00375A4J34856"}],
     revision="A",
 )
 
-test.add_output_callbacks(UploadToTofuPilot())
+# Upload in the background so test.execute returns as soon as the record
+# is final; pending uploads are flushed at exit
+uploads = BackgroundCallbacks(UploadToTofuPilot())
+test.add_output_callbacks(uploads)
+
+# Phase timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+if trace is not None:
+    test.add_output_callbacks(trace.openhtf_callback)
+
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+if metrics is not None:
+    test.add_output_callbacks(metrics.openhtf_callback)
+
+serials = open_serial_allocator()
+
+
+# Execute the test for one unit, under a unique Serial Number unless one was
+# scanned
+def test_unit(serial_number=None):
+    if serial_number is None:
+        serial_number = serials.allocate("00389B4J")
+    return test.execute(lambda: serial_number)
 
-# Generate random Serial Number
-random_digits = "".join([str(random.randint(0, 9)) for _ in range(5)])
-serial_number = f"00389B4J{random_digits}"
 
-# Execute the test
-test.execute(lambda: serial_number)
\ No newline at end of file
+if __name__ == "__main__":
+    test_unit()
@@ -1,10 +1,32 @@
 from tofupilot import TofuPilotClient
 from datetime import datetime, timedelta
+from functools import partial
+import os
 import random
+import sys
 import uuid
 
+# Make the shared station helpers in src/station importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from station.steps import StepPlan, as_steps
+from station.executor import StationExecutor
+from station.metrics import open_metrics
+from station.ordering import open_scheduler
+from station.serials import open_serial_allocator
+from station.spc import open_spc
+from station.trace import open_trace
+from station.uploads import open_uploader
+
 
 client = TofuPilotClient()
+serials = open_serial_allocator()
+# Step timeline, written when TOFUPILOT_TRACE is set
+trace = open_trace()
+# Live metrics, served when TOFUPILOT_METRICS_PORT is set
+metrics = open_metrics()
+# Control charts of the measurements, when TOFUPILOT_SPC_BASELINE is set
+spc = open_spc()
 
 # Simulate FPY (First Pass Yield) for each step
 def simulate_test_result(passed_prob):
@@ -47,70 +69,94 @@ def adc_dac_resolution_check():
 
 
 # Running Steps
-def run_test(test, duration):
-    start_time = datetime.now()
-    passed, value_measured, unit, limit_low, limit_high = test()
-
-    step = {
-        "name": test.__name__,
-        "started_at": start_time,
-        "duration": duration,
-        "step_passed": passed,
-        "measurement_unit": unit,
-        "measurement_value": value_measured,
-        "limit_low": limit_low,
-        "limit_high": limit_high,
+# Execute all steps for the PCBA Motherboard Test, compiled once for every unit
+plan = StepPlan([
+    (power_supply_test, timedelta(seconds=10)),
+    (frequency_range_test, timedelta(seconds=20)),
+    (bandwidth_test, timedelta(seconds=15)),
+    (input_signal_power_test, timedelta(seconds=20)),
+    (output_signal_power_test, timedelta(seconds=15)),
+    (adc_dac_resolution_check, timedelta(seconds=5)),
+    (ddr4_memory_check, timedelta(seconds=30)),
+], procedure_id="FVT2")
+
+# Steps that must pass before another can run; the others may be reordered
+depends = {
+    "frequency_range_test": ["power_supply_test"],
+    "bandwidth_test": ["power_supply_test"],
+    "input_signal_power_test": ["power_supply_test"],
+    "output_signal_power_test": ["input_signal_power_test"],
+    "adc_dac_resolution_check": ["power_supply_test"],
+    "ddr4_memory_check": ["power_supply_test"],
+}
+# Faster step orders learned from history, when TOFUPILOT_STEP_HISTORY is set
+scheduler = open_scheduler(plan, depends)
+
+def run_all_tests(plan):
+    run_passed, records, _ = plan.run(fail_fast=True, trace=trace, metrics=metrics)
+    return run_passed, as_steps(records)
+
+# Unit Under Test (UUT) identification
+part_number = "00375"
+revision = "A"
+static_segment = "4J"
+batch_number = "1024"
+
+# Test a single unit and return its Run for TofuPilot
+def test_unit(serial_number, plan=plan):
+    # Run all tests
+    run_passed, steps = run_all_tests(plan)
+
+    return {
+        "procedure_id": "FVT2",
+        "unit_under_test": {
+            "part_number": part_number,
+            "revision": revision,
+            "serial_number": serial_number,
+            "batch_number": batch_number,
+        },
+        "run_passed": run_passed,
+        "steps": steps,
     }
-    return step
-
-# Execute all steps for the PCBA Motherboard Test
-def run_all_tests():
-    tests = [
-        (power_supply_test, timedelta(seconds=10)),
-        (frequency_range_test, timedelta(seconds=20)),
-        (bandwidth_test, timedelta(seconds=15)),
-        (input_signal_power_test, timedelta(seconds=20)),
-        (output_signal_power_test, timedelta(seconds=15)),
-        (adc_dac_resolution_check, timedelta(seconds=5)),
-        (ddr4_memory_check, timedelta(seconds=30)),
-    ]
-
-    steps = []
-
-    for test, duration in tests:
-        step = run_test(test, duration)
-        steps.append(step)
-        if not step["step_passed"]:
-            break
-
-    return steps
 
 # Manage the test execution and create a test run for each unit
-def handle_test(end):
-   for _ in range(end):
-        # Generate a unique serial number for each Unit Under Test (UUT)
-        part_number = "00375"
-        revision = "A"
-        static_segment = "4J"
-        batch_number = "1024"
-        random_digits = "".join([str(random.randint(0, 9)) for _ in range(5)])
-        serial_number = f"{part_number}{revision}{static_segment}{random_digits}"
-
-        # Run all tests
-        steps = run_all_tests()
-
-        # Create a Run on TofuPilot
-        client.create_run(
-            procedure_id="FVT2",
-            unit_under_test={
-                "part_number": part_number,
-                "revision": revision,
-                "serial_number": serial_number,
-                "batch_number": batch_number,
-            },
-            run_passed=all(step["step_passed"] for step in steps),
-            steps=steps,
-        )
-
-# Run mock-up for 1 unit
-handle_test(9)
+def handle_test(end, uploads, nests=1):
+    # Run the steps in the order the step history shows to be fastest. The
+    # plan is passed to every unit, as worker processes import the template
+    # with the original order
+    order = plan
+    if scheduler is not None:
+        proposal = scheduler.propose(plan)
+        if proposal.worthwhile:
+            print(proposal.format())
+            order = proposal.plan
+
+    # Allocate a unique serial number for each Unit Under Test (UUT)
+    serial_numbers = serials.allocate_block(f"{part_number}{revision}{static_segment}", end)
+
+    # Test the units on every nest of the fixture and queue each Run for upload
+    with StationExecutor(nests) as station:
+        for run in station.map(partial(test_unit, plan=order), serial_numbers):
+            if spc is not None:
+                spc.observe_run(run)
+            if scheduler is not None:
+                scheduler.observe_run(run)
+            uploads.submit(**run)
+    if scheduler is not None:
+        scheduler.save()
+
+# Test a batch of units and upload their Runs with the given client
+def main(client=client):
+    # Runs are uploaded in the background so the next unit starts right away,
+    # through an on-disk spool when TOFUPILOT_SPOOL_DIR is set
+    uploads = open_uploader(client, metrics)
+
+    # Run mock-up for 1 unit
+    handle_test(9, uploads)
+    uploads.close()
+    if spc is not None:
+        print(spc.format())
+
+
+if __name__ == "__main__":
+    main()
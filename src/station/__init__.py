@@ -0,0 +1,5 @@
+"""Shared station helpers used by the TofuPilot templates.
+
+The templates are run as plain scripts (``python src/motors/test_motor.py``),
+so each one puts ``src`` on ``sys.path`` before importing from here.
+"""
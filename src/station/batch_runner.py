@@ -0,0 +1,173 @@
+"""Run several templates in one interpreter, each with its own credentials.
+
+The scheduled workflow used to start a new interpreter for every template
+and organization, paying each time for Python itself, the ``tofupilot``
+import and the template's module-level setup. The batch runner imports
+every template once, keeps one ``TofuPilotClient`` per API key, and calls
+the template's ``main(client)`` hook for every job, so a template run for
+three organizations is imported once and run three times.
+
+A job is ``PATH=KEY_VARIABLE``: a template, or a directory whose ``*.py``
+files are all run, and the environment variable holding the API key of the
+organization to upload to. ``TOFUPILOT_API_KEY`` is set to that key while
+a template is imported, for the client it builds at module level.
+
+``PATH=KEY_VARIABLE,KEY_VARIABLE,...`` runs the templates once and uploads
+the same runs to every organization listed, through a
+``station.fanout.FanoutClient``, instead of testing a batch for each of
+them.
+
+Templates are imported under the name of their file, with their directory
+on ``sys.path`` and registered in ``sys.modules``, as running them directly
+would make them importable. Worker processes of a ``StationExecutor`` with
+several nests can then unpickle ``test_unit`` from them; two templates
+with the same file name cannot run in one batch.
+
+For every job the runner reports the time spent importing the template
+and building the client apart from the time spent running it. A failing
+job does not stop the others; the runner exits with status 1 at the end.
+
+Usage: python -m station.batch_runner PATH=KEY_VARIABLE[,KEY_VARIABLE...]
+[...] (with src/ on PYTHONPATH)
+"""
+
+from time import perf_counter
+import importlib.util
+import logging
+import os
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def expand(path):
+    """Return the template files of ``path``, a file or a directory."""
+    if os.path.isdir(path):
+        return [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.endswith(".py")
+        ]
+    return [path]
+
+
+class BatchRunner:
+    """Templates imported once, run with one client per API key."""
+
+    def __init__(self):
+        self.modules = {}
+        self.clients = {}
+        self.results = []
+
+    def module(self, path):
+        path = os.path.abspath(path)
+        module = self.modules.get(path)
+        if module is None:
+            directory, filename = os.path.split(path)
+            name = os.path.splitext(filename)[0]
+            loaded = sys.modules.get(name)
+            if loaded is not None:
+                raise RuntimeError(
+                    f"cannot import {path} as {name!r}: "
+                    f"{getattr(loaded, '__file__', name)} already is"
+                )
+            # Importable by name, for worker processes to unpickle test_unit
+            if directory not in sys.path:
+                sys.path.insert(0, directory)
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                del sys.modules[name]
+                raise
+            self.modules[path] = module
+        return module
+
+    def client(self, api_keys):
+        """Return the client of ``api_keys``, by key variable, built once."""
+        key = tuple(api_keys.items())
+        client = self.clients.get(key)
+        if client is None:
+            if len(api_keys) > 1:
+                from station.fanout import open_fanout
+
+                client = open_fanout(api_keys)
+            else:
+                from tofupilot import TofuPilotClient
+
+                (api_key,) = api_keys.values()
+                client = TofuPilotClient(api_key=api_key)
+            self.clients[key] = client
+        return client
+
+    def run(self, path, api_keys):
+        """Run one template for the organizations of ``api_keys``."""
+        start = perf_counter()
+        setup = None
+        try:
+            os.environ["TOFUPILOT_API_KEY"] = next(iter(api_keys.values()))
+            module = self.module(path)
+            client = self.client(api_keys)
+            setup = perf_counter() - start
+            module.main(client)
+            ok = True
+        except Exception:
+            logger.exception("%s failed", path)
+            ok = False
+        elapsed = perf_counter() - start
+        if setup is None:
+            setup = elapsed
+        self.results.append((path, ok, setup, elapsed - setup))
+        return ok
+
+    def format(self):
+        lines = [f"{'template':<56}{'setup s':>9}{'run s':>9}  status"]
+        for path, ok, setup, run in self.results:
+            lines.append(
+                f"{os.path.relpath(path):<56}{setup:9.2f}{run:9.2f}  "
+                f"{'ok' if ok else 'FAILED'}"
+            )
+        setup = sum(result[2] for result in self.results)
+        run = sum(result[3] for result in self.results)
+        lines.append(f"{'total':<56}{setup:9.2f}{run:9.2f}")
+        return "\n".join(lines)
+
+    def close(self):
+        """Close the fan-out clients and print what each organization got."""
+        from station.fanout import FanoutClient
+
+        for client in self.clients.values():
+            if isinstance(client, FanoutClient):
+                print(client.format())
+                client.close()
+
+
+def main(argv=None):
+    logging.basicConfig()
+    jobs = []
+    for arg in argv if argv is not None else sys.argv[1:]:
+        path, sep, variables = arg.rpartition("=")
+        if not sep:
+            raise SystemExit(f"expected PATH=KEY_VARIABLE, got {arg!r}")
+        api_keys = {}
+        for variable in variables.split(","):
+            api_key = os.environ.get(variable)
+            if not api_key:
+                raise SystemExit(f"{variable} is not set")
+            api_keys[variable] = api_key
+        jobs.extend((template, api_keys) for template in expand(path))
+
+    start = perf_counter()
+    runner = BatchRunner()
+    # Every job runs, even after one has failed
+    ok = all([runner.run(path, api_keys) for path, api_keys in jobs])
+    runner.close()
+    print(runner.format())
+    print(f"wall time {perf_counter() - start:.2f} s")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""openhtf output callbacks run in the background, after ``test.execute``.
+
+openhtf calls its output callbacks synchronously at the end of
+``test.execute``, so an uploading callback such as ``UploadToTofuPilot``
+keeps the operator waiting on the network before the next board can be
+loaded. ``BackgroundCallbacks`` is itself an output callback: it takes a
+deep copy of the finalized test record, so nothing the framework does to it
+afterwards can change what is uploaded, puts the copy on a bounded queue
+and returns.
+
+A single worker thread hands every record to the wrapped callbacks, in the
+order the tests finished. When the queue is full the next test waits, which
+keeps a station from running arbitrarily far ahead of a slow server. The
+queue is flushed when the wrapper is closed or the interpreter exits.
+"""
+
+import atexit
+import copy
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundCallbacks:
+    """Runs ``callbacks`` on a worker thread for every finished test record."""
+
+    def __init__(self, *callbacks, maxsize=16):
+        self.callbacks = callbacks
+        self.handled = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize)
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._worker, name="output-callbacks", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __call__(self, record):
+        if self._closed:
+            raise RuntimeError("background callbacks are closed")
+        self._queue.put(copy.deepcopy(record))
+
+    def pending(self):
+        """Return the number of records waiting for the worker."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every queued record has been handled."""
+        self._queue.join()
+
+    def close(self):
+        """Flush pending records and stop the worker thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _handle(self, record):
+        ok = True
+        for callback in self.callbacks:
+            try:
+                callback(record)
+            except Exception:
+                logger.exception(
+                    "output callback %r raised for %s",
+                    callback,
+                    getattr(record, "dut_id", None),
+                )
+                ok = False
+        if ok:
+            self.handled += 1
+        else:
+            self.failed += 1
+
+    def _worker(self):
+        while True:
+            record = self._queue.get()
+            try:
+                if record is _STOP:
+                    return
+                self._handle(record)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,92 @@
+"""Run several units under test at once, one per fixture nest.
+
+``StationExecutor.map`` calls ``test_unit(serial_number)`` for every serial
+on a pool of ``nests`` workers and yields what each call returns, usually the
+keyword arguments for ``create_run``. Uploads stay in the calling process, so
+a single uploader serves every nest without contention.
+
+With ``processes=True`` (the default) each nest is a worker process and the
+module-level ``random`` generator of the worker is reseeded before every
+unit, giving each unit its own reproducible random stream. With a single
+nest units run in the calling process, also with a stream of their own: the
+state of its generator is put back after every unit, so the rest of the
+template keeps drawing from where it was. Thread nests share the generator
+of the process, so their units are not reproducible; they suit stations
+whose steps mostly wait on instruments.
+
+Worker processes import the template again, so templates keep their entry
+point under ``if __name__ == "__main__":``. They send the station metrics
+they recorded back with every unit, to be served by the calling process.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import random
+
+from station.metrics import REGISTRY
+
+
+def _run_unit(test_unit, serial_number, seed):
+    state = random.getstate()
+    random.seed(seed)
+    try:
+        return test_unit(serial_number)
+    finally:
+        random.setstate(state)
+
+
+def _run_unit_in_worker(test_unit, serial_number, seed):
+    # The worker process is the nest's own, so its generator is reseeded
+    random.seed(seed)
+    return test_unit(serial_number), REGISTRY.drain()
+
+
+class StationExecutor:
+    """Pool of fixture nests that test units concurrently."""
+
+    def __init__(self, nests=1, processes=True):
+        self.nests = nests
+        self.processes = processes
+        self._pool = None
+        if nests > 1:
+            pool_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=nests)
+
+    def map(self, test_unit, serial_numbers, seed=None):
+        """Test every serial number and yield the results in order.
+
+        ``seed`` makes the per-unit random streams reproducible; by default
+        fresh seeds are drawn for every call.
+        """
+        serial_numbers = list(serial_numbers)
+        seeds = random.Random(seed).getrandbits
+        if self._pool is None:
+            for serial_number in serial_numbers:
+                yield _run_unit(test_unit, serial_number, seeds(64))
+            return
+        if not self.processes:
+            # Threads share the generator of the process: units cannot be
+            # reseeded without reseeding each other
+            yield from self._pool.map(test_unit, serial_numbers)
+            return
+        chunksize = max(1, len(serial_numbers) // (self.nests * 4))
+        results = self._pool.map(
+            _run_unit_in_worker,
+            [test_unit] * len(serial_numbers),
+            serial_numbers,
+            [seeds(64) for _ in serial_numbers],
+            chunksize=chunksize,
+        )
+        for result, metrics in results:
+            if metrics:
+                REGISTRY.merge(metrics)
+            yield result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,220 @@
+"""Upload the runs of one test session to several organizations at once.
+
+The scheduled workflow ran the drone template once per organization, so
+every organization got its own independently simulated batch and every
+run was tested again for each of them. ``FanoutClient`` stands in for
+``TofuPilotClient`` in front of N organizations: the template runs once,
+and ``create_run`` hands every run to one ``TofuPilotClient`` per
+organization, concurrently on a shared thread pool. Each client gets its
+own copy of the run, as ``create_run`` rewrites the steps it is given.
+
+A run is created first, without its attachments, and the attachments are
+then uploaded to the run the organization returned, with the client's own
+upload code. What each organization received is recorded in a
+``DeliveryLedger``, so when a run is retried, by the upload queue or by a
+spool replaying it in another process, an organization that already has
+the run only gets its missing attachments, and one that has everything
+gets nothing. A run only counts as uploaded once every organization has
+all of it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import time
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+from station.uploads import accepted
+
+logger = logging.getLogger(__name__)
+
+
+def run_key(run, attachments=None):
+    """Return a digest identifying a run, the same when it is replayed."""
+    data = json.dumps(
+        {"run": run, "attachments": attachments}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class DeliveryLedger:
+    """Runs created in each organization, and whether their files followed."""
+
+    def __init__(self, path, ttl=7 * 86400.0):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS deliveries ("
+                " run_key TEXT NOT NULL,"
+                " tenant TEXT NOT NULL,"
+                " run_id TEXT NOT NULL,"
+                " attached INTEGER NOT NULL,"
+                " delivered_at REAL NOT NULL,"
+                " PRIMARY KEY (run_key, tenant))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        """Return ``{tenant: (run_id, attached)}`` for the run ``key``."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT tenant, run_id, attached FROM deliveries WHERE run_key = ?",
+                (key,),
+            ).fetchall()
+        return {tenant: (run_id, bool(attached)) for tenant, run_id, attached in rows}
+
+    def record(self, key, tenant, run_id, attached):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?, ?, ?)",
+                (key, tenant, run_id, int(attached), time()),
+            )
+
+    def forget(self, key):
+        """Drop a run every organization has received in full."""
+        with self._connect() as db:
+            db.execute("DELETE FROM deliveries WHERE run_key = ?", (key,))
+
+    def purge(self):
+        """Delete the deliveries of runs given up on, older than the time to live."""
+        with self._connect() as db:
+            db.execute("DELETE FROM deliveries WHERE delivered_at < ?", (time() - self.ttl,))
+
+
+def _attach(client, paths, run_id):
+    # The clients have no public call to attach files to an existing run:
+    # use the functions their create_run uploads attachments with
+    module = sys.modules[type(client).__module__]
+    module.validate_files(
+        client._logger, paths, client._max_attachments, client._max_file_size
+    )
+    args = [client._logger, client._headers, client._url, paths, run_id]
+    if hasattr(client, "_verify"):
+        args.append(client._verify)
+    module.upload_attachments(*args)
+
+
+class FanoutClient:
+    """``create_run`` of one test session, sent to several organizations."""
+
+    def __init__(self, clients, ledger, workers=8):
+        # TofuPilotClient by organization name
+        self.clients = dict(clients)
+        self.ledger = ledger
+        self.stats = {name: [0, 0] for name in self.clients}
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="fanout")
+        self._lock = threading.Lock()
+
+    def create_run(self, attachments=None, **run):
+        """Upload a run to every organization that does not have it yet.
+
+        Returns the run ids by organization, or ``{"success": False, ...}``,
+        like the client on an HTTP error, when any organization is missing
+        the run or its attachments.
+        """
+        key = run_key(run, attachments)
+        delivered = self.ledger.get(key)
+        pending = [
+            name
+            for name in self.clients
+            if not (name in delivered and delivered[name][1])
+        ]
+        futures = [
+            self._pool.submit(self._deliver, key, name, run, attachments, delivered.get(name))
+            for name in pending
+        ]
+        ids = {name: run_id for name, (run_id, _) in delivered.items()}
+        failed = []
+        for name, future in zip(pending, futures):
+            try:
+                run_id = future.result()
+            except Exception:
+                logger.exception("upload to %s raised", name)
+                run_id = None
+            with self._lock:
+                self.stats[name][run_id is None] += 1
+            if run_id is None:
+                failed.append(name)
+            else:
+                ids[name] = run_id
+
+        if failed:
+            return {"success": False, "failed": failed, "ids": ids}
+        self.ledger.forget(key)
+        return {"success": True, "ids": ids}
+
+    def _deliver(self, key, name, run, attachments, delivered):
+        """Create the run in one organization and attach its files; return its id."""
+        client = self.clients[name]
+        if delivered is None:
+            result = client.create_run(**copy.deepcopy(run))
+            run_id = result.get("id") if isinstance(result, dict) else None
+            if not accepted(result) or not run_id:
+                logger.error("%s did not accept the run: %s", name, result)
+                return None
+            # Recorded at once, so a retry never creates the run twice
+            self.ledger.record(key, name, run_id, not attachments)
+        else:
+            run_id = delivered[0]
+        if attachments:
+            _attach(client, list(attachments), run_id)
+            self.ledger.record(key, name, run_id, True)
+        return run_id
+
+    def format(self):
+        return "\n".join(
+            f"{name}: {uploaded} uploaded, {failed} failed"
+            for name, (uploaded, failed) in self.stats.items()
+        )
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def open_ledger():
+    """Return the delivery ledger of this machine.
+
+    The database is ``TOFUPILOT_FANOUT_DB``, by default
+    ``~/.tofupilot/fanout.sqlite``; runs not delivered everywhere are given
+    up on after ``TOFUPILOT_FANOUT_TTL`` seconds, a week by default.
+    """
+    path = os.environ.get(
+        "TOFUPILOT_FANOUT_DB",
+        os.path.join(os.path.expanduser("~"), ".tofupilot", "fanout.sqlite"),
+    )
+    ledger = DeliveryLedger(path, float(os.environ.get("TOFUPILOT_FANOUT_TTL", 7 * 86400)))
+    ledger.purge()
+    return ledger
+
+
+def open_fanout(api_keys, url=None):
+    """Return a ``FanoutClient`` for ``api_keys``, by organization name.
+
+    Name organizations after the environment variables holding their keys,
+    so logs never show a key.
+    """
+    from tofupilot import TofuPilotClient
+
+    clients = {
+        name: TofuPilotClient(api_key=api_key, url=url)
+        for name, api_key in api_keys.items()
+    }
+    return FanoutClient(clients, open_ledger())
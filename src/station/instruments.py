@@ -0,0 +1,132 @@
+"""Instrument sessions opened once per process and leased to the tests.
+
+Opening an instrument session (a VISA resource, a socket to a power supply)
+costs far more than a single read, and an instrument answers one client at
+a time. ``InstrumentPool`` opens the session of a resource the first time it
+is leased and keeps it for the life of the process; ``lease`` holds the lock
+of that resource only, so phases using different instruments, or the nests
+of a station, run concurrently while two users of the same instrument take
+turns.
+
+``SimulatedInstrument`` is the local backend of the templates: it sleeps for
+a configurable open and I/O latency and answers every query with the value
+the caller simulated. ``open_instruments`` builds the pool of the station
+from ``TOFUPILOT_INSTRUMENT_LATENCY`` and ``TOFUPILOT_INSTRUMENT_OPEN_LATENCY``
+(seconds, 0 by default), and src/benchmarks/bench_instruments.py measures
+what reusing sessions saves.
+
+``station.plugs`` wraps the pool in openhtf plugs.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter, sleep
+import atexit
+import os
+import threading
+
+
+class SimulatedInstrument:
+    """Session with a simulated instrument answering after ``latency`` seconds."""
+
+    def __init__(self, resource, latency=0.0, open_latency=0.0):
+        self.resource = resource
+        self.latency = latency
+        self.open_latency = open_latency
+        self.queries = 0
+        self.closed = False
+        if open_latency:
+            sleep(open_latency)
+
+    def write(self, command):
+        if self.latency:
+            sleep(self.latency)
+
+    def query(self, command, simulated=None):
+        """Send ``command`` and return the answer, here ``simulated``."""
+        self.queries += 1
+        if self.latency:
+            sleep(self.latency)
+        return simulated
+
+    def close(self):
+        self.closed = True
+
+
+class _Resource:
+    __slots__ = ("lock", "session", "leases", "wait_seconds")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.leases = 0
+        self.wait_seconds = 0.0
+
+
+class InstrumentPool:
+    """Sessions opened with ``factory(resource)`` and shared by lease."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.opened = 0
+        self._resources = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _resource(self, name):
+        with self._lock:
+            resource = self._resources.get(name)
+            if resource is None:
+                resource = self._resources[name] = _Resource()
+            return resource
+
+    @contextmanager
+    def lease(self, name):
+        """Hold the session of the resource ``name`` for the block."""
+        resource = self._resource(name)
+        start = perf_counter()
+        with resource.lock:
+            resource.wait_seconds += perf_counter() - start
+            resource.leases += 1
+            if resource.session is None:
+                resource.session = self.factory(name)
+                self.opened += 1
+            yield resource.session
+
+    def stats(self):
+        """Return ``{resource: (leases, seconds waited for the lock)}``."""
+        with self._lock:
+            resources = dict(self._resources)
+        return {name: (r.leases, r.wait_seconds) for name, r in resources.items()}
+
+    def close(self):
+        """Close every open session; the next lease opens it again."""
+        with self._lock:
+            resources = list(self._resources.values())
+        for resource in resources:
+            with resource.lock:
+                if resource.session is not None:
+                    resource.session.close()
+                    resource.session = None
+
+
+def simulated_pool(latency=0.0, open_latency=0.0):
+    """Return a pool of simulated instruments with the given latencies."""
+    return InstrumentPool(
+        lambda resource: SimulatedInstrument(resource, latency, open_latency)
+    )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def open_instruments():
+    """Return the instrument pool of this process, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = simulated_pool(
+                float(os.environ.get("TOFUPILOT_INSTRUMENT_LATENCY", 0)),
+                float(os.environ.get("TOFUPILOT_INSTRUMENT_OPEN_LATENCY", 0)),
+            )
+        return _pool
@@ -0,0 +1,97 @@
+"""On-disk journal of the steps of a run, written while the run goes on.
+
+A ``StepJournal`` is one JSON Lines file per run: a ``run`` line written
+when the run opens, then the steps in small batches as tests finish, then
+a ``result`` line with the outcome and the report variables. Only the
+current batch is held in memory, and anyone can follow a run by tailing
+its file.
+
+TofuPilot only accepts complete runs, so the run is still uploaded once,
+at the end, from the steps read back from the journal: the journal bounds
+memory and shows progress during the run, not on the dashboards, which
+only see the run when it is uploaded. The journal also keeps every step of
+a session that crashes before its upload.
+"""
+
+from datetime import datetime, timedelta
+import json
+import os
+import re
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"__timedelta__": value.total_seconds()}
+    raise TypeError(f"cannot journal {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    if "__timedelta__" in obj:
+        return timedelta(seconds=obj["__timedelta__"])
+    return obj
+
+
+class StepJournal:
+    """Steps of one run, appended to ``path`` ``batch`` at a time."""
+
+    def __init__(self, path, run, batch=16):
+        self.path = path
+        self.batch = batch
+        self.count = 0
+        self.passed = True
+        self._pending = []
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._write([{"run": run}], "w")
+
+    def _write(self, lines, mode="a"):
+        data = "".join(json.dumps(line, default=_encode) + "\n" for line in lines)
+        with open(self.path, mode, encoding="utf-8") as f:
+            f.write(data)
+
+    def append(self, step):
+        self._pending.append({"step": step})
+        self.count += 1
+        if not step.get("step_passed"):
+            self.passed = False
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._write(pending)
+
+    def close(self, result):
+        """Write the pending steps and the ``result`` of the run."""
+        self.flush()
+        self._write([{"result": result}])
+
+    def steps(self):
+        """Read back every step written so far."""
+        self.flush()
+        steps = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line, object_hook=_decode)
+                if "step" in entry:
+                    steps.append(entry["step"])
+        return steps
+
+
+def open_step_journal(procedure_id, serial_number, run):
+    """Return the journal of a run, or ``None`` if journaling is off.
+
+    Journaling is on when ``TOFUPILOT_STEP_JOURNAL`` names the directory of
+    the journals, one file per procedure and serial number.
+    """
+    directory = os.environ.get("TOFUPILOT_STEP_JOURNAL")
+    if not directory:
+        return None
+    name = re.sub(r"[^\w.-]", "_", f"{procedure_id}-{serial_number}")
+    return StepJournal(os.path.join(directory, name + ".jsonl"), run)
@@ -0,0 +1,397 @@
+"""Discrete-event simulation of a test line on a virtual clock.
+
+A line is a sequence of ``Station`` objects, each running the steps of one
+procedure (a list of ``SimStep``, see ``station.models``) on one or more
+nests. A unit waits in the station queue for a free nest, is loaded by an
+operator, runs the steps with the template's fail-fast semantics and is
+unloaded by an operator again. A failing unit goes to rework and comes back
+to the same station, resuming from the failed step like ``RetestStore``
+does, until it passes or has used up its retests and is scrapped.
+
+Operators are shared by all stations. Units are released into the first
+station either at a fixed interval or, by default, whenever the number of
+units on the line drops below ``wip_limit``, which keeps the bottleneck
+busy.
+
+Nothing sleeps: events are popped from a heap in time order, so a month of
+production takes seconds. ``Line.run`` returns a ``LineReport`` with the
+throughput, cycle time, WIP and the utilization of every station and of the
+operators, and names the bottleneck station.
+
+Usage: python -m station.line_sim [days] [pcb_nests] (from src/)
+"""
+
+from collections import deque
+from datetime import timedelta
+from heapq import heappop, heappush
+from itertools import count
+import random
+import sys
+
+from station.models import DRONE_ASSEMBLY_FVT3, DRONE_CELL_FVT2, DRONE_PCB_FVT1
+
+
+def _seconds(duration):
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    return float(duration)
+
+
+class Simulation:
+    """Event loop on a virtual clock, in seconds."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._order = count()
+
+    def schedule(self, delay, action, *args):
+        """Call ``action(*args)`` ``delay`` seconds from now."""
+        heappush(self._events, (self.now + delay, next(self._order), action, args))
+
+    def run(self, until):
+        """Process every event due before ``until`` and stop the clock there."""
+        events = self._events
+        while events and events[0][0] <= until:
+            self.now, _, action, args = heappop(events)
+            action(*args)
+        self.now = until
+
+
+class _Level:
+    # Time-weighted average of a quantity changing at events
+    __slots__ = ("value", "area", "since")
+
+    def __init__(self):
+        self.value = 0
+        self.area = 0.0
+        self.since = 0.0
+
+    def add(self, now, delta):
+        self.area += self.value * (now - self.since)
+        self.since = now
+        self.value += delta
+
+    def mean(self, now):
+        return (self.area + self.value * (now - self.since)) / now if now else 0.0
+
+
+class Station:
+    """A station of the line: the steps it runs, its nests and handling times."""
+
+    def __init__(
+        self,
+        name,
+        steps,
+        nests=1,
+        load_time=0.0,
+        unload_time=0.0,
+        fail_fast=True,
+        rework_time=0.0,
+        max_retests=1,
+        resume=True,
+    ):
+        self.name = name
+        self.steps = steps
+        self.nests = nests
+        self.load_time = _seconds(load_time)
+        self.unload_time = _seconds(unload_time)
+        self.fail_fast = fail_fast
+        self.rework_time = _seconds(rework_time)
+        self.max_retests = max_retests
+        self.resume = resume
+        self._probs = [step.passed_prob for step in steps]
+        self._durations = [_seconds(step.duration) for step in steps]
+
+    def sample(self, start, random):
+        """Return the test time and the failed step index of one visit."""
+        probs = self._probs
+        durations = self._durations
+        elapsed = 0.0
+        failed = None
+        for index in range(start, len(probs)):
+            elapsed += durations[index]
+            if random() >= probs[index]:
+                if failed is None:
+                    failed = index
+                if self.fail_fast:
+                    break
+        return elapsed, failed
+
+
+class StationStats:
+    __slots__ = (
+        "name", "nests", "queue", "free", "occupied", "queued",
+        "visits", "failures", "scrapped", "test_time",
+    )
+
+    def __init__(self, station):
+        self.name = station.name
+        self.nests = station.nests
+        self.queue = deque()
+        self.free = station.nests
+        self.occupied = _Level()
+        self.queued = _Level()
+        self.visits = 0
+        self.failures = 0
+        self.scrapped = 0
+        self.test_time = 0.0
+
+
+class _Unit:
+    __slots__ = ("released", "start", "retests")
+
+    def __init__(self, released):
+        self.released = released
+        self.start = 0
+        self.retests = 0
+
+
+class LineReport:
+    """Throughput, WIP and utilization of a simulated line."""
+
+    def __init__(self, horizon, released, completed, scrapped, flow_time,
+                 wip, stations, operators, operator_busy, demand=None):
+        self.horizon = horizon
+        self.released = released
+        self.completed = completed
+        self.scrapped = scrapped
+        self.flow_time = flow_time
+        self.wip = wip
+        self.stations = stations
+        self.operators = operators
+        self.operator_busy = operator_busy
+        self.demand = demand
+
+    @property
+    def throughput(self):
+        """Good units leaving the line per second."""
+        return self.completed / self.horizon
+
+    @property
+    def cycle_time(self):
+        """Seconds between two good units at the end of the line."""
+        return self.horizon / self.completed if self.completed else float("inf")
+
+    @property
+    def takt_time(self):
+        """Seconds per unit the demand allows, if a demand was given."""
+        return self.horizon / self.demand if self.demand else None
+
+    @property
+    def operator_utilization(self):
+        if not self.operators:
+            return None
+        return self.operator_busy / (self.operators * self.horizon)
+
+    def utilization(self, station):
+        return station.occupied.mean(self.horizon) / station.nests
+
+    @property
+    def bottleneck(self):
+        """The station whose nests are busiest."""
+        return max(self.stations, key=self.utilization)
+
+    def format(self):
+        hours = self.horizon / 3600
+        lines = [
+            f"{hours:.0f} h simulated: {self.completed} good, {self.scrapped} scrapped, "
+            f"{self.throughput * 3600:.1f} units/h",
+            f"cycle time {self.cycle_time:.1f} s, mean WIP {self.wip:.1f}, "
+            f"mean flow time {self.flow_time:.0f} s",
+        ]
+        if self.demand:
+            verdict = "meets" if self.completed >= self.demand else "misses"
+            lines.append(
+                f"takt time {self.takt_time:.1f} s for {self.demand} units: "
+                f"line {verdict} demand"
+            )
+        if self.operators:
+            lines.append(
+                f"operators {self.operators}, utilization {self.operator_utilization:6.1%}"
+            )
+        for station in self.stations:
+            lines.append(
+                f"  {station.name:<12} nests {station.nests:3d}  "
+                f"utilization {self.utilization(station):6.1%}  "
+                f"queue {station.queued.mean(self.horizon):7.1f}  "
+                f"visits {station.visits:7d}  failures {station.failures:6d}  "
+                f"scrapped {station.scrapped:5d}"
+            )
+        lines.append(f"bottleneck: {self.bottleneck.name}")
+        return "\n".join(lines)
+
+
+class Line:
+    """Stations in series sharing a pool of operators.
+
+    ``operators=None`` means handling never waits for an operator. Units
+    are released every ``release_interval`` seconds if given, otherwise
+    whenever fewer than ``wip_limit`` units are on the line (by default
+    twice the number of nests).
+    """
+
+    def __init__(self, stations, operators=None, wip_limit=None,
+                 release_interval=None, seed=None):
+        self.stations = stations
+        self.operators = operators
+        self.wip_limit = wip_limit or 2 * sum(station.nests for station in stations)
+        self.release_interval = (
+            _seconds(release_interval) if release_interval is not None else None
+        )
+        self.seed = seed
+
+    def run(self, horizon, demand=None):
+        """Simulate ``horizon`` (seconds or timedelta) of production."""
+        horizon = _seconds(horizon)
+        self._sim = sim = Simulation()
+        self._random = random.Random(self.seed).random
+        self._stats = [StationStats(station) for station in self.stations]
+        self._idle = self.operators
+        self._waiting = deque()
+        self._busy = _Level()
+        self._wip = _Level()
+        self._released = 0
+        self._completed = 0
+        self._scrapped = 0
+        self._flow_time = 0.0
+
+        if self.release_interval is None:
+            for _ in range(self.wip_limit):
+                self._release()
+        else:
+            self._release_periodically()
+        sim.run(horizon)
+
+        return LineReport(
+            horizon,
+            self._released,
+            self._completed,
+            self._scrapped,
+            self._flow_time / self._completed if self._completed else 0.0,
+            self._wip.mean(horizon),
+            self._stats,
+            self.operators,
+            self._busy.mean(horizon) * horizon,
+            demand,
+        )
+
+    def _release(self):
+        self._released += 1
+        self._wip.add(self._sim.now, 1)
+        self._arrive(_Unit(self._sim.now), 0)
+
+    def _release_periodically(self):
+        self._release()
+        self._sim.schedule(self.release_interval, self._release_periodically)
+
+    def _leave(self):
+        self._wip.add(self._sim.now, -1)
+        if self.release_interval is None:
+            self._release()
+
+    def _arrive(self, unit, index):
+        stats = self._stats[index]
+        stats.queue.append(unit)
+        stats.queued.add(self._sim.now, 1)
+        self._dispatch(index)
+
+    def _dispatch(self, index):
+        stats = self._stats[index]
+        now = self._sim.now
+        while stats.queue and stats.free:
+            unit = stats.queue.popleft()
+            stats.queued.add(now, -1)
+            stats.free -= 1
+            stats.occupied.add(now, 1)
+            self._handle(self.stations[index].load_time, self._test, index, unit)
+
+    # Operators
+
+    def _handle(self, duration, then, *args):
+        if duration <= 0:
+            then(*args)
+        elif self.operators is None or self._idle:
+            self._start_handling(duration, then, args)
+        else:
+            self._waiting.append((duration, then, args))
+
+    def _start_handling(self, duration, then, args):
+        if self.operators is not None:
+            self._idle -= 1
+            self._busy.add(self._sim.now, 1)
+        self._sim.schedule(duration, self._end_handling, then, args)
+
+    def _end_handling(self, then, args):
+        if self.operators is not None:
+            self._idle += 1
+            self._busy.add(self._sim.now, -1)
+            if self._waiting:
+                self._start_handling(*self._waiting.popleft())
+        then(*args)
+
+    # Units
+
+    def _test(self, index, unit):
+        station = self.stations[index]
+        test_time, failed = station.sample(unit.start, self._random)
+        stats = self._stats[index]
+        stats.visits += 1
+        stats.test_time += test_time
+        self._sim.schedule(test_time, self._tested, index, unit, failed)
+
+    def _tested(self, index, unit, failed):
+        self._handle(self.stations[index].unload_time, self._unloaded, index, unit, failed)
+
+    def _unloaded(self, index, unit, failed):
+        station = self.stations[index]
+        stats = self._stats[index]
+        stats.free += 1
+        stats.occupied.add(self._sim.now, -1)
+
+        if failed is None:
+            unit.start = 0
+            unit.retests = 0
+            if index + 1 < len(self.stations):
+                self._arrive(unit, index + 1)
+            else:
+                self._completed += 1
+                self._flow_time += self._sim.now - unit.released
+                self._leave()
+        else:
+            stats.failures += 1
+            if unit.retests >= station.max_retests:
+                stats.scrapped += 1
+                self._scrapped += 1
+                self._leave()
+            else:
+                unit.retests += 1
+                unit.start = failed if station.resume else 0
+                self._sim.schedule(station.rework_time, self._arrive, unit, index)
+        self._dispatch(index)
+
+
+def drone_line(pcb_nests=1, operators=2):
+    """The PCB -> Cell -> Assembly line of the drone battery templates."""
+    handling = {"load_time": 20, "unload_time": 10, "rework_time": 900}
+    return Line(
+        [
+            Station("PCB", DRONE_PCB_FVT1, nests=pcb_nests, **handling),
+            Station("Cell", DRONE_CELL_FVT2, **handling),
+            Station("Assembly", DRONE_ASSEMBLY_FVT3, **handling),
+        ],
+        operators=operators,
+        seed=0,
+    )
+
+
+if __name__ == "__main__":
+    from time import perf_counter
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    pcb_nests = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    for nests in sorted({1, pcb_nests}):
+        start = perf_counter()
+        report = drone_line(nests).run(timedelta(days=days), demand=30_000 * days // 30)
+        print(report.format())
+        print(f"simulated in {perf_counter() - start:.2f} s\n")
@@ -0,0 +1,139 @@
+"""Cache of instrument readings shared by steps, procedures and reruns.
+
+An expensive reading, such as the voltage or internal resistance of a
+battery, is stored under the serial number of the unit, the name of the
+measurement and the configuration it was taken with (range, integration
+time...), so any step of any procedure asking for the same reading of the
+same unit reuses it instead of measuring again. Readings expire after a
+time to live, and ``invalidate`` drops them explicitly, for example after
+rework. Only readings within the limits of the step using them are
+stored: a failing reading is taken again on the next run, so a rerun
+after rework does not fail on the reading taken before it.
+
+The store is a SQLite database, like the retest store, so the readings
+outlive the test session and are shared by the processes of a station.
+Values must be JSON serializable.
+"""
+
+from contextlib import contextmanager
+from time import time
+import json
+import os
+import sqlite3
+
+
+def within(value, low=None, high=None):
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+class MeasurementCache:
+    """Readings keyed by serial number, measurement name and configuration."""
+
+    def __init__(self, path, ttl=3600.0, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        # Measure again and overwrite the stored readings
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        # Serials allocated in this session, with nothing cached for them yet
+        self.new_serials = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS measurements ("
+                " serial_number TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " config TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " measured_at REAL NOT NULL,"
+                " PRIMARY KEY (serial_number, name, config))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _config(config):
+        return json.dumps(config or {}, sort_keys=True, separators=(",", ":"))
+
+    def get(self, serial_number, name, config=None, ttl=None):
+        """Return ``(True, value)`` for a fresh reading, ``(False, None)`` otherwise."""
+        ttl = self.ttl if ttl is None else ttl
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT value FROM measurements"
+                " WHERE serial_number = ? AND name = ? AND config = ?"
+                " AND measured_at >= ?",
+                (serial_number, name, self._config(config), time() - ttl),
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def put(self, serial_number, name, value, config=None):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?)",
+                (serial_number, name, self._config(config), json.dumps(value), time()),
+            )
+
+    def measure(self, serial_number, name, measure, config=None, ttl=None, limits=None):
+        """Return the cached reading, or call ``measure()`` and store its value.
+
+        With ``limits``, a ``(low, high)`` pair either end of which may be
+        None, a value outside them is returned but not stored.
+        """
+        if not self.refresh and serial_number not in self.new_serials:
+            found, value = self.get(serial_number, name, config, ttl)
+            if found:
+                self.hits += 1
+                return value
+        self.misses += 1
+        value = measure()
+        if limits is None or within(value, *limits):
+            self.put(serial_number, name, value, config)
+        return value
+
+    def invalidate(self, serial_number, name=None, config=None):
+        """Drop the readings of a unit, of one measurement, or of one configuration."""
+        query = "DELETE FROM measurements WHERE serial_number = ?"
+        args = [serial_number]
+        if name is not None:
+            query += " AND name = ?"
+            args.append(name)
+            if config is not None:
+                query += " AND config = ?"
+                args.append(self._config(config))
+        with self._connect() as db:
+            db.execute(query, args)
+
+    def purge(self):
+        """Delete the readings older than the time to live."""
+        with self._connect() as db:
+            db.execute("DELETE FROM measurements WHERE measured_at < ?", (time() - self.ttl,))
+
+
+def open_measurement_cache(refresh=False):
+    """Return the measurement cache of this machine.
+
+    The database is ``TOFUPILOT_MEASUREMENT_CACHE``, by default
+    ``~/.tofupilot/measurements.sqlite``; readings are kept for
+    ``TOFUPILOT_MEASUREMENT_TTL`` seconds, one hour by default.
+    """
+    path = os.environ.get(
+        "TOFUPILOT_MEASUREMENT_CACHE",
+        os.path.join(os.path.expanduser("~"), ".tofupilot", "measurements.sqlite"),
+    )
+    ttl = float(os.environ.get("TOFUPILOT_MEASUREMENT_TTL", 3600))
+    cache = MeasurementCache(path, ttl, refresh)
+    cache.purge()
+    return cache
@@ -0,0 +1,346 @@
+"""Live station metrics in the Prometheus text format.
+
+Counters and fixed-bucket histograms keep one shard per thread: a thread
+only ever writes to its own shard, so recording an event takes no lock and
+stays well under a microsecond (see src/benchmarks/bench_metrics.py). Shards
+are summed when the endpoint is scraped.
+
+``StationMetrics`` holds the metrics of a station:
+
+- ``tofupilot_units_started_total``, ``tofupilot_units_passed_total`` and
+  ``tofupilot_units_failed_total`` per ``procedure_id``,
+- ``tofupilot_step_duration_seconds`` per step,
+- ``tofupilot_upload_queue_depth`` (runs) or, with a spool,
+  ``tofupilot_upload_spool_bytes``,
+- ``tofupilot_create_run_duration_seconds`` and
+  ``tofupilot_create_run_failures_total``.
+
+``StepPlan.run``, the uploaders and ``openhtf_callback`` record them when
+given a ``StationMetrics``. Worker processes of a ``StationExecutor`` send
+what they recorded back with every unit, so the endpoint of the main process
+covers every nest.
+"""
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import multiprocessing
+import os
+import threading
+
+# Seconds, from a fast instrument read to a firmware flash
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _forget(self):
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        """Add ``amount`` to the series of the label values ``labels``."""
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            shards = [shard.copy() for shard in self._shards]
+        totals = {}
+        for shard in shards:
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _merge(self, values):
+        shard = self._shard()
+        for labels, value in values.items():
+            shard[labels] = shard.get(labels, 0) + value
+
+    def render(self):
+        lines = self._header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # One count per bucket, one for +Inf, then the sum
+        self._width = len(self.buckets) + 2
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        row = shard.get(labels)
+        if row is None:
+            row = shard[labels] = [0] * self._width
+        row[bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def values(self):
+        with self._lock:
+            shards = [shard.copy() for shard in self._shards]
+        totals = {}
+        for shard in shards:
+            for labels, row in shard.items():
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = list(row)
+                else:
+                    for i, value in enumerate(row):
+                        total[i] += value
+        return totals
+
+    def _merge(self, values):
+        shard = self._shard()
+        for labels, row in values.items():
+            total = shard.get(labels)
+            if total is None:
+                shard[labels] = list(row)
+            else:
+                for i, value in enumerate(row):
+                    total[i] += value
+
+    def render(self):
+        lines = self._header()
+        for labels, row in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), row):
+                cumulative += count
+                le = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            series = _format_labels(self.labels, labels)
+            lines.append(f"{self.name}_sum{series} {row[-1]}")
+            lines.append(f"{self.name}_count{series} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when the endpoint is scraped, from ``callback`` if set."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, callback=None):
+        super().__init__(name, help)
+        self.callback = callback
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def _forget(self):
+        super()._forget()
+        self.callback = None
+
+    def render(self):
+        value = self.callback() if self.callback is not None else self.value
+        return self._header() + [f"{self.name} {value}"]
+
+
+class Registry:
+    """The metrics served by one endpoint."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            # A forked nest starts from zero; it sends back only its own
+            # events, which the parent adds to its totals
+            os.register_at_fork(after_in_child=self._forget)
+
+    def _get(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def gauge(self, name, help, callback=None):
+        return self._get(Gauge, name, help, callback)
+
+    def _forget(self):
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._forget()
+
+    def drain(self):
+        """Return and reset what this process recorded, to merge elsewhere."""
+        delta = {}
+        for name, metric in list(self._metrics.items()):
+            if isinstance(metric, Gauge):
+                continue
+            with metric._lock:
+                shards, metric._shards = metric._shards, []
+                metric._local = threading.local()
+            values = {}
+            for shard in shards:
+                for labels, value in shard.items():
+                    if isinstance(value, list):
+                        total = values.setdefault(labels, [0] * len(value))
+                        for i, item in enumerate(value):
+                            total[i] += item
+                    else:
+                        values[labels] = values.get(labels, 0) + value
+            if values:
+                delta[name] = values
+        return delta
+
+    def merge(self, delta):
+        """Add the values returned by ``drain`` in another process."""
+        for name, values in delta.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric._merge(values)
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, registry=REGISTRY, host=""):
+    """Serve ``registry`` on ``http://host:port/metrics`` from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class StationMetrics:
+    """The metrics recorded by a test station."""
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.units_started = registry.counter(
+            "tofupilot_units_started_total", "Procedure runs started.", ("procedure_id",)
+        )
+        self.units_passed = registry.counter(
+            "tofupilot_units_passed_total", "Procedure runs passed.", ("procedure_id",)
+        )
+        self.units_failed = registry.counter(
+            "tofupilot_units_failed_total", "Procedure runs failed.", ("procedure_id",)
+        )
+        self.step_seconds = registry.histogram(
+            "tofupilot_step_duration_seconds", "Duration of a test step.", ("step",)
+        )
+        self.create_run_seconds = registry.histogram(
+            "tofupilot_create_run_duration_seconds", "Duration of a create_run call."
+        )
+        self.create_run_failures = registry.counter(
+            "tofupilot_create_run_failures_total", "create_run calls that failed."
+        )
+
+    def watch_uploads(self, uploads):
+        """Report the backlog of an ``UploadQueue`` or a ``RunSpool``."""
+        if hasattr(uploads, "pending_bytes"):
+            gauge = self.registry.gauge(
+                "tofupilot_upload_spool_bytes", "Bytes of the spool not uploaded yet."
+            )
+            gauge.callback = uploads.pending_bytes
+        else:
+            gauge = self.registry.gauge(
+                "tofupilot_upload_queue_depth", "Runs waiting for upload."
+            )
+            gauge.callback = uploads.pending
+
+    def observe_create_run(self, seconds, ok):
+        self.create_run_seconds.observe(seconds)
+        if not ok:
+            self.create_run_failures.inc()
+
+    def openhtf_callback(self, record):
+        """openhtf output callback recording the test and its phases."""
+        procedure_id = record.metadata.get("procedure_id", "")
+        self.units_started.inc(procedure_id)
+        if getattr(record.outcome, "name", record.outcome) == "PASS":
+            self.units_passed.inc(procedure_id)
+        else:
+            self.units_failed.inc(procedure_id)
+        for phase in record.phases:
+            self.step_seconds.observe(
+                (phase.end_time_millis - phase.start_time_millis) / 1000, phase.name
+            )
+
+
+def open_metrics():
+    """Return the metrics of this station, or ``None`` if they are off.
+
+    Metrics are on when ``TOFUPILOT_METRICS_PORT`` is set; the main process
+    then serves them on that port.
+    """
+    port = os.environ.get("TOFUPILOT_METRICS_PORT")
+    if not port:
+        return None
+    if multiprocessing.parent_process() is None:
+        serve(int(port))
+    return StationMetrics()
@@ -0,0 +1,92 @@
+"""Yield models of the templates' procedures, shared with the simulators.
+
+Each model lists the steps of a procedure as ``SimStep`` entries with its
+first-pass probability and duration, and the uniform ranges its
+measurement is drawn from on pass and on fail. The templates draw their
+simulated results with ``draw`` and build their step tables with
+``step_table`` from these models, so the line and yield simulators always
+simulate the procedures the templates run.
+"""
+
+from collections import namedtuple
+from datetime import timedelta
+import random
+
+SimStep = namedtuple(
+    "SimStep",
+    ["name", "passed_prob", "duration", "pass_range", "fail_range"],
+    defaults=(None, None),
+)
+
+
+def draw(step, digits=None):
+    """Return ``(passed, value)`` of one simulated execution of ``step``.
+
+    The value is drawn from the pass or fail range and rounded to
+    ``digits``, or ``None`` for a step without measurement.
+    """
+    passed = random.random() < step.passed_prob
+    if step.pass_range is None:
+        return passed, None
+    value = random.uniform(*(step.pass_range if passed else step.fail_range))
+    return passed, round(value, digits)
+
+
+def steps_by_name(model):
+    """Return the steps of ``model`` by name."""
+    return {step.name: step for step in model}
+
+
+def step_table(model, tests):
+    """Return the ``StepPlan`` table running ``tests`` in the order of ``model``."""
+    tests = {test.__name__: test for test in tests}
+    return [(tests[step.name], timedelta(seconds=step.duration)) for step in model]
+
+
+# src/motors/test_motor.py, FVT1
+MOTOR_FVT1 = [
+    SimStep("visual_inspection_connector", 1, 8),
+    SimStep("power_on_test", 1, 1),
+    SimStep("power_supply_check_voltage", 0.99, 3, (11.5, 12.5), (10.0, 11.0)),
+    SimStep("power_supply_check_current", 0.99, 3, (0, 1.5), (1.6, 2)),
+    SimStep("motor_startup_test", 0.99, 15),
+    SimStep("motor_startup_rpm", 0.99, 20, (100, 1500), (50, 99)),
+    SimStep("speed_consistency_no_load_test", 0.98, 10),
+    SimStep("encoder_feedback_measurement", 0.99, 4, (0.5, 4.9), (5.1, 10)),
+    SimStep("backlash_response_time_test", 0.95, 6, (0, 0.19), (0.21, 0.5)),
+    SimStep("full_speed_braking_test", 0.8, 12, (1.5, 2), (2.1, 3)),
+    SimStep("thermal_reading", 0.75, 10, (75, 80), (81, 100)),
+    SimStep("motor_noise", 0.92, 18, (45, 50), (51, 55)),
+    SimStep("encoder_feedback_test", 0.99, 4),
+    SimStep("final_rpm_reading", 1, 15, (2900, 3100), (2500, 2900)),
+]
+
+# src/drone/python-client/test_batteries.py, FVT1 (PCB)
+DRONE_PCB_FVT1 = [
+    SimStep("flash_firmware_and_version", 0.99, 90),
+    SimStep("configuration_battery_gauge", 0.98, 1),
+    SimStep("get_calibration_values_and_internal_statuses", 0.98, 1),
+    SimStep("overvoltage_protection_test", 0.98, 5, (4.20, 4.25), (4.30, 4.35)),
+    SimStep("undervoltage_protection_test", 0.98, 5, (2.5, 2.6), (2.3, 2.4)),
+    SimStep("test_LED_and_button", 0.95, 6),
+    SimStep("save_information_in_memory", 0.99, 0.1),
+    SimStep("visual_inspection", 1, 10),
+]
+
+# src/drone/python-client/test_batteries.py, FVT2 (cell)
+DRONE_CELL_FVT2 = [
+    SimStep("esr_test", 0.98, 2, (5, 10), (15, 20)),
+    SimStep("cell_voltage_test", 0.98, 0.1, (3.0, 3.5), (2.5, 2.9)),
+    SimStep("ir_test", 0.98, 5, (5, 10), (15, 20)),
+    SimStep("charge_discharge_cycle_test", 0.95, 2, (95, 100), (80, 94)),
+]
+
+# src/drone/python-client/test_batteries.py, FVT3 (assembly)
+DRONE_ASSEMBLY_FVT3 = [
+    SimStep("battery_connection", 1.0, 0.1),
+    SimStep("voltage_value", 0.98, 1, (10.0, 12.0), (8.0, 9.5)),
+    SimStep("internal_resistance", 0.98, 1, (5, 10), (15, 20)),
+    SimStep("thermal_runaway_detection", 0.98, 2, (55, 65), (66, 70)),
+    SimStep("state_of_health", 0.98, 2, (95, 100), (85, 94)),
+    SimStep("state_of_charge", 0.98, 2, (40, 60), (25, 35)),
+]
@@ -0,0 +1,149 @@
+"""Long-lived openhtf station testing DUT after DUT with one ``Test``.
+
+The openhtf templates build their ``htf.Test`` at import and test a single
+board per process, so every board would pay for starting the interpreter,
+importing openhtf and building the test. ``StationLoop`` imports a template
+once and calls its ``test_unit`` for every serial of a source:
+
+- ``scanned_serials`` reads one serial per line, as typed by a barcode
+  scanner in keyboard mode or from a file,
+- ``queued_serials`` takes them from a ``queue.Queue`` until ``None``,
+- without a source, the template allocates its own serials.
+
+For every DUT the loop records the wall time of ``test.execute`` and the
+time spent in phases, read from the test record, so the framework overhead
+(plug setup and teardown, record building, output callbacks) is reported
+apart from the time of the test itself. openhtf only keeps phase times in
+milliseconds, which bounds the resolution of the split.
+
+openhtf creates the plug instances of a test at every ``execute`` and tears
+them down afterwards; what must stay open across DUTs, such as instrument
+sessions, belongs to the process and is only handed to the plugs, as the
+pool of ``station.instruments`` does.
+
+Usage: python -m station.openhtf_loop TEMPLATE [--units N] [--serials FILE|-]
+(from src/)
+"""
+
+from collections import namedtuple
+from contextlib import ExitStack
+from time import perf_counter
+import argparse
+import importlib.util
+import itertools
+import os
+import sys
+
+DutTiming = namedtuple("DutTiming", ["serial_number", "passed", "seconds", "phase_seconds"])
+
+
+def scanned_serials(stream):
+    """Serials read one per line from ``stream``, skipping blank lines."""
+    for line in stream:
+        serial_number = line.strip()
+        if serial_number:
+            yield serial_number
+
+
+def queued_serials(serial_queue):
+    """Serials taken from ``serial_queue`` until it yields ``None``."""
+    return iter(serial_queue.get, None)
+
+
+def load_template(path):
+    """Import an openhtf template without running its ``__main__`` block."""
+    name = "station_loop_" + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StationLoop:
+    """Runs ``test_unit(serial_number)`` of a template for every DUT."""
+
+    def __init__(self, test, test_unit):
+        self.test = test
+        self.test_unit = test_unit
+        self.timings = []
+        self._phase_seconds = 0.0
+        test.add_output_callbacks(self._observe)
+
+    @classmethod
+    def from_template(cls, module):
+        return cls(module.test, module.test_unit)
+
+    def _observe(self, record):
+        self._phase_seconds = sum(
+            phase.end_time_millis - phase.start_time_millis for phase in record.phases
+        ) / 1000
+
+    def run(self, serial_numbers):
+        """Test every serial of ``serial_numbers``; ``None`` allocates one."""
+        for serial_number in serial_numbers:
+            self._phase_seconds = 0.0
+            start = perf_counter()
+            passed = self.test_unit(serial_number)
+            seconds = perf_counter() - start
+            self.timings.append(
+                DutTiming(serial_number, passed, seconds, self._phase_seconds)
+            )
+        return self.timings
+
+    def format(self):
+        if not self.timings:
+            return "no DUT tested"
+        # The first DUT also pays for the first imports and caches
+        first, warm = self.timings[0], self.timings[1:] or self.timings
+        overheads = sorted(t.seconds - t.phase_seconds for t in warm)
+        count = len(overheads)
+        passed = sum(1 for t in self.timings if t.passed)
+        total = sum(t.seconds for t in self.timings)
+        return "\n".join([
+            f"{len(self.timings)} DUTs, {passed} passed, {total:.2f} s "
+            f"({len(self.timings) / total * 3600:.0f} DUTs/h)",
+            f"first DUT     {first.seconds * 1e3:9.1f} ms, "
+            f"{(first.seconds - first.phase_seconds) * 1e3:.1f} ms overhead",
+            f"phase time    {sum(t.phase_seconds for t in warm) / count * 1e3:9.1f} ms per DUT",
+            f"overhead mean {sum(overheads) / count * 1e3:9.1f} ms, "
+            f"p50 {overheads[count // 2] * 1e3:.1f} ms, "
+            f"p99 {overheads[min(count - 1, int(0.99 * count))] * 1e3:.1f} ms",
+        ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("template", help="openhtf template defining test and test_unit")
+    parser.add_argument("--units", type=int, help="stop after this many DUTs")
+    parser.add_argument(
+        "--serials", help="file of serial numbers, one per line, or - for stdin"
+    )
+    args = parser.parse_args(argv)
+
+    path = os.path.abspath(args.template)
+    module = load_template(path)
+    loop = StationLoop.from_template(module)
+    with ExitStack() as stack:
+        if args.serials == "-":
+            serial_numbers = scanned_serials(sys.stdin)
+        elif args.serials:
+            f = stack.enter_context(open(args.serials, encoding="utf-8"))
+            serial_numbers = scanned_serials(f)
+        else:
+            serial_numbers = itertools.repeat(None)
+        if args.units is not None:
+            serial_numbers = itertools.islice(serial_numbers, args.units)
+        elif not args.serials:
+            serial_numbers = itertools.islice(serial_numbers, 1)
+
+        try:
+            loop.run(serial_numbers)
+        finally:
+            uploads = getattr(module, "uploads", None)
+            if uploads is not None:
+                uploads.close()
+    print(loop.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Order fail-fast steps to minimize the expected test time per unit.
+
+When a run stops at its first failing step, step ``i`` only runs if every
+step before it passed, so the expected time of an order is
+``sum(d[i] * prod(1 - p[j] for j < i))``. Without constraints the best order
+runs steps by increasing ``duration / failure probability``; a 10 s step
+failing one unit in four belongs before a 20 s step that almost never fails.
+
+``StepScheduler`` learns the failure rate and mean duration of every step
+from the runs of the station and keeps them on disk, so the history
+survives restarts. ``propose`` builds the best order it can find that
+respects the declared dependencies: each time it takes the step whose
+unscheduled prerequisites, run together with it, have the lowest ratio of
+expected time to probability of failing, which is optimal when every step
+has at most one prerequisite chain. The ``Proposal`` reports the expected
+time of both orders; it is only worth applying once enough runs have been
+seen and the saving is large enough.
+
+Failures are assumed independent from one step to the next, and a step's
+failure rate is estimated from the units that reached it.
+"""
+
+import json
+import os
+from datetime import timedelta
+
+
+def _seconds(duration):
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    return float(duration)
+
+
+def expected_time(order, durations, failure):
+    """Expected fail-fast test time of the step names in ``order``."""
+    total = 0.0
+    reach = 1.0
+    for name in order:
+        total += durations[name] * reach
+        reach *= 1 - failure[name]
+    return total
+
+
+class Proposal:
+    """A new step order and the expected time per unit it would save."""
+
+    def __init__(self, plan, current_time, projected_time, runs, worthwhile):
+        self.plan = plan
+        self.current_time = current_time
+        self.projected_time = projected_time
+        self.runs = runs
+        self.worthwhile = worthwhile
+
+    @property
+    def saving(self):
+        """Share of the expected time per unit saved by the new order."""
+        if not self.current_time:
+            return 0.0
+        return 1 - self.projected_time / self.current_time
+
+    def format(self):
+        lines = [
+            f"step order from {self.runs} runs: expected "
+            f"{self.current_time:.1f} s -> {self.projected_time:.1f} s per unit "
+            f"({self.saving:.1%} saved)"
+        ]
+        lines.extend(f"  {i + 1:2d}. {name}" for i, name in enumerate(self.plan.names))
+        return "\n".join(lines)
+
+
+class StepScheduler:
+    """Learns step statistics and proposes faster fail-fast orders.
+
+    ``depends`` maps a step name to the names of the steps that must run
+    before it. ``prior`` is the failure rate assumed for a step before it
+    has been seen, weighted as ``prior_weight`` runs.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        depends=None,
+        min_runs=50,
+        min_saving=0.02,
+        prior=0.02,
+        prior_weight=10,
+    ):
+        self.path = path
+        self.depends = {name: tuple(before) for name, before in (depends or {}).items()}
+        self.min_runs = min_runs
+        self.min_saving = min_saving
+        self.prior = prior
+        self.prior_weight = prior_weight
+        self.runs = 0
+        # name -> [units reaching the step, failures, total seconds]
+        self.steps = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.runs = data["runs"]
+            self.steps = data["steps"]
+
+    def observe_run(self, run):
+        """Learn from the steps of a ``create_run`` payload."""
+        self.runs += 1
+        for step in run.get("steps") or ():
+            stats = self.steps.setdefault(step["name"], [0, 0, 0.0])
+            stats[0] += 1
+            if not step["step_passed"]:
+                stats[1] += 1
+            stats[2] += _seconds(step["duration"])
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"runs": self.runs, "steps": self.steps}, f)
+        os.replace(tmp_path, self.path)
+
+    def estimates(self, plan):
+        """Return the ``(durations, failure)`` estimates of the plan's steps."""
+        durations = {}
+        failure = {}
+        for name, duration in zip(plan.names, plan.durations):
+            reached, failed, seconds = self.steps.get(name, (0, 0, 0.0))
+            durations[name] = seconds / reached if reached else _seconds(duration)
+            failure[name] = (failed + self.prior * self.prior_weight) / (
+                reached + self.prior_weight
+            )
+        return durations, failure
+
+    def propose(self, plan):
+        """Return the ``Proposal`` of the best order found for ``plan``."""
+        durations, failure = self.estimates(plan)
+        order = self._order(plan.names, durations, failure)
+        current_time = expected_time(plan.names, durations, failure)
+        projected_time = expected_time(order, durations, failure)
+        proposal = Proposal(
+            plan.reorder(order), current_time, projected_time, self.runs, False
+        )
+        proposal.worthwhile = (
+            self.runs >= self.min_runs
+            and tuple(order) != plan.names
+            and proposal.saving >= self.min_saving
+        )
+        return proposal
+
+    def _order(self, names, durations, failure):
+        def ratio(chain):
+            reach = 1.0
+            for name in chain:
+                reach *= 1 - failure[name]
+            fail = 1 - reach
+            return expected_time(chain, durations, failure) / fail if fail else float("inf")
+
+        def ancestors(name, scheduled):
+            # The unscheduled prerequisites of a step, then the step, in the
+            # order of the table
+            needed = set()
+            stack = [name]
+            while stack:
+                current = stack.pop()
+                if current in needed or current in scheduled:
+                    continue
+                needed.add(current)
+                stack.extend(self.depends.get(current, ()))
+            return [n for n in names if n in needed]
+
+        unknown = {n for before in self.depends.values() for n in before} - set(names)
+        if unknown:
+            raise ValueError(f"dependencies on unknown steps: {sorted(unknown)}")
+
+        order = []
+        scheduled = set()
+        while len(order) < len(names):
+            best = None
+            for name in names:
+                if name in scheduled:
+                    continue
+                chain = self._sorted(ancestors(name, scheduled), scheduled, durations, failure)
+                key = ratio(chain)
+                if best is None or key < best[0]:
+                    best = (key, chain)
+            for name in best[1]:
+                order.append(name)
+                scheduled.add(name)
+        return order
+
+    def _sorted(self, chain, scheduled, durations, failure):
+        # Topological order of a chain, lowest ratio first among the ready steps
+        done = set(scheduled)
+        remaining = list(chain)
+        result = []
+        while remaining:
+            ready = [
+                name for name in remaining
+                if all(before in done for before in self.depends.get(name, ()))
+            ]
+            if not ready:
+                raise ValueError(f"circular step dependencies among {remaining}")
+            name = min(
+                ready,
+                key=lambda n: durations[n] / failure[n] if failure[n] else float("inf"),
+            )
+            result.append(name)
+            done.add(name)
+            remaining.remove(name)
+        return result
+
+
+def open_scheduler(plan, depends=None):
+    """Return the step scheduler of ``plan``, or ``None`` if it is off.
+
+    The scheduler is on when ``TOFUPILOT_STEP_HISTORY`` names the directory
+    keeping the step history, one file per procedure.
+    """
+    directory = os.environ.get("TOFUPILOT_STEP_HISTORY")
+    if not directory:
+        return None
+    path = os.path.join(directory, f"{plan.procedure_id or 'steps'}.json")
+    return StepScheduler(path, depends)
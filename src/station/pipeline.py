@@ -0,0 +1,149 @@
+"""Run a sequence of test stations as a pipeline.
+
+Each ``Stage`` is a station with one or more fixtures (``workers``). Stages
+are connected by bounded queues, so while unit k is on the second station
+unit k + 1 is already on the first one. A stage function receives the item
+coming from the previous stage and returns the item to hand to the next one,
+or ``None`` to take the unit off the line, for example after a failure.
+
+``Pipeline.run`` returns a ``PipelineStats`` with the throughput of the line
+and the utilization of every stage, i.e. the share of the wall time its
+fixtures spent working.
+"""
+
+from time import perf_counter
+import queue
+import threading
+
+_DONE = object()
+
+
+class Stage:
+    """A station of the line: a name, the work done per unit and its fixtures."""
+
+    def __init__(self, name, work, workers=1):
+        self.name = name
+        self.work = work
+        self.workers = workers
+
+
+class StageStats:
+    __slots__ = ("name", "workers", "units", "forwarded", "busy", "running", "lock")
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.units = 0
+        self.forwarded = 0
+        self.busy = 0.0
+        self.running = workers
+        self.lock = threading.Lock()
+
+
+class PipelineStats:
+    """Throughput of a pipeline run and utilization of its stages."""
+
+    def __init__(self, units, wall_time, stages):
+        self.units = units
+        self.wall_time = wall_time
+        self.stages = stages
+
+    @property
+    def throughput(self):
+        """Units entering the line per second."""
+        return self.units / self.wall_time if self.wall_time else 0.0
+
+    def utilization(self, stage):
+        return stage.busy / (self.wall_time * stage.workers) if self.wall_time else 0.0
+
+    def format(self):
+        lines = [
+            f"{self.units} units in {self.wall_time:.2f} s "
+            f"({self.throughput * 3600:.0f} units/h)"
+        ]
+        for stage in self.stages:
+            lines.append(
+                f"  {stage.name:<12} {stage.units:6d} in {stage.forwarded:6d} out  "
+                f"utilization {self.utilization(stage):6.1%}"
+            )
+        return "\n".join(lines)
+
+
+class Pipeline:
+    """Stages connected by bounded queues, each running in its own threads."""
+
+    def __init__(self, stages, maxsize=1):
+        self.stages = stages
+        self.maxsize = maxsize
+
+    def run(self, items):
+        """Push every item through the line and return a ``PipelineStats``."""
+        queues = [queue.Queue(self.maxsize) for _ in self.stages] + [None]
+        stats = [StageStats(stage.name, stage.workers) for stage in self.stages]
+        errors = []
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(
+                        stage,
+                        stats[index],
+                        queues[index],
+                        queues[index + 1],
+                        self._next_workers(index),
+                        errors,
+                    ),
+                    name=f"stage-{stage.name}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        start = perf_counter()
+        units = 0
+        for item in items:
+            queues[0].put(item)
+            units += 1
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        wall_time = perf_counter() - start
+
+        if errors:
+            raise errors[0]
+        return PipelineStats(units, wall_time, stats)
+
+    def _next_workers(self, index):
+        if index + 1 < len(self.stages):
+            return self.stages[index + 1].workers
+        return 0
+
+    @staticmethod
+    def _work(stage, stats, inbox, outbox, next_workers, errors):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                break
+            started = perf_counter()
+            try:
+                result = stage.work(item)
+            except Exception as error:
+                errors.append(error)
+                result = None
+            busy = perf_counter() - started
+            with stats.lock:
+                stats.units += 1
+                stats.busy += busy
+                if result is not None:
+                    stats.forwarded += 1
+            if result is not None and outbox is not None:
+                outbox.put(result)
+        with stats.lock:
+            stats.running -= 1
+            last = stats.running == 0
+        if last and outbox is not None:
+            # The last fixture of this stage closes the next one
+            for _ in range(next_workers):
+                outbox.put(_DONE)
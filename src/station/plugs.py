@@ -0,0 +1,51 @@
+"""openhtf plugs for the instruments of ``station.instruments``.
+
+openhtf creates plug instances at every ``test.execute`` and tears them
+down at the end, so the plugs do not own a session: every call leases the
+instrument from the process-wide pool, which opens it once and keeps it
+for the next phases, tests and nests.
+
+Requires openhtf.
+"""
+
+from openhtf import plugs
+
+from station.instruments import open_instruments
+
+
+class InstrumentPlug(plugs.BasePlug):
+    """Plug reaching the instrument ``resource`` through the station pool."""
+
+    resource = None
+
+    def __init__(self):
+        self.pool = open_instruments()
+
+    def lease(self):
+        """Hold the session for several commands in a row."""
+        return self.pool.lease(self.resource)
+
+    def query(self, command, simulated=None):
+        with self.pool.lease(self.resource) as session:
+            return session.query(command, simulated)
+
+
+class PowerSupplyPlug(InstrumentPlug):
+    """Programmable power supply feeding the DUT."""
+
+    resource = "PSU"
+
+    def measure_voltage(self, output, simulated=None):
+        return self.query(f"MEAS:VOLT? {output}", simulated)
+
+    def measure_power(self, simulated=None):
+        return self.query("MEAS:POW?", simulated)
+
+
+class MultimeterPlug(InstrumentPlug):
+    """Digital multimeter probing the DUT."""
+
+    resource = "DMM"
+
+    def measure_voltage(self, simulated=None):
+        return self.query("MEAS:VOLT:DC?", simulated)
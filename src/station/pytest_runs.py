@@ -0,0 +1,266 @@
+"""One TofuPilot run per unit from the pytest plugin templates.
+
+The tofupilot pytest plugin keeps the run information in the global
+``conf`` and uploads a single run when the session ends, so a session, and
+every xdist worker of it, can only test one unit. ``StationRuns`` takes
+its place, uploading when pytest is given ``--tofupilot``: every test
+module declares the run it produces in a module-level ``run_info`` dict,
+and each worker tests its own unit of every module:
+
+- the ``unit_run`` fixture (module scope, autouse) allocates the serial
+  number of the worker's unit from the station allocator and holds the
+  ``UnitRun`` of the module; tests take it to read the serial number and
+  to ``set`` report variables and attachments,
+- every test adds its step to the run of its module, as the tofupilot
+  plugin does, from what ``@numeric_step`` / ``@string_step`` recorded,
+- the run is queued for upload when the module is done, and the uploads
+  of a worker are flushed at the end of its session.
+
+``--serial-number`` gives the serial of a unit tested again instead of
+allocating a new one; given several times with the same prefix, the first
+serial goes to the first xdist worker, the second to the second, and so
+on, and workers left without one test a new unit. The
+``measurement_cache`` fixture is the ``station.measurements`` cache of the
+machine: readings of a unit tested again, taken in an earlier session,
+are reused until they expire, and the terminal summary shows how many
+were. For example, after an assembly session that failed on a flaky
+connection, ``pytest --serial-number SI02430B4J00000012
+test_battery_assembly.py`` tests that battery again without measuring its
+voltage and internal resistance again. Readings of new units are only
+stored, for such reruns; ``--refresh-measurements`` measures everything
+again.
+
+When ``TOFUPILOT_STEP_JOURNAL`` is set, the steps of every run go to a
+``station.journal`` file as the tests finish instead of piling up in
+memory, and the run is uploaded from it at the end of the module.
+
+With pytest-xdist, ``pytest --tofupilot -n 32 --dist each`` runs every
+module on all 32 workers, one unit per worker, for example one per nest
+of a 32-nest fixture.
+"""
+
+from datetime import datetime, timedelta, timezone
+from time import time
+import os
+import re
+
+import pytest
+
+from station.journal import open_step_journal
+from station.measurements import open_measurement_cache
+from station.serials import open_serial_allocator
+from station.uploads import open_uploader
+
+
+class UnitRun:
+    """The run of one unit: its information and its steps so far."""
+
+    def __init__(self, procedure_id, unit_under_test, sub_units=None):
+        self.procedure_id = procedure_id
+        self.unit_under_test = unit_under_test
+        self.sub_units = sub_units
+        self.report_variables = None
+        self.attachments = None
+        self.steps = []
+        self.started_at = time()
+        self.journal = open_step_journal(
+            procedure_id,
+            unit_under_test["serial_number"],
+            {
+                "procedure_id": procedure_id,
+                "unit_under_test": unit_under_test,
+                "started_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc),
+            },
+        )
+
+    @property
+    def serial_number(self):
+        return self.unit_under_test["serial_number"]
+
+    def set(self, report_variables=None, attachments=None):
+        """Set what ``conf.set`` used to set late in a session."""
+        if report_variables is not None:
+            self.report_variables = report_variables
+        if attachments is not None:
+            self.attachments = attachments
+        return self
+
+    def add_step(self, name, passed, started_at, duration, step_info=None):
+        step = dict(step_info or {})
+        step.setdefault("name", name)
+        step["step_passed"] = passed
+        step["started_at"] = datetime.fromtimestamp(started_at, tz=timezone.utc)
+        step["duration"] = timedelta(seconds=duration)
+        if self.journal is not None:
+            self.journal.append(step)
+        else:
+            self.steps.append(step)
+
+    def finish(self):
+        """Close the journal, if any, with the outcome of the run."""
+        if self.journal is not None:
+            self.journal.close({
+                "run_passed": self.journal.passed,
+                "duration": timedelta(seconds=time() - self.started_at),
+                "report_variables": self.report_variables,
+            })
+
+    def to_run(self):
+        """Return the keyword arguments of ``create_run``."""
+        if self.journal is not None:
+            steps = self.journal.steps()
+            run_passed = self.journal.passed
+        else:
+            steps = self.steps
+            run_passed = all(step["step_passed"] for step in steps)
+        run = {
+            "procedure_id": self.procedure_id,
+            "unit_under_test": self.unit_under_test,
+            "run_passed": run_passed,
+            "started_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc),
+            "duration": timedelta(seconds=time() - self.started_at),
+            "steps": steps,
+        }
+        if self.sub_units is not None:
+            run["sub_units"] = self.sub_units
+        if self.report_variables is not None:
+            run["report_variables"] = self.report_variables
+        if self.attachments is not None:
+            run["attachments"] = self.attachments
+        return run
+
+
+def worker_index():
+    """Return the index of this xdist worker, 0 without xdist."""
+    match = re.fullmatch(r"gw(\d+)", os.environ.get("PYTEST_XDIST_WORKER", ""))
+    return int(match.group(1)) if match else 0
+
+
+class StationRuns:
+    """pytest plugin uploading one run per test module and unit."""
+
+    def __init__(self, upload=True, serial_numbers=(), refresh=False):
+        self.upload = upload
+        self.serial_numbers = tuple(serial_numbers)
+        self.refresh = refresh
+        self.runs = {}
+        # Serials allocated in this session, so never measured before
+        self.new_serials = set()
+        self._uploads = None
+        self._serials = None
+        self._measurements = None
+
+    def open_run(self, run_info):
+        """Return the ``UnitRun`` of a module's ``run_info``, with its serial."""
+        info = dict(run_info)
+        prefix = info.pop("serial_prefix")
+        # A unit tested again keeps the serial number given for it, one per
+        # worker
+        given = [serial for serial in self.serial_numbers if serial.startswith(prefix)]
+        index = worker_index()
+        if index < len(given):
+            serial_number = given[index]
+        else:
+            if self._serials is None:
+                self._serials = open_serial_allocator()
+            serial_number = self._serials.allocate(prefix)
+            self.new_serials.add(serial_number)
+        unit_under_test = {"serial_number": serial_number}
+        for key in ("part_number", "revision", "batch_number"):
+            if key in info:
+                unit_under_test[key] = info.pop(key)
+        return UnitRun(info.pop("procedure_id"), unit_under_test, **info)
+
+    def submit(self, run):
+        if not self.upload:
+            return
+        if self._uploads is None:
+            from tofupilot import TofuPilotClient
+
+            self._uploads = open_uploader(TofuPilotClient())
+        self._uploads.submit(**run.to_run())
+
+    @pytest.fixture(scope="module", autouse=True)
+    def unit_run(self, request):
+        """The run of the unit tested by this worker for the module."""
+        run_info = getattr(request.module, "run_info", None)
+        if run_info is None:
+            yield None
+            return
+        run = self.runs[request.module] = self.open_run(run_info)
+        yield run
+        del self.runs[request.module]
+        run.finish()
+        self.submit(run)
+
+    @pytest.fixture(scope="session")
+    def measurement_cache(self):
+        """Readings of the units, kept across steps, procedures and sessions."""
+        self._measurements = open_measurement_cache(self.refresh)
+        self._measurements.new_serials = self.new_serials
+        return self._measurements
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        run = self.runs.get(getattr(item, "module", None))
+        if run is None or report.skipped:
+            return
+        # A step is the call of its test, or its setup when a fixture failed
+        if report.when == "call" or (report.when == "setup" and report.failed):
+            step_info = None
+            for name, value in item.user_properties:
+                if name == "step_info":
+                    step_info = value
+            run.add_step(item.name, report.passed, call.start, call.duration, step_info)
+
+    def pytest_sessionfinish(self):
+        if self._uploads is not None:
+            self._uploads.close()
+
+    def pytest_terminal_summary(self, terminalreporter):
+        cache = self._measurements
+        if cache is not None:
+            terminalreporter.write_line(
+                f"measurement cache: {cache.hits} readings reused, "
+                f"{cache.misses} measured"
+            )
+
+
+def add_options(parser):
+    group = parser.getgroup("station")
+    group.addoption(
+        "--serial-number",
+        action="append",
+        default=[],
+        help="serial number of a unit tested again, for the module whose prefix it "
+        "has; repeat it to give one to every xdist worker",
+    )
+    group.addoption(
+        "--refresh-measurements",
+        action="store_true",
+        help="measure again instead of reusing cached readings",
+    )
+
+
+def install(config):
+    """Register ``StationRuns``, uploading in place of the tofupilot plugin.
+
+    Runs are only uploaded under ``--tofupilot``; without it the tests still
+    get their ``unit_run``.
+    """
+    try:
+        upload = config.getoption("--tofupilot")
+    except ValueError:
+        upload = False
+    if upload:
+        plugin = config.pluginmanager.get_plugin("testpilotplugin")
+        if plugin is not None:
+            config.pluginmanager.unregister(plugin)
+    plugin = StationRuns(
+        upload,
+        config.getoption("--serial-number"),
+        config.getoption("--refresh-measurements"),
+    )
+    config.pluginmanager.register(plugin, "stationruns")
@@ -0,0 +1,137 @@
+"""Persist where a unit failed so a retest resumes from that step.
+
+When a procedure fails, ``RetestStore.save`` keeps the index of the failing
+step and the records of the run, keyed by procedure and serial number. When
+the same unit comes back from rework, ``load`` returns them, the plan is run
+again from the failing step, and the steps that had already passed are
+reused in the uploaded run instead of being executed again.
+
+The store is a SQLite database, so stations running in several processes
+can share it. A failure is deleted once its unit passes, and failures of
+units that never come back are purged after a time to live. Only look up
+units that come back: a serial allocated in this session has no history,
+and a random serial colliding with an old one would resume its records.
+"""
+
+from contextlib import contextmanager
+from datetime import timedelta
+from time import time
+import json
+import os
+import sqlite3
+
+from station.steps import StepRecord
+
+
+def _dump_records(records):
+    rows = []
+    for record in records:
+        row = [getattr(record, field) for field in StepRecord.__slots__]
+        duration = record.duration
+        if isinstance(duration, timedelta):
+            row[2] = duration.total_seconds()
+        rows.append(row)
+    return json.dumps(rows)
+
+
+def _load_records(data):
+    records = []
+    for row in json.loads(data):
+        record = StepRecord(*row)
+        if record.duration is not None:
+            record.duration = timedelta(seconds=record.duration)
+        records.append(record)
+    return records
+
+
+class RetestStore:
+    """Last failed step of every unit, keyed by procedure and serial."""
+
+    def __init__(self, path, ttl=7 * 86400.0):
+        self.path = path
+        self.ttl = ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS failed_steps ("
+                " procedure_id TEXT NOT NULL,"
+                " serial_number TEXT NOT NULL,"
+                " failed_index INTEGER NOT NULL,"
+                " records TEXT NOT NULL,"
+                " saved_at REAL NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (procedure_id, serial_number))"
+            )
+            columns = [row[1] for row in db.execute("PRAGMA table_info(failed_steps)")]
+            if "saved_at" not in columns:
+                # Stores created before failures expired
+                db.execute(
+                    "ALTER TABLE failed_steps ADD COLUMN saved_at REAL NOT NULL DEFAULT 0"
+                )
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the store safe to use
+        # from threads and forked worker processes
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def load(self, procedure_id, serial_number):
+        """Return ``{"index", "records"}`` of the last failure, or ``None``."""
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT failed_index, records FROM failed_steps"
+                " WHERE procedure_id = ? AND serial_number = ?",
+                (procedure_id, serial_number),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"index": row[0], "records": _load_records(row[1])}
+
+    def save(self, procedure_id, serial_number, failed_step):
+        """Remember the failed step returned by a run of the procedure."""
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO failed_steps VALUES (?, ?, ?, ?, ?)",
+                (
+                    procedure_id,
+                    serial_number,
+                    failed_step["index"],
+                    _dump_records(failed_step["records"]),
+                    time(),
+                ),
+            )
+
+    def clear(self, procedure_id, serial_number):
+        """Forget the failure of a unit once it has passed."""
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM failed_steps WHERE procedure_id = ? AND serial_number = ?",
+                (procedure_id, serial_number),
+            )
+
+    def purge(self):
+        """Delete the failures older than the time to live."""
+        with self._connect() as db:
+            db.execute("DELETE FROM failed_steps WHERE saved_at < ?", (time() - self.ttl,))
+
+
+def open_retest_store():
+    """Return the retest store of this machine, or None when not configured.
+
+    The store is opt-in: set ``TOFUPILOT_RETEST_DB`` to the database path.
+    Failures are kept for ``TOFUPILOT_RETEST_TTL`` seconds, a week by
+    default.
+    """
+    path = os.environ.get("TOFUPILOT_RETEST_DB")
+    if not path:
+        return None
+    ttl = float(os.environ.get("TOFUPILOT_RETEST_TTL", 7 * 86400))
+    store = RetestStore(path, ttl)
+    store.purge()
+    return store
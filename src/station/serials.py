@@ -0,0 +1,190 @@
+"""Collision-free serial number allocation.
+
+The templates used to append five random digits to a part/revision prefix,
+which collides quickly at production volume. ``SerialAllocator`` instead
+hands out sequential numbers per prefix from ranges leased out of a small
+store on disk: one file per prefix holding the next unleased number, updated
+under an exclusive file lock. Every process leases its own range, so
+stations sharing the store never hand out the same serial, and all but one
+allocation per lease are served from memory. ``allocate_block`` leases
+exactly the numbers it returns.
+
+When the allocator is closed, the unused end of a lease goes back to the
+store if no other process has leased after it; otherwise, as after a crash,
+those numbers are skipped, never reused.
+
+Sequential serials are only unique as long as the store is kept.
+``open_serial_allocator`` keeps it in ``~/.tofupilot/serials`` unless told
+otherwise, so every process of a machine, pytest-xdist workers included,
+shares it by default. The random serials of the original templates remain
+available for stations that cannot keep a store.
+"""
+
+from itertools import count
+import atexit
+import os
+import random
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class _Lease:
+    __slots__ = ("numbers", "end", "format")
+
+    def __init__(self, start, end, format):
+        self.numbers = count(start)
+        self.end = end
+        self.format = format
+
+
+class SerialAllocator:
+    """Hands out unique serial numbers per prefix from leased ranges."""
+
+    def __init__(self, directory, width=8, lease=100):
+        self.directory = directory
+        self.width = width
+        self.lease = lease
+        self.capacity = 10**width
+        self._leases = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.close)
+
+    def allocate(self, prefix):
+        """Return the next unique serial number for ``prefix``."""
+        while True:
+            lease = self._leases.get(prefix)
+            if lease is not None:
+                number = next(lease.numbers)
+                if number < lease.end:
+                    return lease.format(number)
+            with self._lock:
+                # Another thread may have renewed the lease meanwhile
+                if self._leases.get(prefix) is lease:
+                    self._leases[prefix] = self._take_lease(prefix, self.lease)
+
+    def allocate_block(self, prefix, size):
+        """Return ``size`` unique serial numbers for ``prefix`` in one call.
+
+        The block is leased from the store on its own, so it costs a single
+        locked update however many numbers it holds.
+        """
+        if not size:
+            return []
+        lease = self._take_lease(prefix, size, partial=False)
+        return list(map(lease.format, range(next(lease.numbers), lease.end)))
+
+    def close(self):
+        """Hand the unused numbers of the leases back to the store."""
+        with self._lock:
+            leases, self._leases = self._leases, {}
+        for prefix, lease in leases.items():
+            unused = min(next(lease.numbers), lease.end)
+            if unused < lease.end:
+                self._update(prefix, lambda stored: unused if stored == lease.end else stored)
+        atexit.unregister(self.close)
+
+    def _update(self, prefix, update):
+        """Replace the next unleased number of ``prefix`` under the file lock."""
+        path = os.path.join(self.directory, f"{prefix}.next")
+        with open(path, "a+", encoding="ascii") as f:
+            _lock(f)
+            try:
+                f.seek(0)
+                stored = int(f.read().strip() or 0)
+                new = update(stored)
+                if new != stored:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(str(new))
+                    f.flush()
+                    os.fsync(f.fileno())
+            finally:
+                _unlock(f)
+        return stored, new
+
+    def _take_lease(self, prefix, size, partial=True):
+        # Checked under the file lock, so a refused lease takes no numbers
+        def lease(start):
+            if start + (1 if partial else size) > self.capacity:
+                raise RuntimeError(f"serial numbers for prefix {prefix!r} are exhausted")
+            return min(start + size, self.capacity)
+
+        start, end = self._update(prefix, lease)
+        template = prefix.replace("%", "%%") + f"%0{self.width}d"
+        return _Lease(start, end, template.__mod__)
+
+
+class RandomSerials:
+    """Random serial numbers, as the templates generated before the store.
+
+    Serials are unique within a process, and only likely to be unique
+    across processes and days.
+    """
+
+    def __init__(self, width=5):
+        self.width = width
+        self.capacity = 10**width
+        self._random = random.Random()
+        # Numbers issued by prefix, at most the capacity of each
+        self._issued = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, prefix):
+        return self.allocate_block(prefix, 1)[0]
+
+    def allocate_block(self, prefix, size):
+        with self._lock:
+            issued = self._issued.setdefault(prefix, set())
+            if len(issued) + size > self.capacity:
+                raise RuntimeError(f"serial numbers for prefix {prefix!r} are exhausted")
+            numbers = []
+            while len(numbers) < size:
+                number = self._random.randrange(self.capacity)
+                if number not in issued:
+                    issued.add(number)
+                    numbers.append(number)
+        return [f"{prefix}{number:0{self.width}d}" for number in numbers]
+
+    def close(self):
+        pass
+
+
+def open_serial_allocator():
+    """Return the serial allocator shared by the stations of this machine.
+
+    Serials are sequential, ``TOFUPILOT_SERIAL_WIDTH`` digits wide (8 by
+    default), leased from the store ``TOFUPILOT_SERIAL_DIR``, by default
+    ``~/.tofupilot/serials``. With ``TOFUPILOT_SERIAL_DIR=random`` they are
+    random instead, 5 digits wide by default, and may collide across
+    processes.
+    """
+    directory = os.environ.get(
+        "TOFUPILOT_SERIAL_DIR",
+        os.path.join(os.path.expanduser("~"), ".tofupilot", "serials"),
+    )
+    width = os.environ.get("TOFUPILOT_SERIAL_WIDTH")
+    if directory == "random":
+        return RandomSerials(int(width or 5))
+    return SerialAllocator(directory, int(width or 8))
@@ -0,0 +1,249 @@
+"""Streaming statistical process control of the measurements of a station.
+
+``SpcEngine.observe_run`` takes every run before it is uploaded and updates,
+for each numeric measurement (keyed by procedure and step name):
+
+- Welford running mean and variance, and Cpk/Ppk against the step limits,
+- an EWMA chart and a two-sided tabular CUSUM,
+- the four Western Electric rules.
+
+State per measurement is a fixed handful of numbers plus the last five
+points, whatever the number of units. The control charts need a centre and
+a sigma: they are taken from the first ``baseline`` values of every
+measurement (sigma from the average moving range, as on an individuals
+chart), then kept fixed so a drift shows against them.
+
+Every out-of-control point is logged as a warning and handed to
+``on_signal``, if given. Signals are meant to be acted on while the line
+runs, not read from the history of the runs.
+"""
+
+from collections import deque, namedtuple
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+Signal = namedtuple("Signal", ["procedure_id", "step", "rule", "value", "index"])
+
+# d2 constant for moving ranges of two points
+_D2 = 1.128
+
+
+class MeasurementSpc:
+    """Running statistics and control-chart state of one measurement."""
+
+    __slots__ = (
+        "n", "mean", "m2", "last", "mr_sum", "low", "high",
+        "center", "sigma", "ewma", "ewma_n", "cusum_high", "cusum_low",
+        "recent", "side", "run_length", "signals",
+    )
+
+    def __init__(self, low=None, high=None):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last = None
+        self.mr_sum = 0.0
+        self.low = low
+        self.high = high
+        self.center = None
+        self.sigma = None
+        self.ewma = None
+        self.ewma_n = 0
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+        self.recent = deque(maxlen=5)
+        self.side = 0
+        self.run_length = 0
+        self.signals = {}
+
+    @property
+    def std(self):
+        """Overall standard deviation."""
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    @property
+    def sigma_within(self):
+        """Short-term sigma estimated from the average moving range."""
+        return self.mr_sum / (self.n - 1) / _D2 if self.n > 1 else 0.0
+
+    def _capability(self, sigma):
+        if not sigma or (self.low is None and self.high is None):
+            return None
+        sides = []
+        if self.high is not None:
+            sides.append((self.high - self.mean) / (3 * sigma))
+        if self.low is not None:
+            sides.append((self.mean - self.low) / (3 * sigma))
+        return min(sides)
+
+    @property
+    def cpk(self):
+        return self._capability(self.sigma_within)
+
+    @property
+    def ppk(self):
+        return self._capability(self.std)
+
+
+class SpcEngine:
+    """Online SPC of every numeric measurement of a station."""
+
+    def __init__(
+        self,
+        baseline=100,
+        ewma_lambda=0.2,
+        ewma_width=3.0,
+        cusum_k=0.5,
+        cusum_h=5.0,
+        on_signal=None,
+    ):
+        self.baseline = baseline
+        self.ewma_lambda = ewma_lambda
+        self.ewma_width = ewma_width
+        self.cusum_k = cusum_k
+        self.cusum_h = cusum_h
+        self.on_signal = on_signal
+        self.measurements = {}
+        # Pipeline stages with several fixtures observe from several threads
+        self._lock = threading.Lock()
+
+    def observe_run(self, run):
+        """Update the statistics with the steps of a ``create_run`` payload."""
+        signals = []
+        procedure_id = run.get("procedure_id")
+        for step in run.get("steps") or ():
+            value = step.get("measurement_value")
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                signals.extend(
+                    self.observe(
+                        procedure_id,
+                        step["name"],
+                        value,
+                        step.get("limit_low"),
+                        step.get("limit_high"),
+                    )
+                )
+        return signals
+
+    def observe(self, procedure_id, step, value, limit_low=None, limit_high=None):
+        """Add one value and return the signals it raises."""
+        with self._lock:
+            signals = self._observe(procedure_id, step, value, limit_low, limit_high)
+        for signal in signals:
+            logger.warning(
+                "SPC %s on %s/%s: value %r (unit %d)",
+                signal.rule,
+                procedure_id,
+                step,
+                value,
+                signal.index,
+            )
+            if self.on_signal is not None:
+                self.on_signal(signal)
+        return signals
+
+    def _observe(self, procedure_id, step, value, limit_low, limit_high):
+        key = (procedure_id, step)
+        state = self.measurements.get(key)
+        if state is None:
+            state = self.measurements[key] = MeasurementSpc(limit_low, limit_high)
+
+        # Welford update and moving range
+        state.n += 1
+        delta = value - state.mean
+        state.mean += delta / state.n
+        state.m2 += delta * (value - state.mean)
+        if state.last is not None:
+            state.mr_sum += abs(value - state.last)
+        state.last = value
+
+        if state.center is None:
+            if state.n >= self.baseline and state.sigma_within > 0:
+                state.center = state.mean
+                state.sigma = state.sigma_within
+                state.ewma = state.center
+            return []
+
+        rules = self._check(state, value)
+        signals = [Signal(procedure_id, step, rule, value, state.n) for rule in rules]
+        for signal in signals:
+            state.signals[signal.rule] = state.signals.get(signal.rule, 0) + 1
+        return signals
+
+    def _check(self, state, value):
+        rules = []
+        z = (value - state.center) / state.sigma
+
+        # Western Electric rules
+        recent = state.recent
+        recent.append(z)
+        if abs(z) > 3:
+            rules.append("beyond_3_sigma")
+        if z > 2 or z < -2:
+            last3 = list(recent)[-3:]
+            if len(last3) == 3 and sum(1 for x in last3 if x * z > 0 and abs(x) > 2) >= 2:
+                rules.append("2_of_3_beyond_2_sigma")
+        if z > 1 or z < -1:
+            if len(recent) == 5 and sum(1 for x in recent if x * z > 0 and abs(x) > 1) >= 4:
+                rules.append("4_of_5_beyond_1_sigma")
+        side = (z > 0) - (z < 0)
+        if side and side == state.side:
+            state.run_length += 1
+        else:
+            state.side = side
+            state.run_length = 1 if side else 0
+        if state.run_length >= 8:
+            rules.append("8_on_one_side")
+            state.run_length = 0
+
+        # EWMA with the exact, time-varying control limits
+        lam = self.ewma_lambda
+        state.ewma = lam * value + (1 - lam) * state.ewma
+        state.ewma_n += 1
+        width = self.ewma_width * state.sigma * math.sqrt(
+            lam / (2 - lam) * (1 - (1 - lam) ** (2 * state.ewma_n))
+        )
+        if abs(state.ewma - state.center) > width:
+            rules.append("ewma")
+
+        # Tabular CUSUM, in sigma units, restarted after a signal
+        state.cusum_high = max(0.0, state.cusum_high + z - self.cusum_k)
+        state.cusum_low = max(0.0, state.cusum_low - z - self.cusum_k)
+        if state.cusum_high > self.cusum_h:
+            rules.append("cusum_high")
+            state.cusum_high = 0.0
+        if state.cusum_low > self.cusum_h:
+            rules.append("cusum_low")
+            state.cusum_low = 0.0
+        return rules
+
+    def format(self):
+        lines = [
+            f"{'procedure':<10}{'step':<34}{'n':>8}{'mean':>11}{'std':>10}"
+            f"{'Cpk':>7}{'Ppk':>7}  signals"
+        ]
+        for (procedure_id, step), state in sorted(
+            self.measurements.items(), key=lambda item: tuple(map(str, item[0]))
+        ):
+            cpk = f"{state.cpk:7.2f}" if state.cpk is not None else f"{'-':>7}"
+            ppk = f"{state.ppk:7.2f}" if state.ppk is not None else f"{'-':>7}"
+            signals = ", ".join(f"{rule} {count}" for rule, count in state.signals.items())
+            lines.append(
+                f"{str(procedure_id):<10}{step:<34}{state.n:8d}{state.mean:11.3f}"
+                f"{state.std:10.3f}{cpk}{ppk}  {signals}"
+            )
+        return "\n".join(lines)
+
+
+def open_spc():
+    """Return the SPC engine of this station, or ``None`` if SPC is off.
+
+    SPC is on when ``TOFUPILOT_SPC_BASELINE`` is set to the number of units
+    that set the centre and sigma of the control charts.
+    """
+    baseline = os.environ.get("TOFUPILOT_SPC_BASELINE")
+    return SpcEngine(int(baseline)) if baseline else None
@@ -0,0 +1,322 @@
+"""Durable on-disk spool for runs waiting to be uploaded.
+
+``RunSpool.submit`` appends the serialized run to an append-only log and
+returns; a background replayer drains the log to ``create_run``. A station
+therefore keeps testing at full speed while the server is slow or down, and
+runs survive a restart of the station.
+
+The spool directory holds three files:
+
+``runs.log``
+    One JSON line per run: ``{"key": <idempotency key>, "run": {...}}``.
+``cursor``
+    Byte offset in ``runs.log`` up to which every run has been uploaded.
+``acked.log``
+    Keys uploaded since the cursor was last written. The replayer skips
+    these so a restart does not post them again.
+``rejected.log``
+    Dead letters: the spool lines of runs the server refused with a client
+    error (4xx other than 408 and 429), which would be refused again. They
+    are moved out of the way so the runs spooled after them are not held
+    back, and can be replayed by hand once fixed.
+
+Every other failure, a network error or a 5xx during an outage, is retried
+for as long as it takes, every ``retry_interval`` seconds at first and
+backing off to ``max_retry_interval``, so the backlog drains once the
+server is back.
+
+The idempotency key is not sent to ``create_run``, which has no field for
+it: deduplication is on the station's side only, through ``acked.log``. A
+run the server accepted just before a crash, before its key reached
+``acked.log``, is posted again after the restart.
+
+The replayer streams ``runs.log`` from the cursor in small batches, so
+draining a backlog of any size only keeps one batch in memory. Attachments
+are stored as the file paths given to ``create_run``.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from time import perf_counter
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+
+from station.uploads import accepted
+
+logger = logging.getLogger(__name__)
+
+# Result of _post for a run moved to the dead-letter file
+REJECTED = "rejected"
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, timedelta):
+        return {"$timedelta": value.total_seconds()}
+    raise TypeError(f"cannot spool {type(value).__name__}")
+
+
+def _decode(value):
+    if "$datetime" in value:
+        return datetime.fromisoformat(value["$datetime"])
+    if "$timedelta" in value:
+        return timedelta(seconds=value["$timedelta"])
+    return value
+
+
+def dumps(run, key):
+    """Serialize a run and its idempotency key to one spool line."""
+    entry = {"key": key, "run": run}
+    return json.dumps(entry, default=_encode) + "\n"
+
+
+def loads(line):
+    """Return ``(key, run)`` from a spool line."""
+    entry = json.loads(line, object_hook=_decode)
+    return entry["key"], entry["run"]
+
+
+class RunSpool:
+    """Write-ahead log of runs drained to ``create_run`` in the background."""
+
+    def __init__(
+        self,
+        client,
+        directory,
+        workers=4,
+        batch=32,
+        retry_interval=5.0,
+        max_retry_interval=300.0,
+        fsync=False,
+        metrics=None,
+    ):
+        self.client = client
+        self.metrics = metrics
+        self.directory = directory
+        self.workers = workers
+        self.batch = batch
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.fsync = fsync
+        self.uploaded = 0
+        self.rejected = 0
+        os.makedirs(directory, exist_ok=True)
+        self._log_path = os.path.join(directory, "runs.log")
+        self._cursor_path = os.path.join(directory, "cursor")
+        self._acked_path = os.path.join(directory, "acked.log")
+        self._rejected_path = os.path.join(directory, "rejected.log")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drained = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._log = open(self._log_path, "ab")
+        if self._log.tell():
+            with open(self._log_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Terminate a line cut short by a crash
+                    self._log.write(b"\n")
+                    self._log.flush()
+        self._cursor = self._read_cursor()
+        self._acked = self._read_acked()
+        self._thread = threading.Thread(target=self._replay, name="spool", daemon=True)
+        self._thread.start()
+        if metrics is not None:
+            metrics.watch_uploads(self)
+        atexit.register(self.close)
+
+    def submit(self, **run):
+        """Append a run to the spool and return its idempotency key."""
+        key = uuid.uuid4().hex
+        line = dumps(run, key).encode("utf-8")
+        with self._lock:
+            self._log.write(line)
+            self._log.flush()
+            if self.fsync:
+                os.fsync(self._log.fileno())
+        self._wake.set()
+        return key
+
+    def pending_bytes(self):
+        """Return the size of the part of the log not uploaded yet."""
+        with self._lock:
+            return self._log.tell() - self._cursor
+
+    def flush(self, timeout=None):
+        """Wait until the spool is drained; return whether it was."""
+        self._wake.set()
+        with self._drained:
+            return self._drained.wait_for(
+                lambda: self._log.tell() == self._cursor, timeout
+            )
+
+    def close(self, timeout=10.0):
+        """Try to drain the spool, then stop the replayer.
+
+        Runs still in the log when ``timeout`` expires stay on disk and are
+        replayed by the next ``RunSpool`` opened on the same directory.
+        """
+        if self._stop.is_set():
+            return
+        self.flush(timeout)
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._log.close()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_cursor(self):
+        try:
+            with open(self._cursor_path, encoding="utf-8") as f:
+                cursor = int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+        # A crash between truncating the log and resetting the cursor
+        # leaves the cursor past the end of the log
+        return min(cursor, self._log.tell())
+
+    def _read_acked(self):
+        try:
+            with open(self._acked_path, encoding="utf-8") as f:
+                return set(f.read().split())
+        except FileNotFoundError:
+            return set()
+
+    def _commit(self, offset):
+        """Persist the cursor and return whether the log was emptied."""
+        _write_cursor(self._cursor_path, offset)
+        with self._lock:
+            self._cursor = offset
+            self._acked.clear()
+            open(self._acked_path, "w").close()
+            emptied = offset == self._log.tell()
+            if emptied:
+                # Everything is uploaded: start over with an empty log
+                self._log.truncate(0)
+                self._log.seek(0)
+                self._cursor = 0
+                _write_cursor(self._cursor_path, 0)
+            self._drained.notify_all()
+        return emptied
+
+    def _read_batch(self, reader):
+        entries = []
+        while len(entries) < self.batch:
+            line = reader.readline()
+            if not line.endswith(b"\n"):
+                # End of the log, or a line still being written
+                reader.seek(-len(line), os.SEEK_CUR)
+                break
+            try:
+                entry = loads(line)
+            except ValueError:
+                logger.error("skipping corrupt spool line at %d", reader.tell())
+                continue
+            if entry[0] not in self._acked:
+                entries.append(entry)
+        return entries
+
+    def _post(self, entry):
+        """Upload a spooled run; return ``True``, ``False`` or ``REJECTED``."""
+        key, run = entry
+        started = perf_counter()
+        result = None
+        try:
+            result = self.client.create_run(**run)
+            ok = accepted(result)
+        except Exception:
+            logger.exception("create_run raised for spooled run %s", key)
+            ok = False
+        if self.metrics is not None:
+            self.metrics.observe_create_run(perf_counter() - started, ok)
+        if not ok:
+            return REJECTED if _permanent(result) else False
+        return ok
+
+    def _reject(self, entries):
+        """Move runs that will never be accepted to the dead-letter file."""
+        with open(self._rejected_path, "a", encoding="utf-8") as f:
+            for key, run in entries:
+                logger.error(
+                    "spooled run %s rejected by the server, moved to %s",
+                    key,
+                    self._rejected_path,
+                )
+                f.write(dumps(run, key))
+        self.rejected += len(entries)
+
+    def _replay(self):
+        with ThreadPoolExecutor(self.workers) as pool:
+            while True:
+                self._drain(pool)
+                if self._stop.is_set():
+                    return
+                self._wake.wait()
+                self._wake.clear()
+
+    def _drain(self, pool):
+        with open(self._log_path, "rb") as reader:
+            reader.seek(self._cursor)
+            while True:
+                entries = self._read_batch(reader)
+                if entries and not self._upload(pool, entries):
+                    return
+                offset = reader.tell()
+                if offset == self._cursor and not self._acked:
+                    return
+                if self._commit(offset):
+                    return
+
+    def _upload(self, pool, entries):
+        """Upload a batch, retrying failures; return whether all succeeded."""
+        interval = self.retry_interval
+        while entries:
+            results = list(pool.map(self._post, entries))
+            rejected = [entry for entry, ok in zip(entries, results) if ok is REJECTED]
+            if rejected:
+                self._reject(rejected)
+            # Rejected runs are acknowledged too, so the cursor moves past them
+            acked = [entry[0] for entry, ok in zip(entries, results) if ok]
+            if acked:
+                with open(self._acked_path, "a", encoding="utf-8") as f:
+                    f.write("".join(key + "\n" for key in acked))
+                self._acked.update(acked)
+                self.uploaded += len(acked) - len(rejected)
+            entries = [entry for entry, ok in zip(entries, results) if not ok]
+            if entries:
+                logger.warning(
+                    "%d spooled runs failed to upload, retrying in %.0f s",
+                    len(entries),
+                    interval,
+                )
+                if self._stop.wait(interval):
+                    return False
+                # Back off while the failures last
+                interval = min(interval * 2, self.max_retry_interval)
+        return True
+
+
+def _permanent(result):
+    # A client error other than a timeout or throttling fails again on retry
+    status = result.get("status_code") if isinstance(result, dict) else None
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def _write_cursor(path, offset):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,246 @@
+"""Local stand-in for the TofuPilot API.
+
+``StandInServer`` accepts the requests the templates send, from
+``TofuPilotClient.create_run``, the pytest plugin and ``UploadToTofuPilot``,
+answers them like the service does and appends every request to a JSONL
+file. Point a client at it with ``TofuPilotClient(url=server.url)`` or the
+``TOFUPILOT_URL`` environment variable.
+
+To load-test a station offline, the server can inject:
+
+- ``latency`` seconds before every reply, plus up to ``jitter`` seconds,
+- throttling: beyond ``rate`` requests per second (bursts of ``burst``),
+  requests get ``429 Too Many Requests`` with a ``Retry-After`` header,
+- server errors: a share ``error_rate`` of the requests get a 500, 502 or
+  503.
+
+``GET /standin/stats`` returns the counters of the server as JSON.
+
+Usage: python -m station.standin_server [--port 8000] [--record runs.jsonl]
+       [--latency 0.05] [--jitter 0.02] [--rate 10] [--error-rate 0.01]
+(from src/). The URL is printed on the first line of the output.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+import argparse
+import json
+import random
+import threading
+import uuid
+
+_ERRORS = (500, 502, 503)
+
+
+class _Throttle:
+    # Token bucket refilled at ``rate`` tokens per second
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """Return 0 if the request may go through, else seconds to wait."""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        server = self.server.standin
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if self.command == "GET" and self.path == "/standin/stats":
+            self._send(200, server.stats())
+            return
+
+        server.delay()
+        status, reply, headers = server.respond(self.command, self.path, body)
+        server.record(self.command, self.path, status, body)
+        self._send(status, reply, headers)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def _send(self, status, reply, headers=()):
+        data = json.dumps(reply).encode() if reply is not None else b""
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if reply is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer:
+    """Recording TofuPilot API stand-in with latency and failure injection."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        record=None,
+        latency=0.0,
+        jitter=0.0,
+        rate=None,
+        burst=None,
+        error_rate=0.0,
+        seed=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._throttle = _Throttle(rate, burst or max(1, rate)) if rate else None
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._record = open(record, "ab") if record else None
+        self._lock = threading.Lock()
+        self._counters = {"requests": 0, "bytes": 0, "runs": 0, "statuses": {}}
+
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve from a background thread and return the server."""
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="standin-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def close(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+        self._httpd.server_close()
+        if self._record is not None:
+            self._record.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, statuses=dict(self._counters["statuses"]))
+
+    def delay(self):
+        if self.jitter:
+            with self._random_lock:
+                extra = self._random.uniform(0, self.jitter)
+        else:
+            extra = 0.0
+        if self.latency or extra:
+            sleep(self.latency + extra)
+
+    def respond(self, method, path, body):
+        """Return the status, JSON reply and headers of a request."""
+        if self._throttle is not None:
+            wait = self._throttle.take()
+            if wait:
+                retry_after = str(max(1, round(wait)))
+                return 429, {"error": "Too Many Requests"}, [("Retry-After", retry_after)]
+        if self.error_rate:
+            with self._random_lock:
+                if self._random.random() < self.error_rate:
+                    status = self._random.choice(_ERRORS)
+                    return status, {"error": "Injected server error"}, []
+
+        path = path.split("?", 1)[0].rstrip("/")
+        key = str(uuid.uuid4())
+        if method == "PUT":
+            # Attachment bytes sent to the upload URL
+            return 200, None, []
+        if path.endswith("/uploads/initialize"):
+            return 200, {"id": key, "uploadUrl": f"{self.url}/storage/{key}"}, []
+        if path.endswith("/runs"):
+            return 200, {"id": key, "url": f"{self.url}/runs/{key}"}, []
+        return 200, {"success": True}, []
+
+    def record(self, method, path, status, body):
+        entry = {
+            "time": time(),
+            "method": method,
+            "path": path,
+            "status": status,
+            "bytes": len(body),
+        }
+        if body and method != "PUT":
+            try:
+                entry["body"] = json.loads(body)
+            except ValueError:
+                pass
+        with self._lock:
+            counters = self._counters
+            counters["requests"] += 1
+            counters["bytes"] += len(body)
+            counters["statuses"][status] = counters["statuses"].get(status, 0) + 1
+            if status == 200 and method == "POST" and path.rstrip("/").endswith("/runs"):
+                counters["runs"] += 1
+            if self._record is not None:
+                self._record.write(json.dumps(entry).encode() + b"\n")
+                self._record.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local TofuPilot API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--record", help="JSONL file every request is appended to")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--rate", type=float, help="requests per second before 429")
+    parser.add_argument("--burst", type=int)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    server = StandInServer(
+        args.host,
+        args.port,
+        args.record,
+        args.latency,
+        args.jitter,
+        args.rate,
+        args.burst,
+        args.error_rate,
+        args.seed,
+    )
+    print(server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Compiled step-execution engine shared by the python-client templates.
+
+A step table is the list of ``(test, duration)`` tuples the templates have
+always used, where ``test()`` returns
+``(passed, value_measured, unit, limit_low, limit_high)``. ``StepPlan``
+compiles the table once per process and records each executed step into a
+slotted ``StepRecord``; the step dicts expected by ``create_run`` are only
+built when the run is uploaded.
+
+``StepPlan.run`` times every step with ``perf_counter_ns`` and records the
+measured duration in place of the one from the step table, which only
+serves to plan and simulate. Passing a ``StationTrace`` also exports the
+station timeline; passing a ``StationMetrics`` records the run outcome
+under the plan's ``procedure_id`` and the step durations.
+"""
+
+from datetime import datetime, timedelta
+from time import perf_counter_ns, time
+
+
+class StepRecord:
+    """Result of a single executed step."""
+
+    __slots__ = (
+        "name",
+        "started_at",
+        "duration",
+        "step_passed",
+        "measurement_unit",
+        "measurement_value",
+        "limit_low",
+        "limit_high",
+    )
+
+    def __init__(
+        self,
+        name,
+        started_at,
+        duration,
+        step_passed,
+        measurement_unit,
+        measurement_value,
+        limit_low,
+        limit_high,
+    ):
+        self.name = name
+        # Epoch seconds; converted to a datetime only in to_dict()
+        self.started_at = started_at
+        self.duration = duration
+        self.step_passed = step_passed
+        self.measurement_unit = measurement_unit
+        self.measurement_value = measurement_value
+        self.limit_low = limit_low
+        self.limit_high = limit_high
+
+    def to_dict(self):
+        """Return the step in the format expected by ``create_run``."""
+        return {
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at),
+            "duration": self.duration,
+            "step_passed": self.step_passed,
+            "measurement_unit": self.measurement_unit,
+            "measurement_value": self.measurement_value,
+            "limit_low": self.limit_low,
+            "limit_high": self.limit_high,
+        }
+
+    def __repr__(self):
+        return f"StepRecord({self.name!r}, step_passed={self.step_passed!r})"
+
+
+class StepPlan:
+    """A step table compiled into a fixed, reusable execution plan."""
+
+    __slots__ = ("names", "procedure_id", "_steps")
+
+    def __init__(self, tests, procedure_id=None):
+        self._steps = tuple((test, test.__name__, duration) for test, duration in tests)
+        self.names = tuple(name for _, name, _ in self._steps)
+        self.procedure_id = procedure_id
+
+    def __len__(self):
+        return len(self._steps)
+
+    def index(self, name):
+        """Return the position of the step called ``name``."""
+        return self.names.index(name)
+
+    @property
+    def durations(self):
+        """Durations of the steps, as given in the step table."""
+        return tuple(duration for _, _, duration in self._steps)
+
+    def reorder(self, names):
+        """Return a plan running the same steps in the order of ``names``."""
+        if sorted(names) != sorted(self.names):
+            raise ValueError("a new order must name every step of the plan once")
+        steps = {name: (test, duration) for test, name, duration in self._steps}
+        return StepPlan([steps[name] for name in names], self.procedure_id)
+
+    def run(self, fail_fast=True, start=0, previous=None, trace=None, metrics=None):
+        """Execute the plan for one unit.
+
+        With ``fail_fast`` the run stops at the first failing step, otherwise
+        every step is executed. To resume a run, pass the records of an
+        earlier attempt as ``previous`` and the index to restart from as
+        ``start``; the records before ``start`` are kept as they are. Every
+        step is recorded with its measured duration. With a ``trace``, the
+        steps are added to the timeline; with ``metrics``, the run and its
+        steps are counted.
+
+        Returns ``(run_passed, records, failed_index)`` where
+        ``failed_index`` is the index of the first failing step or ``None``.
+        """
+        if metrics is not None:
+            metrics.units_started.inc(self.procedure_id)
+        if trace is not None:
+            with trace.span("run", "plan", steps=len(self._steps) - start):
+                result = self._run(fail_fast, start, previous, trace, metrics)
+        else:
+            result = self._run(fail_fast, start, previous, None, metrics)
+        if metrics is not None:
+            if result[0]:
+                metrics.units_passed.inc(self.procedure_id)
+            else:
+                metrics.units_failed.inc(self.procedure_id)
+        return result
+
+    def _run(self, fail_fast, start, previous, trace, metrics):
+        records = list(previous[:start]) if previous else []
+        append = records.append
+        failed_index = None
+        for position, record in enumerate(records):
+            if not record.step_passed:
+                failed_index = position
+                break
+
+        index = start
+        for test, name, _ in self._steps[start:]:
+            started_at = time()
+            start_ns = perf_counter_ns()
+            result = test()
+            measured_ns = perf_counter_ns()
+            duration = timedelta(microseconds=(measured_ns - start_ns) / 1000)
+            if metrics is not None:
+                metrics.step_seconds.observe((measured_ns - start_ns) / 1e9, name)
+
+            passed, value_measured, unit, limit_low, limit_high = result
+            stop = False
+            if not passed and failed_index is None:
+                failed_index = index
+                stop = fail_fast
+            if trace is not None:
+                validated_ns = perf_counter_ns()
+
+            append(
+                StepRecord(
+                    name,
+                    started_at,
+                    duration,
+                    passed,
+                    unit,
+                    value_measured,
+                    limit_low,
+                    limit_high,
+                )
+            )
+            if trace is not None:
+                trace.step(
+                    name,
+                    start_ns,
+                    measured_ns,
+                    validated_ns,
+                    perf_counter_ns(),
+                    {"passed": passed, "value": value_measured},
+                )
+            if stop:
+                break
+            index += 1
+
+        return failed_index is None, records, failed_index
+
+
+def as_steps(records):
+    """Convert step records to the list of dicts passed to ``create_run``."""
+    return [record.to_dict() for record in records]
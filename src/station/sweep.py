@@ -0,0 +1,143 @@
+"""Frequency sweeps checked against limit-line masks in one vectorized pass.
+
+A sweep is a whole trace, thousands of points taken across a band, kept as
+two NumPy arrays instead of one measurement per frequency. ``LimitMask``
+holds piecewise-linear lower and upper limit lines; ``Sweep.check`` compares
+every point with the interpolated lines at once, and ``Sweep.summary``
+derives the numbers worth a measurement of their own (minimum and maximum in
+band, 3 dB bandwidth, mask violations and the worst margin) without a
+Python loop per frequency.
+
+``Sweep.to_npy`` packs the trace into the ``.npy`` format, frequency and
+value rows of ``float32``, as a compact attachment that
+``Sweep.from_npy`` and ``numpy.load`` read back.
+
+Requires NumPy.
+"""
+
+import io
+
+import numpy as np
+
+
+class LimitLine:
+    """A piecewise-linear limit through ``(frequency, value)`` points.
+
+    The limit only applies between the first and last frequency.
+    """
+
+    def __init__(self, points):
+        points = sorted(points)
+        self.frequencies = np.array([f for f, _ in points], dtype=float)
+        self.values = np.array([v for _, v in points], dtype=float)
+
+    def at(self, frequencies):
+        """Limit at every frequency, NaN where it does not apply."""
+        return np.interp(
+            frequencies, self.frequencies, self.values, left=np.nan, right=np.nan
+        )
+
+
+class LimitMask:
+    """Lower and upper limit lines of a sweep, either of them optional."""
+
+    def __init__(self, lower=None, upper=None):
+        self.lower = LimitLine(lower) if lower else None
+        self.upper = LimitLine(upper) if upper else None
+
+    def margins(self, frequencies, values):
+        """Distance of every point inside the mask, negative where it is out.
+
+        Points without any limit get an infinite margin.
+        """
+        margin = np.full(values.shape, np.inf)
+        if self.lower is not None:
+            below = values - self.lower.at(frequencies)
+            margin = np.fmin(margin, below)
+        if self.upper is not None:
+            above = self.upper.at(frequencies) - values
+            margin = np.fmin(margin, above)
+        return margin
+
+
+class Sweep:
+    """A trace of ``values`` measured at increasing ``frequencies``."""
+
+    def __init__(self, frequencies, values):
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        if self.frequencies.shape != self.values.shape:
+            raise ValueError("a sweep needs one value per frequency")
+
+    def __len__(self):
+        return len(self.frequencies)
+
+    def check(self, mask):
+        """Return the boolean array of the points outside ``mask``."""
+        return mask.margins(self.frequencies, self.values) < 0
+
+    def band(self, low, high):
+        """Values measured between the frequencies ``low`` and ``high``."""
+        start, stop = np.searchsorted(self.frequencies, (low, high), side="left")
+        if stop < len(self.frequencies) and self.frequencies[stop] == high:
+            stop += 1
+        return self.values[start:stop]
+
+    def bandwidth(self, drop=3.0):
+        """Width of the band around the peak within ``drop`` dB of it.
+
+        The edges are interpolated between the points around each crossing;
+        a band reaching the end of the sweep stops there.
+        """
+        f = self.frequencies
+        v = self.values
+        peak = int(np.argmax(v))
+        threshold = v[peak] - drop
+        outside = np.flatnonzero(v < threshold)
+        left = outside[outside < peak]
+        right = outside[outside > peak]
+
+        if len(left):
+            i = left[-1]
+            low = np.interp(threshold, (v[i], v[i + 1]), (f[i], f[i + 1]))
+        else:
+            low = f[0]
+        if len(right):
+            i = right[0]
+            high = np.interp(threshold, (v[i], v[i - 1]), (f[i], f[i - 1]))
+        else:
+            high = f[-1]
+        return float(high - low)
+
+    def summary(self, mask=None, band=None):
+        """Measurements derived from the trace.
+
+        ``band`` is the ``(low, high)`` frequencies the minimum and maximum
+        are taken over, the whole sweep by default.
+        """
+        values = self.band(*band) if band is not None else self.values
+        result = {
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "ripple": float(values.max() - values.min()),
+            "peak_frequency": float(self.frequencies[np.argmax(self.values)]),
+            "bandwidth_3dB": self.bandwidth(3.0),
+        }
+        if mask is not None:
+            margins = mask.margins(self.frequencies, self.values)
+            worst = int(np.argmin(margins))
+            result["violations"] = int(np.count_nonzero(margins < 0))
+            result["worst_margin"] = float(margins[worst])
+            result["worst_frequency"] = float(self.frequencies[worst])
+        return result
+
+    def to_npy(self):
+        """Return the sweep as ``.npy`` bytes of shape ``(2, points)``."""
+        buffer = io.BytesIO()
+        np.save(buffer, np.vstack((self.frequencies, self.values)).astype(np.float32))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_npy(cls, data):
+        frequencies, values = np.load(io.BytesIO(data))
+        return cls(frequencies, values)
@@ -0,0 +1,157 @@
+"""Timeline of a station in the Chrome trace event format.
+
+``StationTrace`` records spans timed with ``perf_counter_ns`` and writes
+them as complete (``"X"``) events to a JSON file that chrome://tracing and
+ui.perfetto.dev open directly. ``StepPlan.run(trace=...)`` adds one span per
+step, split into:
+
+- measurement: the step function itself,
+- validation: reading its result and deciding pass, fail or stop,
+- bookkeeping: recording the step.
+
+``span`` wraps anything else, such as a whole unit or an upload, and
+``openhtf_callback`` turns the phases of an openhtf test record into spans.
+
+The file uses the array format with the closing bracket left out, which the
+viewers accept. Every process appends its own events to it, so the nests of a
+``StationExecutor`` share one timeline, one track per process and thread.
+Events are buffered and written at the end of every top-level span, when
+the buffer fills up and at exit.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter_ns, time_ns
+import atexit
+import json
+import os
+import threading
+
+
+class StationTrace:
+    """Buffered writer of trace events to ``path``."""
+
+    def __init__(self, path, buffer=4096):
+        self.path = path
+        self.buffer = buffer
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "ab") as f:
+            if f.tell() == 0:
+                f.write(b"[\n")
+        # perf_counter_ns is monotonic and shared by the processes of the
+        # machine; the offset turns it into epoch microseconds for the viewer
+        self._offset = time_ns() - perf_counter_ns()
+        self._events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._named = set()
+        if hasattr(os, "register_at_fork"):
+            # A forked nest must not write the events buffered by its parent
+            os.register_at_fork(after_in_child=self._forget)
+        atexit.register(self.flush)
+
+    def _forget(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._named = set()
+
+    def add(self, name, category, start_ns, end_ns, args=None):
+        """Record a span that ran from ``start_ns`` to ``end_ns`` (perf_counter_ns)."""
+        pid = os.getpid()
+        tid = threading.get_native_id()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start_ns + self._offset) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            if (pid, tid) not in self._named:
+                self._named.add((pid, tid))
+                self._events.append({
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": threading.current_thread().name},
+                })
+            self._events.append(event)
+            full = len(self._events) >= self.buffer
+        if full:
+            self.flush()
+
+    @contextmanager
+    def span(self, name, category="station", **args):
+        """Record the block as a span; top-level spans flush the buffer."""
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, perf_counter_ns(), args)
+            self._local.depth = depth
+            if depth == 0:
+                self.flush()
+
+    def step(self, name, start_ns, measured_ns, validated_ns, end_ns, args):
+        """Record a step and its measurement, validation and bookkeeping."""
+        self.add(name, "step", start_ns, end_ns, args)
+        self.add("measurement", "step", start_ns, measured_ns)
+        self.add("validation", "step", measured_ns, validated_ns)
+        self.add("bookkeeping", "step", validated_ns, end_ns)
+
+    def openhtf_callback(self, record):
+        """openhtf output callback adding the phases of a test record.
+
+        openhtf only keeps the wall-clock start and end of every phase in
+        milliseconds, so these spans have millisecond resolution and are
+        not split further.
+        """
+        to_perf_ns = 1_000_000
+        dut = getattr(record, "dut_id", None)
+        self.add(
+            f"test {dut}",
+            "openhtf",
+            record.start_time_millis * to_perf_ns - self._offset,
+            record.end_time_millis * to_perf_ns - self._offset,
+            {"outcome": str(getattr(record.outcome, "name", record.outcome))},
+        )
+        for phase in record.phases:
+            self.add(
+                phase.name,
+                "phase",
+                phase.start_time_millis * to_perf_ns - self._offset,
+                phase.end_time_millis * to_perf_ns - self._offset,
+                {"outcome": str(getattr(phase.outcome, "name", phase.outcome))},
+            )
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return
+        data = "".join(json.dumps(event) + ",\n" for event in events).encode()
+        # One append per flush, so processes sharing the file do not
+        # interleave within an event
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def open_trace():
+    """Return the trace of this station, or ``None`` if tracing is off.
+
+    Tracing is on when ``TOFUPILOT_TRACE`` names the trace file.
+    """
+    path = os.environ.get("TOFUPILOT_TRACE")
+    return StationTrace(path) if path else None
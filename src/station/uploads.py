@@ -0,0 +1,135 @@
+"""Background upload of runs so the test loop does not wait on the network.
+
+``UploadQueue.submit`` takes the same keyword arguments as
+``TofuPilotClient.create_run`` and returns immediately. Runs are handed to a
+bounded queue drained by a small pool of worker threads; when the queue is
+full ``submit`` blocks, which keeps a station from running arbitrarily far
+ahead of a slow server. Pending runs are flushed when the queue is closed or
+the interpreter exits.
+
+Both uploaders accept a ``StationMetrics`` to record how long
+``create_run`` takes.
+"""
+
+from time import perf_counter
+import atexit
+import logging
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def accepted(result):
+    """Return whether a ``create_run`` result reports success.
+
+    The client reports HTTP errors in its return value rather than raising,
+    so a dict with ``success`` set to ``False`` is treated as a failure.
+    """
+    return not (isinstance(result, dict) and result.get("success") is False)
+
+
+class UploadQueue:
+    """Bounded queue of runs uploaded by background worker threads."""
+
+    def __init__(self, client, workers=4, maxsize=64, metrics=None):
+        self.client = client
+        self.metrics = metrics
+        self.uploaded = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if metrics is not None:
+            metrics.watch_uploads(self)
+        atexit.register(self.close)
+
+    def submit(self, **run):
+        """Queue a run for upload, blocking while the queue is full."""
+        if self._closed:
+            raise RuntimeError("upload queue is closed")
+        self._queue.put(run)
+
+    def pending(self):
+        """Return the number of runs waiting in the queue."""
+        return self._queue.qsize()
+
+    def flush(self):
+        """Block until every queued run has been uploaded or has failed."""
+        self._queue.join()
+
+    def close(self):
+        """Flush pending runs and stop the worker threads."""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        atexit.unregister(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _upload(self, run):
+        started = perf_counter()
+        try:
+            ok = accepted(self.client.create_run(**run))
+        except Exception:
+            logger.exception("create_run raised for %s", _describe(run))
+            ok = False
+        else:
+            if not ok:
+                logger.error("create_run was rejected for %s", _describe(run))
+        if self.metrics is not None:
+            self.metrics.observe_create_run(perf_counter() - started, ok)
+        with self._lock:
+            if ok:
+                self.uploaded += 1
+            else:
+                self.failed += 1
+        return ok
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                self._upload(item)
+            finally:
+                self._queue.task_done()
+
+
+def _describe(run):
+    unit = run.get("unit_under_test") or {}
+    return f"{run.get('procedure_id')} {unit.get('serial_number')}"
+
+
+def open_uploader(client, metrics=None):
+    """Return the uploader configured for this station.
+
+    Runs go through a durable ``RunSpool`` when ``TOFUPILOT_SPOOL_DIR`` is
+    set, and through an in-memory ``UploadQueue`` otherwise. ``metrics``, if
+    given, records the uploads.
+    """
+    directory = os.environ.get("TOFUPILOT_SPOOL_DIR")
+    if directory:
+        from station.spool import RunSpool
+
+        return RunSpool(client, directory, metrics=metrics)
+    return UploadQueue(client, metrics=metrics)
@@ -0,0 +1,167 @@
+"""Vectorized Monte Carlo simulation of a procedure's yield and test time.
+
+Instead of running the template loop unit by unit, ``simulate`` draws every
+step outcome for a whole batch of virtual units as one NumPy array and applies
+the fail-fast semantics of ``StepPlan.run`` with array operations. Millions of
+units take seconds.
+
+A step is described by a ``SimStep``: its first-pass probability, its
+duration, and optionally the uniform ranges its measurement is drawn from on
+pass and on fail, as in the templates' step functions. ``station.models``
+holds the models of the templates' procedures.
+
+Requires NumPy.
+
+Usage: python -m station.yield_sim [units] (from src/)
+"""
+
+from datetime import timedelta
+import sys
+
+import numpy as np
+
+from station.models import MOTOR_FVT1, SimStep
+
+
+class StepYield:
+    """Simulated outcome of one step across all virtual units."""
+
+    __slots__ = ("name", "attempted", "failed", "mean", "std")
+
+    def __init__(self, name, attempted, failed, mean=None, std=None):
+        self.name = name
+        self.attempted = attempted
+        self.failed = failed
+        self.mean = mean
+        self.std = std
+
+    @property
+    def fallout(self):
+        """Share of the units reaching this step that fail it."""
+        return self.failed / self.attempted if self.attempted else 0.0
+
+
+class YieldReport:
+    """Per-step fallout, rolled throughput yield and test time of a simulation."""
+
+    def __init__(self, units, passed, steps, total_time, total_time_sq):
+        self.units = units
+        self.passed = passed
+        self.steps = steps
+        if not units:
+            self.mean_test_time = self.std_test_time = 0.0
+            return
+        self.mean_test_time = total_time / units
+        self.std_test_time = np.sqrt(
+            max(total_time_sq / units - self.mean_test_time**2, 0.0)
+        )
+
+    @property
+    def rty(self):
+        """Rolled throughput yield: share of units passing every step."""
+        return self.passed / self.units if self.units else 0.0
+
+    def format(self):
+        lines = [
+            f"{'step':<34}{'attempted':>12}{'failed':>10}{'fallout':>10}"
+            f"{'mean':>10}{'std':>9}"
+        ]
+        for step in self.steps:
+            stats = (
+                f"{step.mean:>10.3f}{step.std:>9.3f}" if step.mean is not None else ""
+            )
+            lines.append(
+                f"{step.name:<34}{step.attempted:>12}{step.failed:>10}"
+                f"{step.fallout:>10.2%}{stats}"
+            )
+        lines.append(f"units: {self.units}  RTY: {self.rty:.2%}")
+        lines.append(
+            f"expected test time: {self.mean_test_time:.2f} s "
+            f"(std {self.std_test_time:.2f} s)"
+        )
+        return "\n".join(lines)
+
+
+def _seconds(duration):
+    if isinstance(duration, timedelta):
+        return duration.total_seconds()
+    return float(duration)
+
+
+def simulate(steps, units=1_000_000, fail_fast=True, seed=None, chunk=250_000):
+    """Simulate ``units`` virtual units through ``steps``.
+
+    With ``fail_fast`` a unit stops at its first failing step, like the
+    ``break`` in the templates; otherwise every step runs. Units are drawn
+    in chunks of ``chunk`` rows to bound memory.
+    """
+    if not steps:
+        # Nothing to fail: every unit passes, in no time
+        return YieldReport(units, units, [], 0.0, 0.0)
+    rng = np.random.default_rng(seed)
+    count = len(steps)
+    probs = np.array([step.passed_prob for step in steps], dtype=np.float64)
+    durations = np.array([_seconds(step.duration) for step in steps])
+    elapsed = np.cumsum(durations)
+
+    attempted = np.zeros(count, dtype=np.int64)
+    failed = np.zeros(count, dtype=np.int64)
+    sums = np.zeros(count)
+    sums_sq = np.zeros(count)
+    passed_units = 0
+    total_time = 0.0
+    total_time_sq = 0.0
+
+    remaining = units
+    while remaining:
+        n = min(chunk, remaining)
+        remaining -= n
+        step_passed = rng.random((n, count)) < probs
+
+        if fail_fast:
+            step_failed = ~step_passed
+            has_failed = step_failed.any(axis=1)
+            first_failed = step_failed.argmax(axis=1)
+            executed = np.where(has_failed, first_failed + 1, count)
+            # Units that executed at least j + 1 steps attempted step j
+            reached = np.bincount(executed, minlength=count + 1)
+            attempted += reached[::-1].cumsum()[::-1][1:]
+            failed += np.bincount(first_failed[has_failed], minlength=count)
+            ran = np.arange(count) < executed[:, None]
+        else:
+            has_failed = ~step_passed.all(axis=1)
+            executed = np.full(n, count)
+            attempted += n
+            failed += n - step_passed.sum(axis=0)
+            ran = None
+
+        passed_units += n - int(has_failed.sum())
+        unit_time = elapsed[executed - 1]
+        total_time += float(unit_time.sum())
+        total_time_sq += float(np.square(unit_time).sum())
+
+        for j, step in enumerate(steps):
+            if step.pass_range is None:
+                continue
+            values = np.where(
+                step_passed[:, j],
+                rng.uniform(*step.pass_range, size=n),
+                rng.uniform(*(step.fail_range or step.pass_range), size=n),
+            )
+            if ran is not None:
+                values = values[ran[:, j]]
+            sums[j] += values.sum()
+            sums_sq[j] += np.square(values).sum()
+
+    results = []
+    for j, step in enumerate(steps):
+        mean = std = None
+        if step.pass_range is not None and attempted[j]:
+            mean = sums[j] / attempted[j]
+            std = float(np.sqrt(max(sums_sq[j] / attempted[j] - mean**2, 0.0)))
+        results.append(StepYield(step.name, int(attempted[j]), int(failed[j]), mean, std))
+    return YieldReport(units, passed_units, results, total_time, total_time_sq)
+
+
+if __name__ == "__main__":
+    print(simulate(MOTOR_FVT1, int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000).format())